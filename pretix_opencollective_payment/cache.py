@@ -0,0 +1,182 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from pretix.multidomain.urlreverse import get_event_domain
+
+from . import metrics
+from .conf import plugin_setting
+from .opencollective import CONFIRMED_ORDER_STATUSES
+
+DEFAULT_ORDER_CACHE_TTL = 600
+DEFAULT_ORDER_CACHE_PENDING_TTL = 10
+VERIFICATION_STATE_TTL = 600
+DEFAULT_SINGLE_FLIGHT_TIMEOUT = 20
+SINGLE_FLIGHT_RESULT_TTL = 5
+SINGLE_FLIGHT_POLL_INTERVAL = 0.1
+DONATION_URL_MEMO_SIZE = 1024
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_donation_urls = {}
+_donation_urls_lock = threading.Lock()
+
+
+def order_cache_timeout(status):
+    if status in CONFIRMED_ORDER_STATUSES:
+        return plugin_setting("ORDER_CACHE_TTL", DEFAULT_ORDER_CACHE_TTL)
+    # Pending and failed orders may still change, so they are only kept long
+    # enough to absorb reloads and duplicate redirects.
+    return plugin_setting("ORDER_CACHE_PENDING_TTL", DEFAULT_ORDER_CACHE_PENDING_TTL)
+
+
+def donation_url_parts(event, config, slug, cart_namespace, build):
+    # The key covers everything the URL is built from, so moving the event or
+    # saving different settings makes old templates unreachable without
+    # explicit invalidation.
+    key = (
+        event.pk,
+        event.organizer.slug,
+        event.slug,
+        get_event_domain(event, fallback=True),
+        config.base_url,
+        slug,
+        cart_namespace,
+    )
+    parts = _donation_urls.get(key)
+    if parts is None:
+        parts = build()
+        with _donation_urls_lock:
+            if len(_donation_urls) >= DONATION_URL_MEMO_SIZE:
+                _donation_urls.clear()
+            _donation_urls[key] = parts
+    return parts
+
+
+def clear_donation_urls():
+    with _donation_urls_lock:
+        _donation_urls.clear()
+
+
+class OrderCache:
+    def __init__(self, event, use_staging):
+        environment = "staging" if use_staging else "live"
+        self.namespace = f"{event.pk}:{environment}"
+
+    def key(self, kind, reference):
+        raw = json.dumps(reference, sort_keys=True, default=str)
+        digest = hashlib.sha1(f"{kind}:{raw}".encode()).hexdigest()
+        return f"pretix_opencollective_order:{self.namespace}:{digest}"
+
+    def get(self, kind, reference):
+        order_data = cache.get(self.key(kind, reference))
+        metrics.incr("order_cache_hit" if order_data else "order_cache_miss")
+        return order_data
+
+    def set(self, kind, reference, order_data):
+        timeout = order_cache_timeout(order_data.get("status"))
+        if not timeout:
+            return
+        entries = {self.key(kind, reference): order_data}
+        # Also index the order under its own ids, so a transaction lookup
+        # followed by an order lookup for the same order hits the cache.
+        if order_data.get("id"):
+            entries[self.key("order", {"id": order_data["id"]})] = order_data
+        if order_data.get("legacyId"):
+            entries[self.key("order", {"legacyId": int(order_data["legacyId"])})] = (
+                order_data
+            )
+        cache.set_many(entries, timeout)
+
+    def delete(self, kind, reference):
+        cache.delete(self.key(kind, reference))
+
+
+def _verification_key(token):
+    return f"pretix_opencollective_verification:{token}"
+
+
+def get_verification_state(token):
+    return cache.get(_verification_key(token))
+
+
+def set_verification_state(token, state):
+    cache.set(_verification_key(token), state, VERIFICATION_STATE_TTL)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, func, timeout=None):
+    timeout = timeout or plugin_setting(
+        "SINGLE_FLIGHT_TIMEOUT", DEFAULT_SINGLE_FLIGHT_TIMEOUT
+    )
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(timeout):
+            metrics.incr("single_flight_shared")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        return func()
+
+    try:
+        flight.result = _shared_flight(key, func, timeout)
+        return flight.result
+    except Exception as exc:
+        flight.error = exc
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+
+def _shared_flight(key, func, timeout):
+    lock_key = f"pretix_opencollective_flight:{key}:lock"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout):
+        try:
+            result = func()
+            cache.set(
+                f"pretix_opencollective_flight:{key}:result:{token}",
+                {"result": result},
+                SINGLE_FLIGHT_RESULT_TTL,
+            )
+            return result
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # Another worker is already on it: wait for the result of exactly that
+    # call, and only do the work ourselves if it gave up or failed. Results of
+    # earlier calls are never picked up, as every leader stores its own.
+    leader = cache.get(lock_key)
+    if leader is None:
+        return func()
+    result_key = f"pretix_opencollective_flight:{key}:result:{leader}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # The lock is checked first: once released, the result is either
+        # stored already or the leader failed.
+        released = cache.get(lock_key) != leader
+        shared = cache.get(result_key)
+        if shared is not None:
+            metrics.incr("single_flight_shared")
+            return shared["result"]
+        if released:
+            break
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    return func()
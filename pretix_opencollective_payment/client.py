@@ -0,0 +1,416 @@
+import contextlib
+import contextvars
+import os
+import random
+import threading
+import time
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.core.cache import cache
+from requests import ConnectionError, HTTPError, RequestException, Timeout
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .conf import plugin_setting
+from .opencollective import (
+    OC_GRAPHQL_BASEURL,
+    OC_GRAPHQL_STAGING_BASEURL,
+    OC_LEGACY_API_BASEURL,
+    OC_LEGACY_API_STAGING_BASEURL,
+)
+
+DEFAULT_POOL_SIZE = 10
+
+DEFAULT_GRAPHQL_TIMEOUT = (3.05, 10)
+DEFAULT_LEGACY_TIMEOUT = (3.05, 5)
+
+DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 30
+
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_RETRY_MAX_DELAY = 5
+DEFAULT_RATE_LIMIT = 90
+RATE_LIMIT_WINDOW = 10
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+PERSISTED_QUERY_NOT_FOUND = {"PERSISTED_QUERY_NOT_FOUND", "PersistedQueryNotFound"}
+PERSISTED_QUERY_NOT_SUPPORTED = {
+    "PERSISTED_QUERY_NOT_SUPPORTED",
+    "PersistedQueryNotSupported",
+}
+PERSISTED_QUERY_DISABLED_TIMEOUT = 86400
+
+
+class CircuitOpenError(RequestException):
+    pass
+
+
+class RateLimitExceeded(RequestException):
+    pass
+
+
+class RequestCounter:
+    def __init__(self):
+        self.count = 0
+
+
+# Context variables are per thread, so concurrent requests served by the same
+# process are never charged to somebody else's counter.
+_request_counters = contextvars.ContextVar(
+    "opencollective_request_counters", default=()
+)
+
+
+@contextlib.contextmanager
+def count_requests():
+    counter = RequestCounter()
+    token = _request_counters.set(_request_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _request_counters.reset(token)
+
+
+_sessions = {}
+_pool_sizes = {}
+_sessions_pid = os.getpid()
+_sessions_lock = threading.Lock()
+
+
+def _endpoint_key(url):
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _api_name(url):
+    return "graphql" if "/graphql" in urllib.parse.urlsplit(url).path else "legacy"
+
+
+def _build_session(pool_size):
+    # send_request owns retries, so that every attempt is rate limited,
+    # measured and seen by the circuit breaker.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    global _sessions_pid
+    key = _endpoint_key(url)
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # Sockets must not be shared with the parent of a forked worker.
+            _sessions.clear()
+            _pool_sizes.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(key)
+        if session is None:
+            pool_size = plugin_setting("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+            session = _sessions[key] = _build_session(pool_size)
+            _pool_sizes[key] = pool_size
+    return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _pool_sizes.clear()
+
+
+def pool_stats():
+    with _sessions_lock:
+        sessions = [
+            (key, session, _pool_sizes[key]) for key, session in _sessions.items()
+        ]
+    stats = {}
+    for key, session, maxsize in sessions:
+        entry = {"maxsize": maxsize, "in_use": 0, "connections_opened": 0}
+        pools = session.get_adapter(key).poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None or pool.pool is None:
+                continue
+            # The queue holds a slot for every connection that is not checked out.
+            entry["in_use"] += maxsize - pool.pool.qsize()
+            entry["connections_opened"] += pool.num_connections
+        stats[key] = entry
+    return stats
+
+
+def _pool_gauges():
+    for endpoint, entry in pool_stats().items():
+        yield "http_pool_size", {"endpoint": endpoint}, entry["maxsize"]
+        yield "http_pool_in_use", {"endpoint": endpoint}, entry["in_use"]
+
+
+metrics.register_gauges(_pool_gauges, per_worker=True)
+
+
+def graphql_timeout():
+    return plugin_setting("GRAPHQL_TIMEOUT", DEFAULT_GRAPHQL_TIMEOUT)
+
+
+def legacy_timeout():
+    return plugin_setting("LEGACY_TIMEOUT", DEFAULT_LEGACY_TIMEOUT)
+
+
+def _persisted_query_key(url):
+    return f"pretix_opencollective_apq_disabled:{_endpoint_key(url)}"
+
+
+def persisted_queries_enabled(url):
+    if not plugin_setting("PERSISTED_QUERIES", True):
+        return False
+    return not cache.get(_persisted_query_key(url))
+
+
+def disable_persisted_queries(url):
+    cache.set(_persisted_query_key(url), True, PERSISTED_QUERY_DISABLED_TIMEOUT)
+
+
+def persisted_query_codes(payload):
+    return {
+        (error.get("extensions") or {}).get("code") or error.get("message")
+        for error in (payload or {}).get("errors") or []
+    }
+
+
+def is_upstream_failure(exc):
+    if isinstance(exc, (ConnectionError, Timeout)):
+        return True
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    def __init__(self, url):
+        # The GraphQL and the legacy API fail independently, so timeouts of
+        # one must not cut off the other on the same host.
+        self.endpoint = _endpoint_key(url)
+        self.api = _api_name(url)
+        prefix = f"pretix_opencollective_circuit:{self.endpoint}:{self.api}"
+        self._failures_key = f"{prefix}:failures"
+        self._opened_key = f"{prefix}:opened"
+        self._probe_key = f"{prefix}:probe"
+
+    @property
+    def reset_timeout(self):
+        return plugin_setting("CIRCUIT_RESET_TIMEOUT", DEFAULT_CIRCUIT_RESET_TIMEOUT)
+
+    def allow_request(self):
+        opened = cache.get(self._opened_key)
+        if opened is None:
+            return True
+        if time.time() - opened < self.reset_timeout:
+            return False
+        # Half-open: a single worker gets to probe whether Open Collective
+        # has recovered, everybody else keeps failing fast meanwhile.
+        return cache.add(self._probe_key, True, self.reset_timeout)
+
+    def record_success(self):
+        cache.delete(self._failures_key)
+        cache.delete(self._opened_key)
+        cache.delete(self._probe_key)
+
+    def record_failure(self):
+        if cache.get(self._opened_key) is not None:
+            # A failed half-open probe reopens the circuit.
+            cache.set(self._opened_key, time.time(), None)
+            cache.delete(self._probe_key)
+            return
+        cache.add(self._failures_key, 0, None)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            failures = 1
+            cache.set(self._failures_key, failures, None)
+        threshold = plugin_setting(
+            "CIRCUIT_FAILURE_THRESHOLD", DEFAULT_CIRCUIT_FAILURE_THRESHOLD
+        )
+        if failures >= threshold:
+            cache.set(self._opened_key, time.time(), None)
+
+    def state(self):
+        opened = cache.get(self._opened_key)
+        if opened is None:
+            state = "closed"
+        elif time.time() - opened < self.reset_timeout:
+            state = "open"
+        else:
+            state = "half_open"
+        return {
+            "state": state,
+            "failures": cache.get(self._failures_key) or 0,
+            "opened_at": opened,
+        }
+
+
+def circuit_states():
+    states = {}
+    for url in (
+        OC_GRAPHQL_BASEURL,
+        OC_LEGACY_API_BASEURL,
+        OC_GRAPHQL_STAGING_BASEURL,
+        OC_LEGACY_API_STAGING_BASEURL,
+    ):
+        breaker = CircuitBreaker(url)
+        states.setdefault(breaker.endpoint, {})[breaker.api] = breaker.state()
+    return states
+
+
+def _circuit_gauges():
+    for endpoint, apis in circuit_states().items():
+        for api, state in apis.items():
+            labels = {"endpoint": endpoint, "api": api}
+            for name in ("closed", "open", "half_open"):
+                yield "circuit_state", {**labels, "state": name}, int(
+                    state["state"] == name
+                )
+            yield "circuit_failures", labels, state["failures"]
+
+
+metrics.register_gauges(_circuit_gauges)
+
+
+def _retry_after(response):
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+    value = response.headers.get("X-RateLimit-Reset") or response.headers.get(
+        "RateLimit-Reset"
+    )
+    if value:
+        try:
+            reset = float(value)
+        except ValueError:
+            return None
+        # Some servers send an epoch timestamp, others the seconds remaining.
+        return reset - time.time() if reset > 1_000_000_000 else reset
+    return None
+
+
+def retry_delay(attempt, response=None):
+    delay = _retry_after(response)
+    if delay is None:
+        backoff = plugin_setting("RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF)
+        delay = random.uniform(0, backoff * 2**attempt)
+    return max(delay, 0)
+
+
+def _is_retryable(exc):
+    if isinstance(exc, (ConnectionError, Timeout)):
+        return True
+    return (
+        exc.response is not None and exc.response.status_code in RETRYABLE_STATUS_CODES
+    )
+
+
+class RateLimiter:
+    def __init__(self, url):
+        self.prefix = f"pretix_opencollective_ratelimit:{_endpoint_key(url)}"
+
+    def acquire(self, max_wait):
+        rate = plugin_setting("RATE_LIMIT", DEFAULT_RATE_LIMIT)
+        if not rate:
+            return True
+        # Requests per minute are spread over short windows counted with an
+        # atomic cache increment, which works the same on every cache backend.
+        limit = max(1, rate * RATE_LIMIT_WINDOW // 60)
+        deadline = time.monotonic() + max_wait
+        while True:
+            window = int(time.time() // RATE_LIMIT_WINDOW)
+            key = f"{self.prefix}:{window}"
+            cache.add(key, 0, RATE_LIMIT_WINDOW * 2)
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                count = 1
+                cache.set(key, count, RATE_LIMIT_WINDOW * 2)
+            if count <= limit:
+                return True
+            wait = (window + 1) * RATE_LIMIT_WINDOW - time.time()
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def _record_attempt(url, response, started):
+    if not metrics.enabled():
+        return
+    api = _api_name(url)
+    metrics.observe("upstream_request_seconds", time.perf_counter() - started, api=api)
+    status = getattr(response, "status_code", None)
+    metrics.incr("upstream_responses", api=api, status=status or "error")
+    if response is None:
+        return
+    request = getattr(response, "request", None)
+    body = getattr(request, "body", None)
+    if body:
+        metrics.incr("upstream_sent_bytes", len(body), api=api)
+    content = getattr(response, "content", None)
+    if content:
+        metrics.incr("upstream_received_bytes", len(content), api=api)
+
+
+def send_request(method, url, idempotent=True, **kwargs):
+    breaker = CircuitBreaker(url)
+    if not breaker.allow_request():
+        metrics.incr("circuit_rejected")
+        raise CircuitOpenError(
+            f"Circuit for the {breaker.api} API at {breaker.endpoint} is open"
+        )
+
+    limiter = RateLimiter(url)
+    max_retries = (
+        plugin_setting("MAX_RETRIES", DEFAULT_MAX_RETRIES) if idempotent else 0
+    )
+    max_delay = plugin_setting("RETRY_MAX_DELAY", DEFAULT_RETRY_MAX_DELAY)
+    attempt = 0
+    while True:
+        if not limiter.acquire(max_delay):
+            metrics.incr("api_throttled")
+            raise RateLimitExceeded(f"Rate limit for {breaker.endpoint} reached")
+        metrics.incr("api_requests")
+        for counter in _request_counters.get():
+            counter.count += 1
+        started = time.perf_counter()
+        response = None
+        try:
+            response = get_session(url).request(method, url, **kwargs)
+            response.raise_for_status()
+        except RequestException as exc:
+            _record_attempt(
+                url, exc.response if exc.response is not None else response, started
+            )
+            if exc.response is not None and exc.response.status_code == 429:
+                metrics.incr("api_throttled")
+            delay = retry_delay(attempt, exc.response)
+            if attempt < max_retries and _is_retryable(exc) and delay <= max_delay:
+                attempt += 1
+                metrics.incr("api_retries")
+                time.sleep(delay)
+                continue
+            if is_upstream_failure(exc):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        _record_attempt(url, response, started)
+        breaker.record_success()
+        return response
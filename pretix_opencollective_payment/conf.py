@@ -0,0 +1,5 @@
+from django.conf import settings
+
+
+def plugin_setting(name, default):
+    return getattr(settings, f"OPENCOLLECTIVE_{name}", default)
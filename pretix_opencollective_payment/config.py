@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from functools import cached_property
+
+from .opencollective import (
+    OC_BASEURL,
+    OC_GRAPHQL_BASEURL,
+    OC_GRAPHQL_STAGING_BASEURL,
+    OC_LEGACY_API_BASEURL,
+    OC_LEGACY_API_STAGING_BASEURL,
+    OC_STAGING_BASEURL,
+)
+
+ROUTING_KINDS = ("product", "subevent", "channel")
+
+
+def normalize_slug(slug):
+    return slug.strip("/") if slug else slug
+
+
+def parse_routing_rules(text):
+    rules = []
+    for line_number, line in enumerate((text or "").splitlines(), start=1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        match, has_target, slug = line.partition("=")
+        kind, has_key, key = match.partition(":")
+        kind, key = kind.strip().lower(), key.strip()
+        slug = normalize_slug(slug.strip())
+        if not (has_target and has_key and kind in ROUTING_KINDS and key and slug):
+            raise ValueError(line_number)
+        rules.append((kind, key, slug))
+    return tuple(rules)
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    token: str
+    collective_slug: str
+    event_slug: str
+    use_staging: bool
+    async_verification: bool
+    webhook_secret: str
+    recipient_email: str
+    routing_rules: tuple = ()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            token=settings.get("token") or "",
+            collective_slug=settings.get("collective_slug") or "",
+            event_slug=settings.get("event_slug") or "",
+            use_staging=bool(settings.get("use_staging", as_type=bool)),
+            async_verification=bool(settings.get("async_verification", as_type=bool)),
+            webhook_secret=settings.get("webhook_secret") or "",
+            recipient_email=settings.get("recipient_email") or "",
+            routing_rules=parse_routing_rules(settings.get("routing_rules")),
+        )
+
+    @property
+    def primary_slug(self):
+        return self.event_slug or self.collective_slug
+
+    @cached_property
+    def routes(self):
+        # (kind, key) -> (rule position, slug), so a position is routed with a
+        # few dict lookups and the earliest matching rule still wins.
+        index = {}
+        for position, (kind, key, slug) in enumerate(self.routing_rules):
+            index.setdefault((kind, key), (position, slug))
+        return index
+
+    @cached_property
+    def routed_slugs(self):
+        return frozenset(slug for _, _, slug in self.routing_rules)
+
+    @cached_property
+    def slugs(self):
+        return self.routed_slugs | frozenset(
+            normalize_slug(slug)
+            for slug in (self.event_slug, self.collective_slug)
+            if slug
+        )
+
+    def route(self, positions, channel=None):
+        if not self.routes:
+            return {self.primary_slug}
+        channel_route = self.routes.get(("channel", str(channel)))
+        targets = set()
+        for item_id, subevent_id in positions:
+            matches = [
+                self.routes.get(("product", str(item_id))),
+                (
+                    self.routes.get(("subevent", str(subevent_id)))
+                    if subevent_id
+                    else None
+                ),
+                channel_route,
+            ]
+            matches = [match for match in matches if match]
+            targets.add(min(matches)[1] if matches else self.primary_slug)
+        return targets or {channel_route[1] if channel_route else self.primary_slug}
+
+    def account_slug(self, target_slug):
+        if target_slug in self.routed_slugs:
+            return target_slug
+        return normalize_slug(self.collective_slug)
+
+    @property
+    def base_url(self):
+        return OC_STAGING_BASEURL if self.use_staging else OC_BASEURL
+
+    @property
+    def graphql_url(self):
+        return OC_GRAPHQL_STAGING_BASEURL if self.use_staging else OC_GRAPHQL_BASEURL
+
+    @property
+    def legacy_api_url(self):
+        return (
+            OC_LEGACY_API_STAGING_BASEURL if self.use_staging else OC_LEGACY_API_BASEURL
+        )
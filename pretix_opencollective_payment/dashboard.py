@@ -0,0 +1,123 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import OpenCollectivePaymentSummary
+from .opencollective import CONFIRMED_ORDER_STATUSES
+
+DASHBOARD_CACHE_TTL = 300
+DEFAULT_PAGE_SIZE = 50
+
+
+def _aggregate_key(event_id):
+    return f"pretix_opencollective_dashboard:{event_id}"
+
+
+def summary_fields(payment, order_data=None, rejection=None):
+    info_data = payment.info_data if payment.info else {}
+    order_data = order_data or {}
+    amount_data = (
+        order_data.get("totalAmount")
+        or order_data.get("amount")
+        or info_data.get("amount")
+        or {}
+    )
+    amount = None
+    if amount_data.get("value") is not None:
+        amount = Decimal(str(amount_data["value"]))
+    currency = amount_data.get("currency") or ""
+    return {
+        "event_id": payment.order.event.pk,
+        "order_id": str(
+            order_data.get("legacyId")
+            or order_data.get("id")
+            or info_data.get("order_id")
+            or ""
+        ),
+        "transaction_id": str(info_data.get("transaction_id") or ""),
+        "status": order_data.get("status") or info_data.get("status") or "",
+        "amount": amount,
+        "currency": currency,
+        "amount_mismatch": amount is not None
+        and (amount != payment.amount or currency != payment.order.event.currency),
+        "rejection": rejection or "",
+        "collective_slug": info_data.get("collective_slug") or "",
+        "use_staging": bool(info_data.get("use_staging")),
+    }
+
+
+def summarize_payment(payment, order_data=None, rejection=None):
+    fields = summary_fields(payment, order_data, rejection)
+    OpenCollectivePaymentSummary.objects.update_or_create(
+        payment=payment, defaults=fields
+    )
+    cache.delete(_aggregate_key(fields["event_id"]))
+
+
+def _empty_aggregate():
+    return {"payments": 0, "mismatches": 0, "statuses": {}, "received": {}}
+
+
+def _compute_aggregates(event_ids):
+    aggregates = {event_id: _empty_aggregate() for event_id in event_ids}
+    rows = (
+        OpenCollectivePaymentSummary.objects.filter(event_id__in=event_ids)
+        .values("event_id", "status", "currency", "amount_mismatch")
+        .annotate(count=Count("id"), total=Sum("amount"))
+        .order_by()
+    )
+    for row in rows:
+        aggregate = aggregates[row["event_id"]]
+        aggregate["payments"] += row["count"]
+        if row["amount_mismatch"]:
+            aggregate["mismatches"] += row["count"]
+        status = row["status"] or "UNKNOWN"
+        aggregate["statuses"][status] = (
+            aggregate["statuses"].get(status, 0) + row["count"]
+        )
+        if row["status"] in CONFIRMED_ORDER_STATUSES and row["total"] is not None:
+            received = Decimal(aggregate["received"].get(row["currency"], "0"))
+            aggregate["received"][row["currency"]] = str(received + row["total"])
+    return aggregates
+
+
+def event_aggregates(event_ids):
+    keys = {event_id: _aggregate_key(event_id) for event_id in event_ids}
+    cached = cache.get_many(list(keys.values()))
+    aggregates = {
+        event_id: cached[key] for event_id, key in keys.items() if key in cached
+    }
+    missing = [event_id for event_id in event_ids if event_id not in aggregates]
+    if missing:
+        computed = _compute_aggregates(missing)
+        cache.set_many(
+            {keys[event_id]: computed[event_id] for event_id in missing},
+            DASHBOARD_CACHE_TTL,
+        )
+        aggregates.update(computed)
+    return aggregates
+
+
+def merge_aggregates(aggregates):
+    merged = _empty_aggregate()
+    for aggregate in aggregates:
+        merged["payments"] += aggregate["payments"]
+        merged["mismatches"] += aggregate["mismatches"]
+        for status, count in aggregate["statuses"].items():
+            merged["statuses"][status] = merged["statuses"].get(status, 0) + count
+        for currency, total in aggregate["received"].items():
+            merged["received"][currency] = merged["received"].get(
+                currency, Decimal("0")
+            ) + Decimal(total)
+    return merged
+
+
+def keyset_page(queryset, after=None, size=DEFAULT_PAGE_SIZE):
+    # Newest first, continuing below the last id of the previous page, so deep
+    # pages cost the same as the first one.
+    if after:
+        queryset = queryset.filter(pk__lt=after)
+    rows = list(queryset.order_by("-pk")[: size + 1])
+    next_cursor = rows[size - 1].pk if len(rows) > size else None
+    return rows[:size], next_cursor
@@ -0,0 +1,132 @@
+import json
+import tempfile
+
+from django.utils.translation import gettext_lazy as _
+from pretix.base.exporter import BaseExporter, ListExporter
+from pretix.base.models import OrderPayment
+
+from .info import compact_info
+from .payment import OpenCollectivePaymentProvider
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    ("event", _("Event")),
+    ("order", _("Order code")),
+    ("payment", _("Payment")),
+    ("created", _("Payment date")),
+    ("state", _("Payment state")),
+    ("amount", _("Amount")),
+    ("currency", _("Currency")),
+    ("oc_order_id", _("Open Collective order ID")),
+    ("oc_order_v2_id", _("Open Collective order ID (GraphQL)")),
+    ("oc_transaction_id", _("Open Collective transaction ID")),
+    ("oc_status", _("Open Collective status")),
+    ("oc_amount", _("Open Collective amount")),
+    ("oc_currency", _("Open Collective currency")),
+    ("from_account_slug", _("Contributor profile")),
+    ("from_account_name", _("Contributor name")),
+)
+
+
+def payment_export_rows(events, chunk_size=EXPORT_CHUNK_SIZE):
+    # Plain value tuples from a server-side cursor: no model instances and
+    # never more than one chunk in memory, however large the organizer is.
+    payments = (
+        OrderPayment.objects.filter(
+            order__event__in=events,
+            provider=OpenCollectivePaymentProvider.identifier,
+        )
+        .order_by("pk")
+        .values_list(
+            "order__event__slug",
+            "order__event__currency",
+            "order__code",
+            "local_id",
+            "created",
+            "state",
+            "amount",
+            "info",
+        )
+    )
+    for (
+        event_slug,
+        currency,
+        order_code,
+        local_id,
+        created,
+        state,
+        amount,
+        info,
+    ) in payments.iterator(chunk_size=chunk_size):
+        try:
+            info_data = compact_info(json.loads(info)) if info else {}
+        except ValueError:
+            info_data = {}
+        oc_amount = info_data.get("amount") or {}
+        from_account = info_data.get("from_account") or {}
+        yield {
+            "event": event_slug,
+            "order": order_code,
+            "payment": f"{order_code}-P-{local_id}",
+            "created": created.isoformat() if created else None,
+            "state": state,
+            "amount": str(amount),
+            "currency": currency,
+            "oc_order_id": info_data.get("order_id"),
+            "oc_order_v2_id": info_data.get("order_v2_id"),
+            "oc_transaction_id": info_data.get("transaction_id"),
+            "oc_status": info_data.get("status"),
+            "oc_amount": oc_amount.get("value"),
+            "oc_currency": oc_amount.get("currency"),
+            "from_account_slug": from_account.get("slug"),
+            "from_account_name": from_account.get("name"),
+        }
+
+
+class OpenCollectivePaymentExporter(ListExporter):
+    identifier = "opencollective_payments"
+    verbose_name = _("Open Collective payments")
+    description = _(
+        "Open Collective order, transaction, status, contributor and amount of "
+        "every Open Collective payment."
+    )
+
+    def iterate_list(self, form_data):
+        yield [str(label) for key, label in EXPORT_COLUMNS]
+        for row in payment_export_rows(self.events):
+            yield [
+                "" if row[key] is None else row[key] for key, label in EXPORT_COLUMNS
+            ]
+
+    def get_filename(self):
+        if self.is_multievent:
+            return f"{self.organizer.slug}_opencollective_payments"
+        return f"{self.event.slug}_opencollective_payments"
+
+
+class OpenCollectivePaymentJSONExporter(BaseExporter):
+    identifier = "opencollective_payments_json"
+    verbose_name = _("Open Collective payments (JSON)")
+    description = OpenCollectivePaymentExporter.description
+
+    def render(self, form_data, output_file=None):
+        name = self.organizer.slug if self.is_multievent else self.event.slug
+        filename = f"{name}_opencollective_payments.json"
+        if output_file is not None:
+            self._write(output_file)
+            return filename, "application/json", None
+        # Without a file from pretix, rows are still streamed to disk first, so
+        # the finished document is only held in memory once.
+        with tempfile.TemporaryFile() as output:
+            self._write(output)
+            output.seek(0)
+            return filename, "application/json", output.read()
+
+    def _write(self, output):
+        output.write(b"[")
+        for index, row in enumerate(payment_export_rows(self.events)):
+            if index:
+                output.write(b",")
+            output.write(b"\n" + json.dumps(row).encode())
+        output.write(b"\n]\n")
@@ -0,0 +1,68 @@
+INFO_VERSION = 2
+
+
+def _contribution_transactions(order_data):
+    return [
+        {
+            "id": transaction.get("id"),
+            "legacyId": transaction.get("legacyId"),
+            "kind": transaction.get("kind"),
+            "type": transaction.get("type"),
+        }
+        for transaction in order_data.get("transactions") or []
+        if transaction.get("kind") == "CONTRIBUTION"
+        and transaction.get("type") == "CREDIT"
+    ][:1]
+
+
+def compact_order(order_data):
+    from_account = order_data.get("fromAccount") or {}
+    return {
+        "id": order_data.get("id"),
+        "legacyId": order_data.get("legacyId"),
+        "status": order_data.get("status"),
+        "frequency": order_data.get("frequency"),
+        "totalAmount": order_data.get("totalAmount") or order_data.get("amount"),
+        "toAccount": {"slug": (order_data.get("toAccount") or {}).get("slug")},
+        "fromAccount": {
+            "slug": from_account.get("slug"),
+            "name": from_account.get("name"),
+        },
+        "transactions": _contribution_transactions(order_data),
+    }
+
+
+def build_info(order_data, **fields):
+    amount = order_data.get("totalAmount") or order_data.get("amount") or {}
+    from_account = order_data.get("fromAccount") or {}
+    info = {
+        "version": INFO_VERSION,
+        "order_id": order_data.get("legacyId") or order_data.get("id"),
+        "order_v2_id": order_data.get("id"),
+        "amount": {
+            "value": (
+                str(amount["value"]) if amount.get("value") is not None else None
+            ),
+            "currency": amount.get("currency"),
+        },
+        "from_account": {
+            "slug": from_account.get("slug"),
+            "name": from_account.get("name"),
+        },
+    }
+    info.update(fields)
+    return info
+
+
+def compact_info(info_data):
+    if info_data.get("version") == INFO_VERSION:
+        return info_data
+    return build_info(
+        info_data.get("order") or {},
+        order_id=info_data.get("order_id"),
+        transaction_id=info_data.get("transaction_id"),
+        status=info_data.get("status"),
+        collective_slug=info_data.get("collective_slug"),
+        use_staging=info_data.get("use_staging"),
+        idempotency_key=info_data.get("idempotency_key"),
+    )
@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.utils.dateparse import parse_datetime
+
+from .opencollective import LEDGER_QUERY
+
+DEFAULT_LEDGER_PAGE_SIZE = 100
+LEDGER_SYNC_SETTING = "ledger_sync"
+
+
+@dataclass(frozen=True)
+class LedgerPage:
+    transactions: list
+    cursor: int
+    total: int
+
+
+def iter_ledger_pages(
+    provider,
+    slug,
+    cursor=0,
+    page_size=DEFAULT_LEDGER_PAGE_SIZE,
+    date_from=None,
+    query=LEDGER_QUERY,
+):
+    # Open Collective paginates transactions by offset. Sorting them oldest
+    # first keeps an offset stable while new transactions come in, so it can
+    # be used as a resumable cursor.
+    while True:
+        data = provider._graphql_request(
+            query,
+            {
+                "account": [{"slug": slug}],
+                "limit": page_size,
+                "offset": cursor,
+                "dateFrom": date_from.isoformat() if date_from else None,
+            },
+        )
+        collection = data.get("transactions") or {}
+        transactions = collection.get("nodes") or []
+        total = collection.get("totalCount") or 0
+        cursor += len(transactions)
+        yield LedgerPage(transactions=transactions, cursor=cursor, total=total)
+        if not transactions or cursor >= total:
+            return
+
+
+def _order_keys(order_data):
+    keys = []
+    for key in (order_data.get("legacyId"), order_data.get("id")):
+        if key not in (None, ""):
+            keys.append(str(key))
+    return keys
+
+
+def match_transactions(transactions, payments):
+    by_order_id = {}
+    for payment in payments:
+        order_id = payment.info_data.get("order_id") if payment.info else None
+        if order_id not in (None, ""):
+            by_order_id[str(order_id)] = payment
+
+    matches = []
+    for transaction in transactions:
+        order_data = transaction.get("order") or {}
+        amount = transaction.get("amount") or {}
+        for key in _order_keys(order_data):
+            payment = by_order_id.get(key)
+            if payment is None:
+                continue
+            if (
+                amount.get("value") is not None
+                and Decimal(str(amount["value"])) == payment.amount
+                and amount.get("currency") == payment.order.event.currency
+            ):
+                matches.append((payment, transaction))
+                del by_order_id[key]
+            break
+    return matches
+
+
+def get_sync_state(provider, setting=LEDGER_SYNC_SETTING):
+    return provider.settings.get(setting, as_type=dict) or {}
+
+
+def reset_sync_state(provider, slug=None, setting=LEDGER_SYNC_SETTING):
+    if slug is None:
+        del provider.settings[setting]
+        return
+    state = get_sync_state(provider, setting)
+    state.pop(slug, None)
+    provider.settings.set(setting, state)
+
+
+def iter_new_transactions(
+    provider,
+    slug,
+    default_date_from,
+    page_size=DEFAULT_LEDGER_PAGE_SIZE,
+    query=LEDGER_QUERY,
+    setting=LEDGER_SYNC_SETTING,
+):
+    # Yields the unseen transactions of each page. The high-water mark only
+    # moves on once the caller has processed a page and asks for the next.
+    state = get_sync_state(provider, setting)
+    mark = state.get(slug) or {}
+    newest = mark.get("created_at")
+    # dateFrom is inclusive, so transactions sharing the high-water
+    # timestamp are fetched again and skipped by their id.
+    seen = set(mark.get("ids") or [])
+    date_from = default_date_from
+    if newest:
+        # A mark older than the window would page through the whole gap of a
+        # quiet period in one run, so it never reaches back further than that.
+        marked = parse_datetime(newest)
+        if default_date_from is None or marked > default_date_from:
+            date_from = marked
+
+    for page in iter_ledger_pages(
+        provider, slug, page_size=page_size, date_from=date_from, query=query
+    ):
+        yield [tx for tx in page.transactions if tx.get("id") not in seen]
+
+        for transaction in page.transactions:
+            if transaction.get("createdAt") != newest:
+                newest = transaction.get("createdAt")
+                seen = set()
+            seen.add(transaction.get("id"))
+        if page.transactions:
+            state[slug] = {"created_at": newest, "ids": sorted(seen)}
+            provider.settings.set(setting, state)
+
+
+def sync_ledger(
+    provider, payments, default_date_from, page_size=DEFAULT_LEDGER_PAGE_SIZE
+):
+    remaining = list(payments)
+    matches = []
+    for slug in sorted(provider.config.slugs):
+        for fresh in iter_new_transactions(
+            provider, slug, default_date_from, page_size=page_size
+        ):
+            for payment, transaction in match_transactions(fresh, remaining):
+                remaining.remove(payment)
+                matches.append((payment, transaction))
+    return matches
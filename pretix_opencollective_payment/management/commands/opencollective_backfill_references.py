@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPayment
+
+from ...dashboard import summary_fields
+from ...models import (
+    OpenCollectivePaymentSummary,
+    ReferencedOpenCollectiveObject,
+    payment_references,
+)
+from ...payment import OpenCollectivePaymentProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Index the Open Collective order and transaction ids stored in existing "
+        "payments and build their dashboard summaries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        payments = (
+            OrderPayment.objects.filter(
+                provider=OpenCollectivePaymentProvider.identifier,
+                info__isnull=False,
+            )
+            .exclude(info="")
+            .select_related("order__event")
+            .only("pk", "info", "amount", "order__event__id", "order__event__currency")
+            .order_by("pk")
+        )
+        batch = []
+        summaries = []
+        indexed = 0
+        for payment in payments.iterator(chunk_size=options["batch_size"]):
+            for kind, reference in sorted(payment_references(payment.info_data)):
+                batch.append(
+                    ReferencedOpenCollectiveObject(
+                        kind=kind, reference=reference, payment_id=payment.pk
+                    )
+                )
+            summaries.append(
+                OpenCollectivePaymentSummary(
+                    payment_id=payment.pk, **summary_fields(payment)
+                )
+            )
+            indexed += 1
+            if len(batch) >= options["batch_size"]:
+                ReferencedOpenCollectiveObject.objects.bulk_create(
+                    batch, ignore_conflicts=True
+                )
+                batch = []
+            if len(summaries) >= options["batch_size"]:
+                OpenCollectivePaymentSummary.objects.bulk_create(
+                    summaries, ignore_conflicts=True
+                )
+                summaries = []
+        if batch:
+            ReferencedOpenCollectiveObject.objects.bulk_create(
+                batch, ignore_conflicts=True
+            )
+        if summaries:
+            OpenCollectivePaymentSummary.objects.bulk_create(
+                summaries, ignore_conflicts=True
+            )
+        self.stdout.write(f"Indexed {indexed} payments.")
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPayment
+
+from ...info import INFO_VERSION, compact_info
+from ...models import ArchivedOpenCollectivePayload
+from ...payment import OpenCollectivePaymentProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the info of existing Open Collective payments in the compact format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--archive",
+            action="store_true",
+            help="Keep the full previous info of each payment in the payload archive",
+        )
+
+    def _flush(self, batch, archive):
+        with transaction.atomic():
+            if archive:
+                ArchivedOpenCollectivePayload.objects.bulk_create(
+                    [
+                        ArchivedOpenCollectivePayload(payment=payment, payload=raw)
+                        for payment, raw in batch
+                    ]
+                )
+            OrderPayment.objects.bulk_update(
+                [payment for payment, _ in batch], ["info"]
+            )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        payments = (
+            OrderPayment.objects.filter(
+                provider=OpenCollectivePaymentProvider.identifier,
+                info__isnull=False,
+            )
+            .exclude(info="")
+            .only("pk", "info")
+            .order_by("pk")
+        )
+        batch = []
+        compacted = 0
+        for payment in payments.iterator(chunk_size=options["batch_size"]):
+            info_data = payment.info_data
+            if not info_data or info_data.get("version") == INFO_VERSION:
+                continue
+            raw = payment.info
+            payment.info = json.dumps(compact_info(info_data))
+            batch.append((payment, raw))
+            if len(batch) >= options["batch_size"]:
+                self._flush(batch, options["archive"])
+                compacted += len(batch)
+                batch = []
+        if batch:
+            self._flush(batch, options["archive"])
+            compacted += len(batch)
+        self.stdout.write(f"Compacted {compacted} payments.")
@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, OrderPayment
+from pretix.base.payment import PaymentException
+
+from ...config import normalize_slug
+from ...ledger import DEFAULT_LEDGER_PAGE_SIZE, iter_ledger_pages, match_transactions
+from ...payment import OpenCollectivePaymentProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the Open Collective contribution ledger of an event's collective "
+        "and match it against pending payments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", help="Organizer slug")
+        parser.add_argument("event", help="Event slug")
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Only import transactions of the last DAYS days",
+        )
+        parser.add_argument("--page-size", type=int, default=DEFAULT_LEDGER_PAGE_SIZE)
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue after the last page imported by a previous run",
+        )
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="Confirm or fail matched payments instead of only listing them",
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.select_related("organizer").get(
+                organizer__slug=options["organizer"], slug=options["event"]
+            )
+        except Event.DoesNotExist:
+            raise CommandError("Event not found.")
+
+        provider = OpenCollectivePaymentProvider(event)
+        slug = normalize_slug(provider.config.collective_slug)
+        if not slug:
+            raise CommandError("Open Collective is not configured for this event.")
+
+        if options["resume"] and provider.settings.get("ledger_date_from"):
+            date_from = parse_datetime(provider.settings.get("ledger_date_from"))
+            cursor = int(provider.settings.get("ledger_cursor") or 0)
+        else:
+            date_from = now() - timedelta(days=options["days"])
+            cursor = 0
+        provider.settings.set("ledger_date_from", date_from.isoformat())
+
+        remaining = list(
+            OrderPayment.objects.filter(
+                order__event=event,
+                provider=provider.identifier,
+                state__in=(
+                    OrderPayment.PAYMENT_STATE_CREATED,
+                    OrderPayment.PAYMENT_STATE_PENDING,
+                ),
+            ).select_related("order")
+        )
+
+        for page in iter_ledger_pages(
+            provider,
+            slug,
+            cursor=cursor,
+            page_size=options["page_size"],
+            date_from=date_from,
+        ):
+            matches = match_transactions(page.transactions, remaining)
+            for payment, transaction in matches:
+                remaining.remove(payment)
+                self.stdout.write(
+                    f"Payment {payment.full_id} matches transaction "
+                    f"{transaction.get('legacyId') or transaction.get('id')}"
+                )
+                if options["apply"]:
+                    try:
+                        provider.apply_order_data(payment, transaction["order"])
+                    except PaymentException as exc:
+                        self.stderr.write(f"Payment {payment.full_id}: {exc}")
+            provider.settings.set("ledger_cursor", page.cursor)
+            self.stdout.write(
+                f"Imported {page.cursor} of {page.total} transactions, "
+                f"{len(matches)} matched on this page."
+            )
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from ...conf import plugin_setting
+from ...ledger import get_sync_state, reset_sync_state
+from ...payment import OpenCollectivePaymentProvider
+from ...reconciliation import (
+    DEFAULT_RECONCILE_MAX_AGE_DAYS,
+    pending_payments,
+    reconcile_payment,
+    sync_ledger,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch Open Collective transactions newer than the last synced one and "
+        "reconcile the matching pending payments of an event."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", help="Organizer slug")
+        parser.add_argument("event", help="Event slug")
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Forget the stored high-water mark instead of syncing",
+        )
+        parser.add_argument(
+            "--slug",
+            help="Only reset the high-water mark of this collective or event slug",
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.select_related("organizer").get(
+                organizer__slug=options["organizer"], slug=options["event"]
+            )
+        except Event.DoesNotExist:
+            raise CommandError("Event not found.")
+
+        provider = OpenCollectivePaymentProvider(event)
+        if options["reset"]:
+            reset_sync_state(provider, options["slug"])
+            self.stdout.write("Ledger sync state has been reset.")
+            return
+
+        cutoff = now() - timedelta(
+            days=plugin_setting(
+                "RECONCILE_MAX_AGE_DAYS", DEFAULT_RECONCILE_MAX_AGE_DAYS
+            )
+        )
+        payments = pending_payments(cutoff).filter(order__event=event)
+        result = {"confirmed": 0, "failed": 0, "pending": 0, "errors": 0}
+        for payment, transaction in sync_ledger(provider, payments, cutoff):
+            reconcile_payment(provider, payment, transaction.get("order"), result)
+        self.stdout.write(f"Reconciled payments: {result}")
+        for slug, mark in sorted(get_sync_state(provider).items()):
+            self.stdout.write(f"{slug}: synced up to {mark['created_at']}")
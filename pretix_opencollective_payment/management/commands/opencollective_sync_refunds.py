@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from ...ledger import get_sync_state, reset_sync_state
+from ...payment import OpenCollectivePaymentProvider
+from ...refunds import (
+    DEFAULT_REFUND_SYNC_MAX_AGE_DAYS,
+    REFUND_SYNC_SETTING,
+    sync_event_refunds,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch refunds made on Open Collective since the last sync and record "
+        "them as external refunds of the matching payments of an event."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", help="Organizer slug")
+        parser.add_argument("event", help="Event slug")
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=DEFAULT_REFUND_SYNC_MAX_AGE_DAYS,
+            help="How far back to look on the first sync",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Forget the stored high-water mark instead of syncing",
+        )
+        parser.add_argument(
+            "--slug",
+            help="Only reset the high-water mark of this collective or event slug",
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.select_related("organizer").get(
+                organizer__slug=options["organizer"], slug=options["event"]
+            )
+        except Event.DoesNotExist:
+            raise CommandError("Event not found.")
+
+        provider = OpenCollectivePaymentProvider(event)
+        if options["reset"]:
+            reset_sync_state(provider, options["slug"], setting=REFUND_SYNC_SETTING)
+            self.stdout.write("Refund sync state has been reset.")
+            return
+
+        result = {"refunds": 0, "skipped": 0, "errors": 0}
+        sync_event_refunds(provider, now() - timedelta(days=options["days"]), result)
+        self.stdout.write(f"Synced refunds: {result}")
+        state = get_sync_state(provider, REFUND_SYNC_SETTING)
+        for slug, mark in sorted(state.items()):
+            self.stdout.write(f"{slug}: synced up to {mark['created_at']}")
@@ -0,0 +1,339 @@
+import bisect
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .conf import plugin_setting
+
+PREFIX = "pretix_opencollective_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REDIS_KEY = "pretix_opencollective_metrics"
+DEFAULT_FLUSH_INTERVAL = 10
+
+logger = logging.getLogger("pretix_opencollective_payment")
+
+_counters = Counter()
+_histograms = {}
+_pending = Counter()
+_gauges = []
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+_sink = None
+_sink_path = None
+
+
+def enabled():
+    return plugin_setting("METRICS", True)
+
+
+def _series(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _shared():
+    return getattr(settings, "HAS_REDIS", False)
+
+
+def _redis():
+    # Like pretix' own metrics, measurements are shared through redis when it
+    # is configured, so every worker reports the totals of all of them.
+    if not _shared():
+        return None
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("redis")
+
+
+def _field(kind, series, slot=None):
+    name, labels = series
+    return json.dumps([kind, name, labels, slot])
+
+
+def register_gauges(collect, per_worker=False):
+    # collect() returns (name, labels, value) tuples with the current values.
+    # Per-worker gauges describe the process they are collected in and are
+    # reported for every worker, the others are the same in all of them.
+    with _lock:
+        if (collect, per_worker) not in _gauges:
+            _gauges.append((collect, per_worker))
+
+
+def _gauge_items(per_worker):
+    items = []
+    for collect, worker in list(_gauges):
+        if per_worker is None or worker == per_worker:
+            items.extend(
+                (_series(name, labels), value) for name, labels, value in collect()
+            )
+    return items
+
+
+def _worker_key(pid):
+    return f"{REDIS_KEY}:worker:{pid}"
+
+
+def _flush_interval():
+    return plugin_setting("METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+
+
+def flush():
+    # Measurements reach redis in batches rather than one round trip each.
+    # Deltas that fail to arrive are dropped; metrics must not break payments.
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    redis = _redis()
+    if redis is None:
+        return
+    try:
+        gauges = _gauge_items(per_worker=True)
+        if not pending and not gauges:
+            return
+        pipeline = redis.pipeline(transaction=False)
+        for field, value in pending.items():
+            pipeline.hincrbyfloat(REDIS_KEY, field, value)
+        if gauges:
+            # Gauges of workers that stopped expire with their key.
+            key = _worker_key(os.getpid())
+            pipeline.delete(key)
+            pipeline.hset(
+                key,
+                mapping={_field("gauge", series): value for series, value in gauges},
+            )
+            pipeline.expire(key, max(60, 3 * int(_flush_interval())))
+        pipeline.execute()
+    except Exception:
+        logger.warning("Could not flush metrics to redis.", exc_info=True)
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush >= _flush_interval():
+        flush()
+
+
+def get_sink():
+    global _sink, _sink_path
+    path = plugin_setting("METRICS_SINK", None)
+    if path != _sink_path:
+        sink = None
+        if path:
+            module_name, _, attribute = path.rpartition(".")
+            sink = getattr(importlib.import_module(module_name), attribute)()
+        _sink, _sink_path = sink, path
+    return _sink
+
+
+def incr(name, value=1, **labels):
+    # Plain counters are always kept in the process. Labelled series and the
+    # shared registry are instrumentation and can be switched off.
+    instrumented = enabled()
+    if labels and not instrumented:
+        return
+    series = _series(name, labels)
+    shared = instrumented and _shared()
+    with _lock:
+        _counters[series] += value
+        if shared:
+            _pending[_field("counter", series)] += value
+    if instrumented:
+        if shared:
+            _maybe_flush()
+        sink = get_sink()
+        if sink is not None:
+            sink.incr(name, value, labels)
+
+
+def observe(name, value, **labels):
+    if not enabled():
+        return
+    series = _series(name, labels)
+    shared = _shared()
+    with _lock:
+        histogram = _histograms.get(series)
+        if histogram is None:
+            histogram = _histograms[series] = [[0] * len(DEFAULT_BUCKETS), 0, 0.0]
+        index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+        if index < len(DEFAULT_BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += 1
+        histogram[2] += value
+        if shared:
+            if index < len(DEFAULT_BUCKETS):
+                _pending[_field("histogram", series, index)] += 1
+            _pending[_field("histogram", series, "count")] += 1
+            _pending[_field("histogram", series, "sum")] += value
+    if shared:
+        _maybe_flush()
+    sink = get_sink()
+    if sink is not None:
+        sink.observe(name, value, labels)
+
+
+class _Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.labels.setdefault("outcome", "error")
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NullTimer:
+    @property
+    def labels(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name, **labels):
+    if not enabled():
+        return _null_timer
+    return _Timer(name, labels)
+
+
+def counters():
+    with _lock:
+        return {
+            name: value for (name, labels), value in _counters.items() if not labels
+        }
+
+
+def histograms():
+    with _lock:
+        return {
+            series: {"buckets": list(buckets), "count": count, "sum": total}
+            for series, (buckets, count, total) in _histograms.items()
+        }
+
+
+def reset():
+    global _last_flush
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _pending.clear()
+        _last_flush = time.monotonic()
+    redis = _redis()
+    if redis is not None:
+        redis.delete(REDIS_KEY)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def _shared_items(redis):
+    counter_items = []
+    histograms = {}
+    for field, value in redis.hgetall(REDIS_KEY).items():
+        kind, name, labels, slot = json.loads(field)
+        series = (name, tuple(tuple(pair) for pair in labels))
+        value = _number(float(value))
+        if kind == "counter":
+            counter_items.append((series, value))
+            continue
+        histogram = histograms.setdefault(series, [[0] * len(DEFAULT_BUCKETS), 0, 0.0])
+        if slot == "count":
+            histogram[1] = value
+        elif slot == "sum":
+            histogram[2] = value
+        else:
+            histogram[0][slot] = value
+    return sorted(counter_items), sorted(
+        (series, tuple(histogram)) for series, histogram in histograms.items()
+    )
+
+
+def _worker_gauge_items(redis):
+    items = []
+    for key in redis.scan_iter(match=_worker_key("*")):
+        if isinstance(key, bytes):
+            key = key.decode()
+        worker = key.rsplit(":", 1)[1]
+        for field, value in redis.hgetall(key).items():
+            _, name, labels, _ = json.loads(field)
+            labels = tuple(
+                sorted([tuple(pair) for pair in labels] + [("worker", worker)])
+            )
+            items.append(((name, labels), _number(float(value))))
+    return items
+
+
+def render_prometheus():
+    redis = _redis()
+    if redis is not None:
+        flush()
+        counter_items, histogram_items = _shared_items(redis)
+        gauge_items = _gauge_items(per_worker=False) + _worker_gauge_items(redis)
+    else:
+        gauge_items = _gauge_items(per_worker=None)
+        with _lock:
+            counter_items = sorted(_counters.items())
+            histogram_items = sorted(
+                (series, (list(buckets), count, total))
+                for series, (buckets, count, total) in _histograms.items()
+            )
+
+    lines = []
+    declared = set()
+    for (name, labels), value in counter_items:
+        metric = f"{PREFIX}{name}_total"
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauge_items):
+        metric = f"{PREFIX}{name}"
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+    for (name, labels), (buckets, count, total) in histogram_items:
+        metric = f"{PREFIX}{name}"
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, bucket in zip(DEFAULT_BUCKETS, buckets):
+            cumulative += bucket
+            le = _format_labels(labels, [("le", str(bound))])
+            lines.append(f"{metric}_bucket{le} {cumulative}")
+        le = _format_labels(labels, [("le", "+Inf")])
+        lines.append(f"{metric}_bucket{le} {count}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
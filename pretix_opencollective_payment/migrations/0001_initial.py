@@ -0,0 +1,47 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("pretixbase", "0096_auto_20180722_0801"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReferencedOpenCollectiveObject",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("order", "Order"), ("transaction", "Transaction")],
+                        max_length=20,
+                    ),
+                ),
+                ("reference", models.CharField(db_index=True, max_length=190)),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="opencollective_references",
+                        to="pretixbase.orderpayment",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("kind", "reference", "payment")},
+            },
+        ),
+    ]
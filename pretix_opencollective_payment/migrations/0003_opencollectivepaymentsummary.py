@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0096_auto_20180722_0801"),
+        ("pretix_opencollective_payment", "0002_archivedopencollectivepayload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OpenCollectivePaymentSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("order_id", models.CharField(blank=True, max_length=190)),
+                ("transaction_id", models.CharField(blank=True, max_length=190)),
+                ("status", models.CharField(blank=True, max_length=40)),
+                (
+                    "amount",
+                    models.DecimalField(decimal_places=2, max_digits=13, null=True),
+                ),
+                ("currency", models.CharField(blank=True, max_length=10)),
+                ("amount_mismatch", models.BooleanField(default=False)),
+                ("rejection", models.CharField(blank=True, max_length=40)),
+                ("collective_slug", models.CharField(blank=True, max_length=190)),
+                ("use_staging", models.BooleanField(default=False)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="opencollective_summaries",
+                        to="pretixbase.event",
+                    ),
+                ),
+                (
+                    "payment",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="opencollective_summary",
+                        to="pretixbase.orderpayment",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,112 @@
+import json
+
+from django.db import models
+
+REFERENCE_ORDER = "order"
+REFERENCE_TRANSACTION = "transaction"
+
+
+class ReferencedOpenCollectiveObject(models.Model):
+    KINDS = (
+        (REFERENCE_ORDER, "Order"),
+        (REFERENCE_TRANSACTION, "Transaction"),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    reference = models.CharField(max_length=190, db_index=True)
+    payment = models.ForeignKey(
+        "pretixbase.OrderPayment",
+        on_delete=models.CASCADE,
+        related_name="opencollective_references",
+    )
+
+    class Meta:
+        unique_together = (("kind", "reference", "payment"),)
+
+
+class ArchivedOpenCollectivePayload(models.Model):
+    payment = models.ForeignKey(
+        "pretixbase.OrderPayment",
+        on_delete=models.CASCADE,
+        related_name="opencollective_payloads",
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    payload = models.TextField()
+
+
+class OpenCollectivePaymentSummary(models.Model):
+    payment = models.OneToOneField(
+        "pretixbase.OrderPayment",
+        on_delete=models.CASCADE,
+        related_name="opencollective_summary",
+    )
+    event = models.ForeignKey(
+        "pretixbase.Event",
+        on_delete=models.CASCADE,
+        related_name="opencollective_summaries",
+    )
+    order_id = models.CharField(max_length=190, blank=True)
+    transaction_id = models.CharField(max_length=190, blank=True)
+    status = models.CharField(max_length=40, blank=True)
+    amount = models.DecimalField(max_digits=13, decimal_places=2, null=True)
+    currency = models.CharField(max_length=10, blank=True)
+    amount_mismatch = models.BooleanField(default=False)
+    rejection = models.CharField(max_length=40, blank=True)
+    collective_slug = models.CharField(max_length=190, blank=True)
+    use_staging = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+
+def archive_payload(payment, order_data, redirect_data=None):
+    ArchivedOpenCollectivePayload.objects.create(
+        payment=payment,
+        payload=json.dumps({"order": order_data, "redirect": redirect_data or {}}),
+    )
+
+
+def payment_references(info_data):
+    order_data = info_data.get("order") or {}
+    references = set()
+    order_ids = (
+        info_data.get("order_id"),
+        info_data.get("order_v2_id"),
+        order_data.get("id"),
+        order_data.get("legacyId"),
+    )
+    for value in order_ids:
+        if value not in (None, ""):
+            references.add((REFERENCE_ORDER, str(value)))
+    if info_data.get("transaction_id") not in (None, ""):
+        references.add((REFERENCE_TRANSACTION, str(info_data["transaction_id"])))
+    for transaction in order_data.get("transactions") or []:
+        for value in (transaction.get("id"), transaction.get("legacyId")):
+            if value not in (None, ""):
+                references.add((REFERENCE_TRANSACTION, str(value)))
+    return references
+
+
+def index_payment(payment):
+    ReferencedOpenCollectiveObject.objects.bulk_create(
+        [
+            ReferencedOpenCollectiveObject(
+                kind=kind, reference=reference, payment=payment
+            )
+            for kind, reference in sorted(payment_references(payment.info_data))
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def order_claimed_elsewhere(payment, order_data):
+    references = [
+        reference
+        for kind, reference in payment_references({"order": order_data})
+        if kind == REFERENCE_ORDER
+    ]
+    return (
+        ReferencedOpenCollectiveObject.objects.filter(
+            kind=REFERENCE_ORDER, reference__in=references
+        )
+        .exclude(payment=payment)
+        .exists()
+    )
@@ -1,3 +1,6 @@
+import hashlib
+from functools import lru_cache
+
 OC_BASEURL = "https://opencollective.com"
 OC_STAGING_BASEURL = "https://staging.opencollective.com"
 
@@ -15,68 +18,172 @@ PENDING_ORDER_STATUSES = {
     "IN_REVIEW",
 }
 
+ORDER_STATUS_FRAGMENT = """
+fragment OrderStatus on Order {
+  id
+  legacyId
+  status
+}
+"""
+
+# Everything needed to verify a payment the first time. Status polling only
+# asks for OrderStatus, which this fragment builds on.
+ORDER_FRAGMENT = """
+fragment OrderDetails on Order {
+  ...OrderStatus
+  frequency
+  totalAmount {
+    value
+    currency
+  }
+  toAccount {
+    slug
+  }
+  fromAccount {
+    slug
+    name
+  }
+  transactions {
+    id
+    legacyId
+    kind
+    type
+  }
+}
+""" + ORDER_STATUS_FRAGMENT
+
 ORDER_QUERY = """
 query ($order: OrderReferenceInput!) {
   order(order: $order) {
-    id
-    legacyId
-    status
-    frequency
-    totalAmount {
-      value
-      currency
-    }
-    amount {
-      value
-      currency
-    }
-    toAccount {
-      slug
-    }
-    fromAccount {
-      slug
-      name
+    ...OrderDetails
+  }
+}
+""" + ORDER_FRAGMENT
+
+
+def persisted_query(query):
+    return {
+        "persistedQuery": {
+            "version": 1,
+            "sha256Hash": _query_hash(query),
+        }
     }
-    transactions {
+
+
+@lru_cache(maxsize=128)
+def _query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def refund_url(collective_slug, transaction_id, use_staging=False):
+    if not collective_slug or not transaction_id:
+        return None
+    base_url = OC_STAGING_BASEURL if use_staging else OC_BASEURL
+    return (
+        f"{base_url}/dashboard/{collective_slug}/transactions"
+        f"?openTransactionId={transaction_id}"
+    )
+
+
+def order_reference(order_id):
+    if order_id in (None, ""):
+        return None
+    try:
+        return {"legacyId": int(order_id)}
+    except (TypeError, ValueError):
+        return {"id": str(order_id)}
+
+
+@lru_cache(maxsize=64)
+def build_order_batch_query(count, status_only=False):
+    fragment, fragment_text = (
+        ("OrderStatus", ORDER_STATUS_FRAGMENT)
+        if status_only
+        else ("OrderDetails", ORDER_FRAGMENT)
+    )
+    variables = ", ".join(f"$o{i}: OrderReferenceInput!" for i in range(count))
+    selections = "".join(
+        f"  o{i}: order(order: $o{i}) {{\n    ...{fragment}\n  }}\n"
+        for i in range(count)
+    )
+    return f"query ({variables}) {{\n{selections}}}\n{fragment_text}"
+
+
+def build_transaction_lookup_query(aliases):
+    variables = ", ".join(f"${alias}: TransactionReferenceInput!" for alias in aliases)
+    selections = "".join(
+        f"  {alias}: transaction(transaction: ${alias}) {{\n"
+        f"    id\n    legacyId\n    order {{\n      ...OrderDetails\n    }}\n  }}\n"
+        for alias in aliases
+    )
+    return f"query ({variables}) {{\n{selections}}}\n{ORDER_FRAGMENT}"
+
+
+LEDGER_QUERY = """
+query (
+  $account: [AccountReferenceInput!]
+  $limit: Int!
+  $offset: Int!
+  $dateFrom: DateTime
+) {
+  transactions(
+    account: $account
+    kind: [CONTRIBUTION]
+    type: CREDIT
+    limit: $limit
+    offset: $offset
+    dateFrom: $dateFrom
+    orderBy: { field: CREATED_AT, direction: ASC }
+  ) {
+    totalCount
+    nodes {
       id
       legacyId
       kind
       type
+      createdAt
+      amount {
+        value
+        currency
+      }
+      order {
+        ...OrderDetails
+      }
     }
   }
 }
-"""
+""" + ORDER_FRAGMENT
 
-TRANSACTION_QUERY = """
-query ($transaction: TransactionReferenceInput!) {
-  transaction(transaction: $transaction) {
-    id
-    legacyId
-    order {
+
+REFUND_QUERY = """
+query (
+  $account: [AccountReferenceInput!]
+  $limit: Int!
+  $offset: Int!
+  $dateFrom: DateTime
+) {
+  transactions(
+    account: $account
+    kind: [CONTRIBUTION]
+    type: DEBIT
+    isRefund: true
+    limit: $limit
+    offset: $offset
+    dateFrom: $dateFrom
+    orderBy: { field: CREATED_AT, direction: ASC }
+  ) {
+    totalCount
+    nodes {
       id
       legacyId
-      status
-      frequency
-      totalAmount {
-        value
-        currency
-      }
+      createdAt
       amount {
         value
         currency
       }
-      toAccount {
-        slug
-      }
-      fromAccount {
-        slug
-        name
-      }
-      transactions {
+      refundTransaction {
         id
         legacyId
-        kind
-        type
       }
     }
   }
@@ -3,10 +3,11 @@ import logging
 import urllib.parse
 from collections import OrderedDict
 from decimal import Decimal
+from functools import cached_property
 
-import requests
 from django import forms
 from django.contrib import messages
+from django.db import transaction
 from django.template.loader import get_template
 from django.utils.translation import gettext_lazy as _
 from pretix.base.decimal import round_decimal
@@ -18,21 +19,52 @@ from pretix.helpers.http import redirect_to_url
 from pretix.multidomain.urlreverse import build_absolute_uri, eventreverse
 from requests import RequestException
 
+from . import metrics
+from .cache import OrderCache, donation_url_parts, single_flight
+from .client import (
+    PERSISTED_QUERY_NOT_FOUND,
+    PERSISTED_QUERY_NOT_SUPPORTED,
+    CircuitOpenError,
+    RateLimitExceeded,
+    disable_persisted_queries,
+    graphql_timeout,
+    legacy_timeout,
+    persisted_queries_enabled,
+    persisted_query_codes,
+    send_request,
+)
+from .conf import plugin_setting
+from .config import ProviderConfig, normalize_slug, parse_routing_rules
+from .dashboard import summarize_payment
+from .info import build_info, compact_order
+from .models import archive_payload, index_payment, order_claimed_elsewhere
 from .opencollective import (
     CONFIRMED_ORDER_STATUSES,
-    OC_BASEURL,
-    OC_GRAPHQL_BASEURL,
-    OC_GRAPHQL_STAGING_BASEURL,
-    OC_LEGACY_API_BASEURL,
-    OC_LEGACY_API_STAGING_BASEURL,
-    OC_STAGING_BASEURL,
     ORDER_QUERY,
     PENDING_ORDER_STATUSES,
-    TRANSACTION_QUERY,
+    build_order_batch_query,
+    build_transaction_lookup_query,
+    order_reference,
+    persisted_query,
+    refund_url,
 )
 
 logger = logging.getLogger("pretix_opencollective_payment")
 
+DEFAULT_GRAPHQL_BATCH_SIZE = 25
+
+
+def _rejected_request(payload):
+    # Errors raised while executing a query come with data, only requests the
+    # server could not run at all are answered without.
+    return bool(payload.get("errors")) and payload.get("data") is None
+
+
+def _rejection(reason, message):
+    exc = PaymentException(message)
+    exc.reason = reason
+    return exc
+
 
 class OpenCollectivePaymentProvider(BasePaymentProvider):
     identifier = "opencollective"
@@ -43,9 +75,16 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
         super().__init__(event)
         self.settings = SettingsSandbox("payment", self.identifier, event)
 
+    @cached_property
+    def config(self):
+        return ProviderConfig.from_settings(self.settings)
+
+    def invalidate_config(self):
+        self.__dict__.pop("config", None)
+
     @property
     def test_mode_message(self):
-        if self.settings.get("use_staging", as_type=bool):
+        if self.config.use_staging:
             return _("The Open Collective staging environment is enabled.")
         return None
 
@@ -68,6 +107,21 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
                     help_text=_("Optional event slug under the collective."),
                 ),
             ),
+            (
+                "routing_rules",
+                forms.CharField(
+                    label=_("Routing rules"),
+                    required=False,
+                    widget=forms.Textarea,
+                    help_text=_(
+                        "Send payments to other collectives or Open Collective "
+                        "events, one rule per line, e.g. product:12 = other-"
+                        "collective, subevent:3 = my-event or channel:web = "
+                        "my-collective. Product and date ids are shown in their "
+                        "URLs. The first matching rule wins."
+                    ),
+                ),
+            ),
             (
                 "token",
                 SecretKeySettingsField(
@@ -76,6 +130,17 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
                     help_text=_("Personal token used for Open Collective API calls."),
                 ),
             ),
+            (
+                "webhook_secret",
+                SecretKeySettingsField(
+                    label=_("Webhook secret"),
+                    required=False,
+                    help_text=_(
+                        "Append it as ?secret=... to the webhook URL you register "
+                        "on Open Collective. Webhooks are ignored while it is empty."
+                    ),
+                ),
+            ),
             (
                 "use_staging",
                 forms.BooleanField(
@@ -84,6 +149,17 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
                     help_text=_("Use the Open Collective staging environment."),
                 ),
             ),
+            (
+                "async_verification",
+                forms.BooleanField(
+                    label=_("Verify payments in the background"),
+                    required=False,
+                    help_text=_(
+                        "Show a waiting page while the payment is verified with "
+                        "Open Collective instead of blocking the request."
+                    ),
+                ),
+            ),
             (
                 "recipient_email",
                 forms.EmailField(
@@ -97,9 +173,16 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
 
     def settings_form_clean(self, cleaned_data):
         cleaned_data = super().settings_form_clean(cleaned_data)
-        for key in ("collective_slug", "event_slug", "token"):
+        for key in ("collective_slug", "event_slug", "token", "webhook_secret"):
             if not cleaned_data.get(key):
                 cleaned_data[key] = ""
+        try:
+            parse_routing_rules(cleaned_data.get("routing_rules"))
+        except ValueError as exc:
+            raise forms.ValidationError(
+                _("Routing rule in line %(line)s is invalid.") % {"line": exc.args[0]}
+            )
+        self.invalidate_config()
         return cleaned_data
 
     def is_allowed(self, request, total=None):
@@ -121,91 +204,201 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
         amount = cart.get("total")
         if amount is None:
             raise PaymentException(_("Invalid cart total."))
+        positions = (
+            (position.item_id, position.subevent_id)
+            for position in cart.get("positions") or ()
+        )
+        slug = self._target_slug(positions, getattr(request, "sales_channel", None))
         request.session["payment_opencollective_payment"] = None
         request.session["payment_opencollective_expected"] = {
             "amount": str(amount),
             "currency": self.event.currency,
+            "slug": slug,
         }
-        return self._build_donation_url(request, amount, None)
+        return self._build_donation_url(request, amount, None, slug)
 
     def payment_prepare(self, request, payment):
+        slug = self._order_target_slug(payment.order)
         request.session["payment_opencollective_payment"] = payment.pk
         request.session["payment_opencollective_expected"] = {
             "amount": str(payment.amount),
             "currency": payment.order.event.currency,
             "order": payment.order.code,
+            "slug": slug,
         }
-        return self._build_donation_url(request, payment.amount, payment.order)
+        return self._build_donation_url(request, payment.amount, payment.order, slug)
+
+    def _order_target_slug(self, order):
+        return self._target_slug(
+            order.positions.values_list("item_id", "subevent_id"),
+            order.sales_channel,
+        )
+
+    def _target_slug(self, positions, channel):
+        if not self.config.routes:
+            return self.config.primary_slug
+        targets = self.config.route(positions, getattr(channel, "identifier", channel))
+        if len(targets) > 1:
+            raise PaymentException(
+                _(
+                    "The products in your order are paid to different Open "
+                    "Collective accounts. Please order them separately."
+                )
+            )
+        return targets.pop()
 
     def payment_is_valid_session(self, request):
         return bool(request.session.get("payment_opencollective_order"))
 
     def _extract_contribution_transaction_id(self, order_data):
         transactions = order_data.get("transactions") or []
-        for transaction in transactions:
+        for oc_transaction in transactions:
             if (
-                transaction.get("kind") == "CONTRIBUTION"
-                and transaction.get("type") == "CREDIT"
+                oc_transaction.get("kind") == "CONTRIBUTION"
+                and oc_transaction.get("type") == "CREDIT"
             ):
-                legacy_id = transaction.get("legacyId")
-                return legacy_id or transaction.get("id")
+                legacy_id = oc_transaction.get("legacyId")
+                return legacy_id or oc_transaction.get("id")
         return None
 
     def execute_payment(self, request, payment):
         order_data = request.session.get("payment_opencollective_order")
         redirect_data = request.session.get("payment_opencollective_redirect", {})
+        expected = request.session.get("payment_opencollective_expected") or {}
         if not order_data:
             raise PaymentException(
                 _("We could not verify your payment with Open Collective.")
             )
 
-        status = self._validate_order(payment, order_data)
-        info_payload = {
-            "order_id": order_data.get("legacyId") or order_data.get("id"),
-            "transaction_id": self._extract_contribution_transaction_id(order_data),
-            "status": status,
-            "order": order_data,
-            "redirect": redirect_data,
-            "collective_slug": self._normalize_slug(
-                self.settings.get("collective_slug")
-            ),
-            "use_staging": self.settings.get("use_staging", as_type=bool),
-        }
-        payment.info = json.dumps(info_payload)
-        payment.save(update_fields=["info"])
-
-        if status in CONFIRMED_ORDER_STATUSES:
-            if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
-                logger.warning(
-                    "Open Collective order already confirmed for payment %s",
-                    payment.id,
-                )
-                return None
-            try:
-                payment.confirm()
-            except Quota.QuotaExceededException as exc:
-                raise PaymentException(str(exc))
-            return None
-
-        if status in PENDING_ORDER_STATUSES:
-            payment.state = OrderPayment.PAYMENT_STATE_PENDING
-            payment.save(update_fields=["state"])
-            messages.warning(
-                request,
-                _(
-                    "Open Collective has not yet confirmed the payment. We will "
-                    "update your order once it clears."
+        # Duplicate redirects for the same payment and order state share a
+        # single confirmation.
+        order_id = order_data.get("legacyId") or order_data.get("id")
+        flight_key = f"payment:{payment.pk}:{order_id}:{order_data.get('status')}"
+        with metrics.timer("confirm_seconds") as timer:
+            status = single_flight(
+                flight_key,
+                lambda: self.apply_order_data(
+                    payment, order_data, redirect_data, expected.get("slug")
                 ),
             )
-            return None
+            timer.labels["outcome"] = status.lower()
+        if status in PENDING_ORDER_STATUSES:
+            self._warn_pending(request)
+        return None
 
-        payment.fail(info=info_payload)
+    def apply_order_data(
+        self, payment, order_data, redirect_data=None, expected_slug=None
+    ):
+        try:
+            status = self._validate_order(payment, order_data, expected_slug)
+        except PaymentException as exc:
+            reason = getattr(exc, "reason", "invalid")
+            metrics.incr("payment_outcomes", outcome="rejected", reason=reason)
+            summarize_payment(payment, order_data, rejection=reason)
+            raise
+        order_id = order_data.get("legacyId") or order_data.get("id")
+        idempotency_key = f"{order_id}:{status}"
+        quota_error = None
+        rejection = None
+
+        with transaction.atomic():
+            OrderPayment.objects.select_for_update().only("pk").get(pk=payment.pk)
+            payment.refresh_from_db()
+            if order_claimed_elsewhere(payment, order_data):
+                # The idempotency key only covers this payment, so one
+                # contribution could otherwise pay for several of them.
+                rejection = _rejection(
+                    "reused",
+                    _(
+                        "This Open Collective contribution has already been used "
+                        "for another payment."
+                    ),
+                )
+            elif self._is_applied(payment, idempotency_key, status):
+                metrics.incr("payment_outcomes", outcome="duplicate", reason="applied")
+                logger.info(
+                    "Open Collective order %s already applied to payment %s",
+                    order_id,
+                    payment.id,
+                )
+            else:
+                info_payload = build_info(
+                    order_data,
+                    transaction_id=self._extract_contribution_transaction_id(
+                        order_data
+                    ),
+                    status=status,
+                    collective_slug=self.config.account_slug(
+                        normalize_slug((order_data.get("toAccount") or {}).get("slug"))
+                    ),
+                    use_staging=self.config.use_staging,
+                    idempotency_key=idempotency_key,
+                )
+                payment.info = json.dumps(info_payload)
+                payment.save(update_fields=["info"])
+                index_payment(payment)
+                summarize_payment(payment, order_data)
+                if plugin_setting("ARCHIVE_PAYLOADS", False):
+                    archive_payload(payment, order_data, redirect_data)
+
+                if status in CONFIRMED_ORDER_STATUSES:
+                    if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
+                        logger.warning(
+                            "Open Collective order already confirmed for payment %s",
+                            payment.id,
+                        )
+                    else:
+                        try:
+                            payment.confirm()
+                        except Quota.QuotaExceededException as exc:
+                            quota_error = exc
+                    outcome, reason = "confirmed", status.lower()
+                    if quota_error is not None:
+                        outcome, reason = "failed", "quota_exceeded"
+                elif status in PENDING_ORDER_STATUSES:
+                    payment.state = OrderPayment.PAYMENT_STATE_PENDING
+                    payment.save(update_fields=["state"])
+                    outcome, reason = "pending", status.lower()
+                else:
+                    payment.fail(info=info_payload)
+                    outcome, reason = "failed", status.lower()
+                metrics.incr("payment_outcomes", outcome=outcome, reason=reason)
+
+        if rejection is not None:
+            metrics.incr("payment_outcomes", outcome="rejected", reason="reused")
+            summarize_payment(payment, order_data, rejection="reused")
+            raise rejection
+        # Raised outside of the transaction, so the stored info survives.
+        if quota_error is not None:
+            raise PaymentException(str(quota_error))
+        if status in CONFIRMED_ORDER_STATUSES or status in PENDING_ORDER_STATUSES:
+            return status
         raise PaymentException(
             _("The Open Collective payment was not completed successfully.")
         )
 
+    def _is_applied(self, payment, idempotency_key, status):
+        if not payment.info or payment.info_data.get("idempotency_key") != (
+            idempotency_key
+        ):
+            return False
+        if status in CONFIRMED_ORDER_STATUSES:
+            return payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+        if status in PENDING_ORDER_STATUSES:
+            return payment.state == OrderPayment.PAYMENT_STATE_PENDING
+        return payment.state == OrderPayment.PAYMENT_STATE_FAILED
+
+    def _warn_pending(self, request):
+        messages.warning(
+            request,
+            _(
+                "Open Collective has not yet confirmed the payment. We will "
+                "update your order once it clears."
+            ),
+        )
+
     def payment_pending_render(self, request, payment):
-        recipient_email = self.settings.get("recipient_email")
+        recipient_email = self.config.recipient_email
         if recipient_email:
             return _(
                 "Your payment is still pending with Open Collective. If it does "
@@ -217,31 +410,22 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
         )
 
     def payment_control_render(self, request, payment):
-        order_id = payment.info_data.get("order_id") if payment.info else None
-        status = payment.info_data.get("status") if payment.info else None
-        collective_slug = (
-            payment.info_data.get("collective_slug") if payment.info else None
-        )
-        transaction_id = (
-            payment.info_data.get("transaction_id") if payment.info else None
-        )
-        use_staging = payment.info_data.get("use_staging") if payment.info else None
+        info_data = payment.info_data if payment.info else {}
+        order_id = info_data.get("order_id")
+        status = info_data.get("status")
+        collective_slug = info_data.get("collective_slug")
+        transaction_id = info_data.get("transaction_id")
+        use_staging = info_data.get("use_staging")
         summary = _("Open Collective order {id} ({status}).").format(
             id=order_id or "-",
             status=status or _("unknown"),
         )
         note = _(
-            "To refund and cancel payment, Click the link <b>'Click here to issue refund on Open Collective'</b> below and issue refund on Open Collective first, Then click the <b>'Create a refund'</b> button below to mark this payment as refunded."
+            "To refund and cancel payment, Click the link <b>'Click here to issue refund on Open Collective'</b> below and issue refund on Open Collective. The refund is picked up automatically within an hour and shown as an external refund of this order, which you can then accept."
         )
-        refund_url = None
-        if transaction_id and collective_slug:
-            base_url = OC_STAGING_BASEURL if use_staging else OC_BASEURL
-            refund_url = (
-                f"{base_url}/dashboard/{collective_slug}/transactions"
-                f"?openTransactionId={transaction_id}"
-            )
-        if refund_url:
-            refund_link = f'<a href="{refund_url}"><b>{_("Click here to issue refund on Open Collective")}</b></a>'
+        refund_link_url = refund_url(collective_slug, transaction_id, use_staging)
+        if refund_link_url:
+            refund_link = f'<a href="{refund_link_url}"><b>{_("Click here to issue refund on Open Collective")}</b></a>'
             return f"{summary}<br><br>{note}<br><br>{refund_link}"
         return f"{summary}<br>{note}"
 
@@ -254,149 +438,204 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
     def payment_partial_refund_supported(self, payment):
         return False
 
-    def _build_donation_url(self, request, amount, order):
-        expected_slug = self._primary_slug()
-        if not expected_slug:
+    def _build_donation_url(self, request, amount, order, slug=None):
+        slug = slug or self.config.primary_slug
+        if not slug:
             raise PaymentException(_("Open Collective settings are incomplete."))
         if amount <= 0:
             raise PaymentException(_("Invalid payment amount."))
 
-        base_url = OC_BASEURL
-        use_staging = self.settings.get("use_staging", as_type=bool)
-        if use_staging:
-            base_url = OC_STAGING_BASEURL
+        cart_namespace = None
+        if request.resolver_match and "cart_namespace" in request.resolver_match.kwargs:
+            cart_namespace = request.resolver_match.kwargs["cart_namespace"]
+        prefix, suffix = donation_url_parts(
+            request.event,
+            self.config,
+            slug,
+            cart_namespace,
+            lambda: self._donation_url_parts(request.event, slug, cart_namespace),
+        )
+        return prefix + self._format_amount(amount, request.event.currency) + suffix
 
+    def _donation_url_parts(self, event, slug, cart_namespace):
         url_kwargs = {}
-        if request.resolver_match and "cart_namespace" in request.resolver_match.kwargs:
-            url_kwargs["cart_namespace"] = request.resolver_match.kwargs[
-                "cart_namespace"
-            ]
+        if cart_namespace is not None:
+            url_kwargs["cart_namespace"] = cart_namespace
         redirect_url = build_absolute_uri(
-            request.event,
+            event,
             "plugins:pretix_opencollective_payment:return",
             kwargs=url_kwargs,
         )
-        amount_str = self._format_amount(amount, request.event.currency)
-        donate_path = "/".join(
-            [base_url.rstrip("/"), expected_slug, "donate", amount_str]
-        )
-
-        final_url = (
-            f"{donate_path}?{urllib.parse.urlencode({'redirect': redirect_url})}"
-        )
-
-        return final_url
+        donate_path = "/".join([self.config.base_url.rstrip("/"), slug, "donate", ""])
+        return donate_path, f"?{urllib.parse.urlencode({'redirect': redirect_url})}"
 
     def _format_amount(self, amount, currency):
         rounded = round_decimal(amount, currency)
         return str(int(rounded))
 
-    def _primary_slug(self):
-        return self.settings.get("event_slug") or self.settings.get("collective_slug")
-
-    def _normalize_slug(self, slug):
-        return slug.strip("/") if slug else slug
-
-    def _valid_slugs(self):
-        slugs = [self.settings.get("event_slug"), self.settings.get("collective_slug")]
-        return {self._normalize_slug(slug) for slug in slugs if slug}
-
-    def _validate_order(self, payment, order_data):
+    def _validate_order(self, payment, order_data, expected_slug=None):
         to_account = order_data.get("toAccount") or {}
-        valid_slugs = self._valid_slugs()
-        target_slug = self._normalize_slug(to_account.get("slug"))
+        target_slug = normalize_slug(to_account.get("slug"))
+        if self.config.routes:
+            # With routing rules, each payment belongs to exactly one account:
+            # the one it was routed to at checkout.
+            if not expected_slug:
+                try:
+                    expected_slug = self._order_target_slug(payment.order)
+                except PaymentException:
+                    expected_slug = None
+            valid_slugs = {normalize_slug(expected_slug)}
+        else:
+            valid_slugs = self.config.slugs
         if valid_slugs and target_slug not in valid_slugs:
-            raise PaymentException(
-                _("The Open Collective order does not match this event.")
+            raise _rejection(
+                "collective", _("The Open Collective order does not match this event.")
             )
 
         amount_data = order_data.get("totalAmount") or order_data.get("amount")
         if not amount_data:
-            raise PaymentException(_("Open Collective order amount missing."))
+            raise _rejection("amount", _("Open Collective order amount missing."))
         oc_amount = Decimal(str(amount_data.get("value")))
         if oc_amount != payment.amount:
-            raise PaymentException(_("The Open Collective payment amount differs."))
+            raise _rejection("amount", _("The Open Collective payment amount differs."))
         if amount_data.get("currency") != payment.order.event.currency:
-            raise PaymentException(_("The Open Collective payment currency differs."))
+            raise _rejection(
+                "currency", _("The Open Collective payment currency differs.")
+            )
 
         frequency = order_data.get("frequency")
         if frequency and frequency != "ONETIME":
-            raise PaymentException(
-                _("Recurring Open Collective contributions are not supported.")
+            raise _rejection(
+                "recurring",
+                _("Recurring Open Collective contributions are not supported."),
             )
 
         status = order_data.get("status")
         if not status:
-            raise PaymentException(_("Open Collective order status missing."))
+            raise _rejection("status", _("Open Collective order status missing."))
         return status
 
     def fetch_order_data(self, redirect_data):
         if redirect_data.get("orderIdV2"):
-            return self._fetch_order_by_reference({"id": redirect_data["orderIdV2"]})
+            with metrics.timer("lookup_seconds", strategy="order_id_v2"):
+                return self._fetch_order_by_reference(
+                    {"id": redirect_data["orderIdV2"]}
+                )
         if redirect_data.get("orderId"):
-            try:
-                legacy_id = int(redirect_data["orderId"])
-                return self._fetch_order_by_reference({"legacyId": legacy_id})
-            except (TypeError, ValueError):
-                return self._fetch_order_by_reference({"id": redirect_data["orderId"]})
+            with metrics.timer("lookup_seconds", strategy="order_id"):
+                reference = order_reference(redirect_data["orderId"])
+                return self._fetch_order_by_reference(reference)
         if redirect_data.get("transactionid"):
-            return self._fetch_order_by_transaction(redirect_data["transactionid"])
+            with metrics.timer("lookup_seconds", strategy="transaction_id"):
+                return self._fetch_order_by_transaction(redirect_data["transactionid"])
         raise PaymentException(_("Open Collective did not return order details."))
 
+    def _order_cache(self):
+        return OrderCache(self.event, self.config.use_staging)
+
     def _fetch_order_by_reference(self, reference):
+        order_cache = self._order_cache()
+        order_data = order_cache.get("order", reference)
+        if order_data:
+            return order_data
+        return single_flight(
+            order_cache.key("order", reference),
+            lambda: self._load_order_by_reference(order_cache, reference),
+        )
+
+    def _refresh_order_by_reference(self, reference):
+        # Skips the cached copy, which may predate the change being reported,
+        # and replaces it with the fresh one.
+        return self._load_order_by_reference(self._order_cache(), reference)
+
+    def _load_order_by_reference(self, order_cache, reference):
         payload = {"order": reference}
         data = self._graphql_request(ORDER_QUERY, payload)
         order_data = data.get("order")
         if not order_data:
             raise PaymentException(_("Open Collective order could not be found."))
+        order_cache.set("order", reference, order_data)
         return order_data
 
     def _fetch_order_by_transaction(self, transaction_id):
-        data = self._graphql_request(
-            TRANSACTION_QUERY, {"transaction": {"id": transaction_id}}
-        )
-        transaction = data.get("transaction") or {}
-        order_data = transaction.get("order")
+        order_cache = self._order_cache()
+        order_data = order_cache.get("transaction", transaction_id)
         if order_data:
             return order_data
+        return single_flight(
+            order_cache.key("transaction", transaction_id),
+            lambda: self._load_order_by_transaction(order_cache, transaction_id),
+        )
+
+    def _load_order_by_transaction(self, order_cache, transaction_id):
+        order_data = self._resolve_order_by_transaction(transaction_id)
+        order_cache.set("transaction", transaction_id, order_data)
+        return order_data
 
+    def _resolve_order_by_transaction(self, transaction_id):
         try:
             legacy_id = int(transaction_id)
         except (TypeError, ValueError):
             legacy_id = None
 
+        # Both GraphQL lookups share one aliased document, so the REST API is
+        # only asked once neither the id nor the legacy id is known.
+        references = {"byId": {"id": str(transaction_id)}}
         if legacy_id is not None:
-            data = self._graphql_request(
-                TRANSACTION_QUERY, {"transaction": {"legacyId": legacy_id}}
-            )
-            transaction = data.get("transaction") or {}
-            order_data = transaction.get("order")
+            references["byLegacyId"] = {"legacyId": legacy_id}
+        payload = self._graphql_post(
+            build_transaction_lookup_query(list(references)), references
+        )
+        self._raise_for_unaliased_errors(payload, references)
+        data = payload.get("data") or {}
+        for alias, strategy in (("byId", "id"), ("byLegacyId", "legacy_id")):
+            order_data = (data.get(alias) or {}).get("order")
             if order_data:
+                metrics.incr(f"transaction_lookup_{strategy}")
                 return order_data
 
         legacy_order = self._fetch_order_via_legacy(transaction_id)
         if legacy_order:
+            metrics.incr("transaction_lookup_legacy_api")
             return legacy_order
 
+        metrics.incr("transaction_lookup_not_found")
         raise PaymentException(_("Open Collective order could not be found."))
 
+    def _raise_for_unaliased_errors(self, payload, aliases):
+        for error in payload.get("errors") or []:
+            path = error.get("path") or []
+            if not path or path[0] not in aliases:
+                logger.error("Open Collective API error: %s", payload["errors"])
+                raise PaymentException(
+                    _("Open Collective did not return a valid response.")
+                )
+            logger.info(
+                "Open Collective lookup %s failed: %s", path[0], error.get("message")
+            )
+
     def _fetch_order_via_legacy(self, transaction_id):
-        expected_slug = self.settings.get("collective_slug")
+        config = self.config
+        expected_slug = config.collective_slug
         if not expected_slug:
             return None
-        api_key = self.settings.get("token")
+        api_key = config.token
         if not api_key:
             return None
 
-        base_url = (
-            OC_LEGACY_API_STAGING_BASEURL
-            if self.settings.get("use_staging", as_type=bool)
-            else OC_LEGACY_API_BASEURL
-        )
+        base_url = config.legacy_api_url
         url = f"{base_url}/collectives/{expected_slug}/transactions/{transaction_id}"
         try:
-            response = requests.get(url, params={"apiKey": api_key}, timeout=15)
-            response.raise_for_status()
+            response = send_request(
+                "GET", url, params={"apiKey": api_key}, timeout=legacy_timeout()
+            )
+        except CircuitOpenError as exc:
+            raise PaymentException(
+                _(
+                    "Open Collective is currently unavailable. Please try again "
+                    "in a few minutes."
+                )
+            ) from exc
         except RequestException as exc:
             logger.warning("Legacy OC lookup failed: %s", exc)
             return None
@@ -436,39 +675,167 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
             },
         }
 
+    def fetch_orders(self, order_ids, batch_size=None, status_only=False):
+        batch_size = batch_size or plugin_setting(
+            "GRAPHQL_BATCH_SIZE", DEFAULT_GRAPHQL_BATCH_SIZE
+        )
+        order_cache = self._order_cache()
+        results = {}
+        missing = []
+        for order_id in dict.fromkeys(order_ids):
+            reference = order_reference(order_id)
+            if reference is None:
+                continue
+            order_data = order_cache.get("order", reference)
+            if order_data:
+                results[order_id] = order_data
+            else:
+                missing.append((order_id, reference))
+
+        for start in range(0, len(missing), batch_size):
+            self._fetch_order_batch(
+                missing[start : start + batch_size], results, order_cache, status_only
+            )
+        return results
+
+    def _fetch_order_batch(self, batch, results, order_cache, status_only=False):
+        aliases = {f"o{index}": item for index, item in enumerate(batch)}
+        variables = {alias: reference for alias, (_, reference) in aliases.items()}
+        try:
+            payload = self._graphql_post(
+                build_order_batch_query(len(batch), status_only), variables
+            )
+        except PaymentException as exc:
+            response = getattr(exc.__cause__, "response", None)
+            if (
+                len(batch) > 1
+                and response is not None
+                and response.status_code in (400, 413)
+            ):
+                # Open Collective rejects documents that are too large or too
+                # complex, so retry with halves until they are accepted.
+                middle = len(batch) // 2
+                self._fetch_order_batch(
+                    batch[:middle], results, order_cache, status_only
+                )
+                self._fetch_order_batch(
+                    batch[middle:], results, order_cache, status_only
+                )
+                return
+            raise
+
+        self._raise_for_unaliased_errors(payload, aliases)
+        data = payload.get("data") or {}
+        for alias, (order_id, reference) in aliases.items():
+            order_data = data.get(alias)
+            if order_data:
+                results[order_id] = order_data
+                if not status_only:
+                    order_cache.set("order", reference, order_data)
+
     def _graphql_request(self, query, variables):
-        api_key = self.settings.get("token")
+        payload = self._graphql_post(query, variables)
+        if payload.get("errors"):
+            logger.error("Open Collective API error: %s", payload["errors"])
+            raise PaymentException(
+                _("Open Collective did not return a valid response.")
+            )
+        return payload.get("data") or {}
+
+    def _graphql_post(self, query, variables):
+        config = self.config
+        api_key = config.token
         if not api_key:
             raise PaymentException(_("Open Collective API token is missing."))
-        endpoint = (
-            OC_GRAPHQL_STAGING_BASEURL
-            if self.settings.get("use_staging", as_type=bool)
-            else OC_GRAPHQL_BASEURL
-        )
+        endpoint = config.graphql_url
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
+        if not persisted_queries_enabled(endpoint):
+            return self._send_graphql(
+                endpoint, headers, {"query": query, "variables": variables}
+            )
+
+        # Automatic persisted queries: send only the hash first and the full
+        # document once Open Collective reports that it doesn't know it yet.
+        extensions = persisted_query(query)
+        try:
+            payload = self._send_graphql(
+                endpoint,
+                headers,
+                {"variables": variables, "extensions": extensions},
+                log_errors=False,
+            )
+        except PaymentException as exc:
+            payload = self._persisted_query_error(exc)
+        codes = persisted_query_codes(payload) & (
+            PERSISTED_QUERY_NOT_FOUND | PERSISTED_QUERY_NOT_SUPPORTED
+        )
+        if not codes and not _rejected_request(payload):
+            metrics.incr("persisted_query_hit")
+            return payload
+        metrics.incr("persisted_query_miss")
+        payload = self._send_graphql(
+            endpoint,
+            headers,
+            {"query": query, "variables": variables, "extensions": extensions},
+        )
+        # Servers without persisted queries don't always say so with one of
+        # the known codes. If the full document got through where the hash
+        # alone did not, only full documents are sent from now on.
+        if codes & PERSISTED_QUERY_NOT_SUPPORTED or (
+            not codes & PERSISTED_QUERY_NOT_FOUND and not _rejected_request(payload)
+        ):
+            disable_persisted_queries(endpoint)
+        return payload
+
+    def _persisted_query_error(self, exc):
+        # A bare hash may be rejected with any client error, with or without a
+        # GraphQL error in the body. Upstream failures are not retried.
+        response = getattr(exc.__cause__, "response", None)
+        if response is None or response.status_code == 429:
+            raise exc
+        if response.status_code >= 500:
+            raise exc
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or not payload.get("errors"):
+            payload = {"errors": [{"message": f"HTTP {response.status_code}"}]}
+        return payload
+
+    def _send_graphql(self, endpoint, headers, body, log_errors=True):
         try:
-            response = requests.post(
+            response = send_request(
+                "POST",
                 endpoint,
-                json={"query": query, "variables": variables},
+                json=body,
                 headers=headers,
-                timeout=15,
+                timeout=graphql_timeout(),
             )
-            response.raise_for_status()
+        except CircuitOpenError as exc:
+            raise PaymentException(
+                _(
+                    "Open Collective is currently unavailable. Please try again "
+                    "in a few minutes."
+                )
+            ) from exc
+        except RateLimitExceeded as exc:
+            raise PaymentException(
+                _(
+                    "Open Collective is receiving too many requests right now. "
+                    "Please try again in a moment."
+                )
+            ) from exc
         except RequestException as exc:
-            logger.exception("Open Collective API request failed")
+            if log_errors:
+                logger.exception("Open Collective API request failed")
             raise PaymentException(
                 _("We had trouble communicating with Open Collective.")
             ) from exc
-        payload = response.json()
-        if payload.get("errors"):
-            logger.error("Open Collective API error: %s", payload["errors"])
-            raise PaymentException(
-                _("Open Collective did not return a valid response.")
-            )
-        return payload.get("data") or {}
+        return response.json()
 
     def handle_callback(self, request, redirect_data):
         try:
@@ -476,33 +843,49 @@ class OpenCollectivePaymentProvider(BasePaymentProvider):
         except PaymentException:
             raise
 
-        request.session["payment_opencollective_order"] = order_data
+        request.session["payment_opencollective_order"] = compact_order(order_data)
         request.session["payment_opencollective_redirect"] = redirect_data
 
-        payment_id = request.session.get("payment_opencollective_payment")
-        if payment_id:
-            try:
-                payment = OrderPayment.objects.get(pk=payment_id)
-            except OrderPayment.DoesNotExist:
-                payment = None
-            if payment:
-                response = self.execute_payment(request, payment)
-                if response:
-                    return response
-                return redirect_to_url(
-                    eventreverse(
-                        request.event,
-                        "presale:event.order",
-                        kwargs={
-                            "order": payment.order.code,
-                            "secret": payment.order.secret,
-                        },
-                    )
-                    + ("?paid=yes" if payment.order.status == Order.STATUS_PAID else "")
-                )
+        payment = self._session_payment(request)
+        if payment:
+            response = self.execute_payment(request, payment)
+            if response:
+                return response
+        return redirect_to_url(self._callback_redirect_url(request, payment))
 
-        return redirect_to_url(
-            eventreverse(
-                request.event, "presale:event.checkout", kwargs={"step": "confirm"}
+    def finish_verification(self, request, state):
+        if state is None:
+            raise PaymentException(
+                _("We could not verify your payment with Open Collective.")
             )
+        if state.get("state") == "error":
+            raise PaymentException(state["message"])
+
+        request.session["payment_opencollective_order"] = state["order"]
+        payment = self._session_payment(request)
+        if payment and state.get("status") in PENDING_ORDER_STATUSES:
+            self._warn_pending(request)
+        return redirect_to_url(self._callback_redirect_url(request, payment))
+
+    def _session_payment(self, request):
+        payment_id = request.session.get("payment_opencollective_payment")
+        if not payment_id:
+            return None
+        try:
+            return OrderPayment.objects.get(pk=payment_id)
+        except OrderPayment.DoesNotExist:
+            return None
+
+    def _callback_redirect_url(self, request, payment):
+        if payment:
+            return eventreverse(
+                request.event,
+                "presale:event.order",
+                kwargs={
+                    "order": payment.order.code,
+                    "secret": payment.order.secret,
+                },
+            ) + ("?paid=yes" if payment.order.status == Order.STATUS_PAID else "")
+        return eventreverse(
+            request.event, "presale:event.checkout", kwargs={"step": "confirm"}
         )
@@ -0,0 +1,214 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils.timezone import now
+from pretix.base.models import OrderPayment
+from pretix.base.payment import PaymentException
+
+from . import metrics
+from .client import count_requests
+from .conf import plugin_setting
+from .ledger import sync_ledger
+from .opencollective import CONFIRMED_ORDER_STATUSES, order_reference
+from .payment import OpenCollectivePaymentProvider
+
+logger = logging.getLogger("pretix_opencollective_payment")
+
+DEFAULT_RECONCILE_BATCH_SIZE = 50
+DEFAULT_RECONCILE_MAX_API_CALLS = 200
+DEFAULT_RECONCILE_CALL_INTERVAL = 0.2
+DEFAULT_RECONCILE_MAX_AGE_DAYS = 14
+
+LAST_RUN_CACHE_KEY = "pretix_opencollective_reconcile_last_run"
+
+
+def pending_payments(cutoff):
+    return (
+        OrderPayment.objects.filter(
+            provider=OpenCollectivePaymentProvider.identifier,
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            created__gte=cutoff,
+        )
+        .select_related("order", "order__event")
+        .order_by("pk")
+    )
+
+
+def _batches(payments, size):
+    batch = []
+    for payment in payments.iterator():
+        batch.append(payment)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reconcile_payment(provider, payment, order_data, result):
+    if not order_data:
+        result["errors"] += 1
+        logger.warning(
+            "Open Collective order for payment %s could not be found", payment.pk
+        )
+        return
+    try:
+        status = provider.apply_order_data(payment, order_data)
+    except PaymentException as exc:
+        if payment.state == OrderPayment.PAYMENT_STATE_FAILED:
+            result["failed"] += 1
+        else:
+            result["errors"] += 1
+            logger.warning(
+                "Could not reconcile Open Collective payment %s: %s",
+                payment.pk,
+                exc,
+            )
+        return
+
+    if status in CONFIRMED_ORDER_STATUSES:
+        result["confirmed"] += 1
+    else:
+        result["pending"] += 1
+
+
+def _fetch_changed_orders(provider, payments, result):
+    # Most pending contributions are still pending, so only poll their status
+    # and load the full order for the ones that moved on.
+    statuses = provider.fetch_orders(
+        [payment.info_data["order_id"] for payment in payments], status_only=True
+    )
+    changed = []
+    for payment in payments:
+        order_id = payment.info_data["order_id"]
+        order_status = statuses.get(order_id)
+        if order_status and order_status.get("status") == payment.info_data.get(
+            "status"
+        ):
+            result["pending"] += 1
+        else:
+            changed.append(order_id)
+    orders = provider.fetch_orders(changed) if changed else {}
+    return {order_id: orders.get(order_id) for order_id in changed}
+
+
+def reconcile_pending_payments():
+    started = time.monotonic()
+    batch_size = plugin_setting("RECONCILE_BATCH_SIZE", DEFAULT_RECONCILE_BATCH_SIZE)
+    max_api_calls = plugin_setting(
+        "RECONCILE_MAX_API_CALLS", DEFAULT_RECONCILE_MAX_API_CALLS
+    )
+    interval = plugin_setting(
+        "RECONCILE_CALL_INTERVAL", DEFAULT_RECONCILE_CALL_INTERVAL
+    )
+    cutoff = now() - timedelta(
+        days=plugin_setting("RECONCILE_MAX_AGE_DAYS", DEFAULT_RECONCILE_MAX_AGE_DAYS)
+    )
+
+    result = {
+        "scanned": 0,
+        "confirmed": 0,
+        "failed": 0,
+        "pending": 0,
+        "errors": 0,
+        "api_calls": 0,
+        "duration": 0.0,
+    }
+    providers = {}
+    last_call = None
+
+    with count_requests() as api_calls:
+        limit_reached = False
+        for batch in _batches(pending_payments(cutoff), batch_size):
+            by_event = {}
+            for payment in batch:
+                if order_reference(payment.info_data.get("order_id")):
+                    by_event.setdefault(payment.order.event.pk, []).append(payment)
+
+            for event_payments in by_event.values():
+                if api_calls.count >= max_api_calls:
+                    limit_reached = True
+                    break
+                event = event_payments[0].order.event
+                provider = providers.get(event.pk)
+                if provider is None:
+                    provider = providers[event.pk] = OpenCollectivePaymentProvider(
+                        event
+                    )
+
+                if last_call is not None:
+                    wait = interval - (time.monotonic() - last_call)
+                    if wait > 0:
+                        time.sleep(wait)
+                last_call = time.monotonic()
+
+                result["scanned"] += len(event_payments)
+                try:
+                    orders = _fetch_changed_orders(provider, event_payments, result)
+                except PaymentException as exc:
+                    result["errors"] += len(event_payments)
+                    logger.warning(
+                        "Could not fetch Open Collective orders for event %s: %s",
+                        event.pk,
+                        exc,
+                    )
+                    continue
+
+                for payment in event_payments:
+                    order_id = payment.info_data["order_id"]
+                    if order_id in orders:
+                        reconcile_payment(provider, payment, orders[order_id], result)
+            if limit_reached:
+                logger.info(
+                    "Open Collective reconciliation stopped at the API call limit"
+                )
+                break
+
+    result["api_calls"] = api_calls.count
+    result["duration"] = round(time.monotonic() - started, 3)
+    for key in ("scanned", "confirmed", "failed", "errors"):
+        metrics.incr(f"reconcile_{key}", result[key])
+    cache.set(LAST_RUN_CACHE_KEY, result, None)
+    logger.info("Open Collective reconciliation finished: %s", result)
+    return result
+
+
+def open_payments_by_event(cutoff):
+    payments = {}
+    for payment in pending_payments(cutoff).iterator():
+        payments.setdefault(payment.order.event, []).append(payment)
+    return payments
+
+
+def sync_ledgers():
+    cutoff = now() - timedelta(
+        days=plugin_setting("RECONCILE_MAX_AGE_DAYS", DEFAULT_RECONCILE_MAX_AGE_DAYS)
+    )
+    result = {
+        "events": 0,
+        "matched": 0,
+        "confirmed": 0,
+        "failed": 0,
+        "pending": 0,
+        "errors": 0,
+    }
+    for event, payments in open_payments_by_event(cutoff).items():
+        provider = OpenCollectivePaymentProvider(event)
+        result["events"] += 1
+        try:
+            matches = sync_ledger(provider, payments, cutoff)
+        except PaymentException as exc:
+            result["errors"] += 1
+            logger.warning(
+                "Could not sync Open Collective ledger for event %s: %s",
+                event.pk,
+                exc,
+            )
+            continue
+        for payment, transaction in matches:
+            result["matched"] += 1
+            reconcile_payment(provider, payment, transaction.get("order"), result)
+    logger.info("Open Collective ledger sync finished: %s", result)
+    return result
@@ -0,0 +1,181 @@
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from pretix.base.models import Event, OrderPayment, OrderRefund
+from pretix.base.payment import PaymentException
+
+from . import metrics
+from .conf import plugin_setting
+from .ledger import DEFAULT_LEDGER_PAGE_SIZE, iter_new_transactions
+from .models import REFERENCE_TRANSACTION, ReferencedOpenCollectiveObject
+from .opencollective import REFUND_QUERY
+from .payment import OpenCollectivePaymentProvider
+
+logger = logging.getLogger("pretix_opencollective_payment")
+
+DEFAULT_REFUND_SYNC_MAX_AGE_DAYS = 90
+REFUND_SYNC_SETTING = "refund_sync"
+
+
+def _refunded_references(refund_transaction):
+    original = refund_transaction.get("refundTransaction") or {}
+    return [
+        str(value)
+        for value in (original.get("legacyId"), original.get("id"))
+        if value not in (None, "")
+    ]
+
+
+def _existing_refunds(payments):
+    synced = set()
+    refunded = {}
+    refunds = (
+        OrderRefund.objects.filter(payment__in=payments)
+        .exclude(
+            state__in=(
+                OrderRefund.REFUND_STATE_CANCELED,
+                OrderRefund.REFUND_STATE_FAILED,
+            )
+        )
+        .values_list("payment_id", "provider", "amount", "info")
+    )
+    for payment_id, provider, amount, info in refunds:
+        refunded[payment_id] = refunded.get(payment_id, Decimal("0")) + amount
+        if provider != OpenCollectivePaymentProvider.identifier:
+            continue
+        try:
+            refund_id = json.loads(info or "{}").get("refund_transaction_id")
+        except ValueError:
+            continue
+        if refund_id:
+            synced.add(str(refund_id))
+    return synced, refunded
+
+
+def match_refunds(event, refund_transactions):
+    # One query for the whole page: refunds point at the contribution
+    # transaction, which is indexed next to every verified payment.
+    by_reference = {}
+    for refund_transaction in refund_transactions:
+        for reference in _refunded_references(refund_transaction):
+            by_reference[reference] = refund_transaction
+    if not by_reference:
+        return []
+    references = ReferencedOpenCollectiveObject.objects.filter(
+        kind=REFERENCE_TRANSACTION,
+        reference__in=list(by_reference),
+        payment__order__event=event,
+    ).select_related("payment", "payment__order")
+
+    matches = {}
+    for reference in references:
+        refund_transaction = by_reference[reference.reference]
+        matches.setdefault(
+            refund_transaction["id"], (reference.payment, refund_transaction)
+        )
+    return list(matches.values())
+
+
+def apply_refunds(event, matches, result):
+    synced, refunded = _existing_refunds([payment for payment, _ in matches])
+    with transaction.atomic():
+        for payment, refund_transaction in matches:
+            # Payments refunded by hand before are left alone as well.
+            if (
+                str(refund_transaction["id"]) in synced
+                or refunded.get(payment.pk, Decimal("0")) >= payment.amount
+            ):
+                result["skipped"] += 1
+                continue
+            amount_data = refund_transaction.get("amount") or {}
+            if amount_data.get("currency") not in (None, event.currency):
+                result["errors"] += 1
+                logger.warning(
+                    "Open Collective refund %s of payment %s is in %s",
+                    refund_transaction["id"],
+                    payment.pk,
+                    amount_data.get("currency"),
+                )
+                continue
+            amount = payment.amount
+            if amount_data.get("value") is not None:
+                amount = abs(Decimal(str(amount_data["value"])))
+            created_at = refund_transaction.get("createdAt")
+            payment.create_external_refund(
+                amount=amount,
+                execution_date=parse_datetime(created_at) if created_at else now(),
+                info=json.dumps(
+                    {
+                        "refund_transaction_id": refund_transaction["id"],
+                        "refund_transaction_legacy_id": refund_transaction.get(
+                            "legacyId"
+                        ),
+                        "created_at": created_at,
+                    }
+                ),
+            )
+            synced.add(str(refund_transaction["id"]))
+            refunded[payment.pk] = refunded.get(payment.pk, Decimal("0")) + amount
+            result["refunds"] += 1
+
+
+def sync_event_refunds(
+    provider, default_date_from, result, page_size=DEFAULT_LEDGER_PAGE_SIZE
+):
+    for slug in sorted(provider.config.slugs):
+        for refund_transactions in iter_new_transactions(
+            provider,
+            slug,
+            default_date_from,
+            page_size=page_size,
+            query=REFUND_QUERY,
+            setting=REFUND_SYNC_SETTING,
+        ):
+            matches = match_refunds(provider.event, refund_transactions)
+            if matches:
+                apply_refunds(provider.event, matches, result)
+
+
+def refund_sync_events(cutoff):
+    event_ids = (
+        OrderPayment.objects.filter(
+            provider=OpenCollectivePaymentProvider.identifier,
+            state__in=(
+                OrderPayment.PAYMENT_STATE_CONFIRMED,
+                OrderPayment.PAYMENT_STATE_REFUNDED,
+            ),
+            created__gte=cutoff,
+        )
+        .values_list("order__event_id", flat=True)
+        .distinct()
+    )
+    return Event.objects.filter(pk__in=event_ids).order_by("pk")
+
+
+def sync_refunds():
+    cutoff = now() - timedelta(
+        days=plugin_setting(
+            "REFUND_SYNC_MAX_AGE_DAYS", DEFAULT_REFUND_SYNC_MAX_AGE_DAYS
+        )
+    )
+    result = {"events": 0, "refunds": 0, "skipped": 0, "errors": 0}
+    for event in refund_sync_events(cutoff):
+        provider = OpenCollectivePaymentProvider(event)
+        result["events"] += 1
+        try:
+            sync_event_refunds(provider, cutoff, result)
+        except PaymentException as exc:
+            result["errors"] += 1
+            logger.warning(
+                "Could not sync Open Collective refunds for event %s: %s",
+                event.pk,
+                exc,
+            )
+    metrics.incr("refunds_synced", result["refunds"])
+    logger.info("Open Collective refund sync finished: %s", result)
+    return result
@@ -1,10 +1,94 @@
 from django.dispatch import receiver
+from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
+from django_scopes import scopes_disabled
 
-from pretix.base.signals import register_payment_providers
+from pretix.base.signals import (
+    periodic_task,
+    register_data_exporters,
+    register_multievent_data_exporters,
+    register_payment_providers,
+)
+from pretix.control.signals import nav_organizer
+from pretix.helpers.periodic import minimum_interval
 
 from .payment import OpenCollectivePaymentProvider
+from .reconciliation import reconcile_pending_payments, sync_ledgers
+from .refunds import sync_refunds
 
 
 @receiver(register_payment_providers, dispatch_uid="payment_opencollective")
 def register_payment_provider(sender, **kwargs):
     return OpenCollectivePaymentProvider
+
+
+@receiver(register_data_exporters, dispatch_uid="payment_opencollective_export")
+def register_exporter(sender, **kwargs):
+    from .exporters import OpenCollectivePaymentExporter
+
+    return OpenCollectivePaymentExporter
+
+
+@receiver(register_data_exporters, dispatch_uid="payment_opencollective_export_json")
+def register_json_exporter(sender, **kwargs):
+    from .exporters import OpenCollectivePaymentJSONExporter
+
+    return OpenCollectivePaymentJSONExporter
+
+
+@receiver(
+    register_multievent_data_exporters,
+    dispatch_uid="payment_opencollective_multievent_export",
+)
+def register_multievent_exporter(sender, **kwargs):
+    from .exporters import OpenCollectivePaymentExporter
+
+    return OpenCollectivePaymentExporter
+
+
+@receiver(
+    register_multievent_data_exporters,
+    dispatch_uid="payment_opencollective_multievent_export_json",
+)
+def register_multievent_json_exporter(sender, **kwargs):
+    from .exporters import OpenCollectivePaymentJSONExporter
+
+    return OpenCollectivePaymentJSONExporter
+
+
+@receiver(nav_organizer, dispatch_uid="payment_opencollective_nav_organizer")
+def control_nav_organizer(sender, request, organizer, **kwargs):
+    url = request.resolver_match
+    return [
+        {
+            "label": _("Open Collective"),
+            "url": reverse(
+                "plugins:pretix_opencollective_payment:organizer.dashboard",
+                kwargs={"organizer": organizer.slug},
+            ),
+            "active": url.namespace == "plugins:pretix_opencollective_payment"
+            and url.url_name == "organizer.dashboard",
+            "icon": "money",
+        }
+    ]
+
+
+@receiver(periodic_task, dispatch_uid="payment_opencollective_reconcile")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=5, minutes_after_error=5)
+def run_reconciliation(sender, **kwargs):
+    reconcile_pending_payments()
+
+
+@receiver(periodic_task, dispatch_uid="payment_opencollective_sync_ledgers")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=15, minutes_after_error=15)
+def run_ledger_sync(sender, **kwargs):
+    sync_ledgers()
+
+
+@receiver(periodic_task, dispatch_uid="payment_opencollective_sync_refunds")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=30, minutes_after_error=30)
+def run_refund_sync(sender, **kwargs):
+    sync_refunds()
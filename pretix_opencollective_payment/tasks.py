@@ -0,0 +1,40 @@
+import logging
+
+from django.utils.translation import gettext as _
+from pretix.base.models import OrderPayment
+from pretix.base.payment import PaymentException
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+
+from .cache import set_verification_state
+from .info import compact_order
+from .payment import OpenCollectivePaymentProvider
+
+logger = logging.getLogger("pretix_opencollective_payment")
+
+
+@app.task(base=EventTask)
+def verify_callback(event, token, redirect_data, payment_id=None):
+    provider = OpenCollectivePaymentProvider(event)
+    state = {"state": "done", "status": None}
+    try:
+        state["order"] = compact_order(provider.fetch_order_data(redirect_data))
+        payment = None
+        if payment_id:
+            try:
+                payment = OrderPayment.objects.get(pk=payment_id)
+            except OrderPayment.DoesNotExist:
+                payment = None
+        if payment:
+            state["status"] = provider.apply_order_data(
+                payment, state["order"], redirect_data
+            )
+    except PaymentException as exc:
+        state = {"state": "error", "message": str(exc)}
+    except Exception:
+        logger.exception("Open Collective payment verification failed")
+        state = {
+            "state": "error",
+            "message": _("We could not verify your payment with Open Collective."),
+        }
+    set_verification_state(token, state)
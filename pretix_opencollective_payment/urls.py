@@ -1,9 +1,30 @@
 from django.urls import include, re_path
 
-from .views import return_view
+from pretix.multidomain import event_url
+
+from .views import (
+    metrics_view,
+    organizer_dashboard_view,
+    return_view,
+    status_view,
+    webhook_view,
+)
 
 app_name = "pretix_opencollective_payment"
 
+urlpatterns = [
+    re_path(
+        r"^opencollective/metrics/$",
+        metrics_view,
+        name="metrics",
+    ),
+    re_path(
+        r"^control/organizer/(?P<organizer>[^/]+)/opencollective/$",
+        organizer_dashboard_view,
+        name="organizer.dashboard",
+    ),
+]
+
 
 event_patterns = [
     re_path(
@@ -16,7 +37,24 @@ event_patterns = [
                     return_view,
                     name="return",
                 ),
+                event_url(
+                    r"^webhook/$", webhook_view, name="webhook", require_live=False
+                ),
+                re_path(r"^status/$", status_view, name="status"),
+                re_path(
+                    r"w/(?P<cart_namespace>[a-zA-Z0-9]{16})/status/$",
+                    status_view,
+                    name="status",
+                ),
             ]
         ),
     )
 ]
+
+organizer_patterns = [
+    re_path(
+        r"^payment/opencollective/webhook/$",
+        webhook_view,
+        name="webhook.organizer",
+    ),
+]
@@ -1,14 +1,64 @@
+import base64
+import binascii
+import hmac
+import json
+import uuid
+
+from django.conf import settings
 from django.contrib import messages
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import render
 from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django_scopes import scopes_disabled
 
 from pretix.base.payment import PaymentException
+from pretix.control.permissions import organizer_permission_required
 from pretix.helpers.http import redirect_to_url
 from pretix.multidomain.urlreverse import eventreverse
 
+from . import metrics
+from .cache import get_verification_state, set_verification_state
+from .dashboard import event_aggregates, keyset_page, merge_aggregates
+from .models import OpenCollectivePaymentSummary
+from .opencollective import refund_url
 from .payment import OpenCollectivePaymentProvider
+from .tasks import verify_callback
+from .webhooks import process_webhook
+
+
+def _payment_step_redirect(request, kwargs):
+    urlkwargs = {"step": "payment"}
+    if "cart_namespace" in kwargs:
+        urlkwargs["cart_namespace"] = kwargs["cart_namespace"]
+    return redirect_to_url(
+        eventreverse(request.event, "presale:event.checkout", kwargs=urlkwargs)
+    )
+
+
+def _render_verifying(request, kwargs):
+    urlkwargs = {}
+    if "cart_namespace" in kwargs:
+        urlkwargs["cart_namespace"] = kwargs["cart_namespace"]
+    status_url = eventreverse(
+        request.event,
+        "plugins:pretix_opencollective_payment:status",
+        kwargs=urlkwargs,
+    )
+    return render(
+        request,
+        "pretixplugins/opencollective/verifying.html",
+        {"event": request.event, "status_url": status_url},
+    )
 
 
 def return_view(request, *args, **kwargs):
+    with metrics.timer("callback_seconds", view="return") as timer:
+        return _return_view(request, timer, kwargs)
+
+
+def _return_view(request, timer, kwargs):
     provider = OpenCollectivePaymentProvider(request.event)
     redirect_data = {
         "orderId": request.GET.get("orderId"),
@@ -25,21 +75,152 @@ def return_view(request, *args, **kwargs):
         ]
     )
     if not has_order_reference:
+        timer.labels["outcome"] = "missing_reference"
         messages.error(request, _("Missing Open Collective order reference."))
-        urlkwargs = {"step": "payment"}
-        if "cart_namespace" in kwargs:
-            urlkwargs["cart_namespace"] = kwargs["cart_namespace"]
-        return redirect_to_url(
-            eventreverse(request.event, "presale:event.checkout", kwargs=urlkwargs)
+        return _payment_step_redirect(request, kwargs)
+
+    if provider.config.async_verification:
+        token = uuid.uuid4().hex
+        set_verification_state(token, {"state": "queued"})
+        request.session["payment_opencollective_verification"] = token
+        request.session["payment_opencollective_redirect"] = redirect_data
+        verify_callback.apply_async(
+            kwargs={
+                "event": request.event.pk,
+                "token": token,
+                "redirect_data": redirect_data,
+                "payment_id": request.session.get("payment_opencollective_payment"),
+            }
         )
+        timer.labels["outcome"] = "queued"
+        return _render_verifying(request, kwargs)
 
     try:
-        return provider.handle_callback(request, redirect_data)
+        response = provider.handle_callback(request, redirect_data)
     except PaymentException as exc:
+        timer.labels["outcome"] = "rejected"
         messages.error(request, str(exc))
-        urlkwargs = {"step": "payment"}
-        if "cart_namespace" in kwargs:
-            urlkwargs["cart_namespace"] = kwargs["cart_namespace"]
-        return redirect_to_url(
-            eventreverse(request.event, "presale:event.checkout", kwargs=urlkwargs)
-        )
+        return _payment_step_redirect(request, kwargs)
+    timer.labels["outcome"] = "handled"
+    return response
+
+
+def status_view(request, *args, **kwargs):
+    provider = OpenCollectivePaymentProvider(request.event)
+    token = request.session.get("payment_opencollective_verification")
+    state = get_verification_state(token) if token else None
+    if state and state.get("state") == "queued":
+        return _render_verifying(request, kwargs)
+
+    request.session.pop("payment_opencollective_verification", None)
+    try:
+        return provider.finish_verification(request, state)
+    except PaymentException as exc:
+        messages.error(request, str(exc))
+        return _payment_step_redirect(request, kwargs)
+
+
+@csrf_exempt
+@require_POST
+@scopes_disabled()
+def webhook_view(request, *args, **kwargs):
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest("Invalid payload")
+
+    status, message = process_webhook(
+        payload,
+        request.GET.get("secret"),
+        request.organizer,
+        getattr(request, "event", None),
+    )
+    return HttpResponse(message, status=status)
+
+
+def _metrics_authorized(request):
+    user = getattr(request, "user", None)
+    if (
+        user is not None
+        and user.is_authenticated
+        and user.has_active_staff_session(request.session.session_key)
+    ):
+        return True
+
+    # Scrapers can't log in, so they may use the credentials pretix' own
+    # metrics endpoint is configured with.
+    metrics_user = getattr(settings, "METRICS_USER", None)
+    metrics_passphrase = getattr(settings, "METRICS_PASSPHRASE", None)
+    header = request.META.get("HTTP_AUTHORIZATION", "")
+    if not metrics_user or not metrics_passphrase or not header.startswith("Basic "):
+        return False
+    try:
+        credentials = base64.b64decode(header[6:]).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        return False
+    username, _, passphrase = credentials.partition(":")
+    return hmac.compare_digest(username, metrics_user) and hmac.compare_digest(
+        passphrase, metrics_passphrase
+    )
+
+
+@scopes_disabled()
+def metrics_view(request, *args, **kwargs):
+    if not metrics.enabled():
+        raise Http404()
+    if not _metrics_authorized(request):
+        response = HttpResponse("Unauthorized", status=401)
+        response["WWW-Authenticate"] = 'Basic realm="Open Collective metrics"'
+        return response
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@organizer_permission_required(None)
+def organizer_dashboard_view(request, *args, **kwargs):
+    events = request.user.get_events_with_permission("can_view_orders", request).filter(
+        organizer=request.organizer
+    )
+    event_ids = list(events.values_list("pk", flat=True))
+    summary = merge_aggregates(event_aggregates(event_ids).values())
+
+    summaries = OpenCollectivePaymentSummary.objects.filter(
+        event_id__in=event_ids
+    ).select_related("event", "payment", "payment__order")
+    status = request.GET.get("status")
+    if status:
+        summaries = summaries.filter(status=status)
+    mismatches = request.GET.get("mismatch") == "1"
+    if mismatches:
+        summaries = summaries.filter(amount_mismatch=True)
+    try:
+        after = int(request.GET.get("after") or 0)
+    except ValueError:
+        after = 0
+    rows, next_cursor = keyset_page(summaries, after)
+
+    return render(
+        request,
+        "pretixplugins/opencollective/organizer_dashboard.html",
+        {
+            "organizer": request.organizer,
+            "summary": summary,
+            "rows": [
+                (
+                    row,
+                    refund_url(
+                        row.collective_slug, row.transaction_id, row.use_staging
+                    ),
+                )
+                for row in rows
+            ],
+            "status": status or "",
+            "mismatches": mismatches,
+            "next_cursor": next_cursor,
+            "is_first_page": not after,
+        },
+    )
@@ -0,0 +1,90 @@
+import hmac
+import logging
+
+from django.core.cache import cache
+from pretix.base.models import OrderPayment
+from pretix.base.payment import PaymentException
+
+from .models import REFERENCE_ORDER
+from .opencollective import order_reference
+from .payment import OpenCollectivePaymentProvider
+
+logger = logging.getLogger("pretix_opencollective_payment")
+
+WEBHOOK_DEDUPLICATION_TTL = 7 * 24 * 3600
+
+
+def webhook_order_id(payload):
+    data = payload.get("data") or {}
+    order = data.get("order") or {}
+    transaction = data.get("transaction") or {}
+    return order.get("id") or transaction.get("OrderId")
+
+
+def webhook_payments(order_id, organizer, event=None):
+    payments = OrderPayment.objects.filter(
+        provider=OpenCollectivePaymentProvider.identifier,
+        order__event__organizer=organizer,
+        state__in=(
+            OrderPayment.PAYMENT_STATE_CREATED,
+            OrderPayment.PAYMENT_STATE_PENDING,
+        ),
+        opencollective_references__kind=REFERENCE_ORDER,
+        opencollective_references__reference=str(order_id),
+    ).select_related("order", "order__event")
+    if event is not None:
+        payments = payments.filter(order__event=event)
+    return list(payments.distinct())
+
+
+def verify_webhook_secret(provider, secret):
+    expected = provider.config.webhook_secret
+    return bool(expected) and hmac.compare_digest(str(expected), secret or "")
+
+
+def process_webhook(payload, secret, organizer, event=None):
+    order_id = webhook_order_id(payload)
+    if not order_id:
+        return 200, "Not interested in this event type"
+
+    providers = {}
+    payments = []
+    for payment in webhook_payments(order_id, organizer, event):
+        provider = providers.get(payment.order.event_id)
+        if provider is None:
+            provider = providers[payment.order.event_id] = (
+                OpenCollectivePaymentProvider(payment.order.event)
+            )
+        if verify_webhook_secret(provider, secret):
+            payments.append((provider, payment))
+    if not payments:
+        # Unknown orders and wrong secrets look the same from the outside.
+        return 200, "No matching payment"
+
+    dedup_key = None
+    if payload.get("id") is not None:
+        dedup_key = f"pretix_opencollective_webhook:{organizer.pk}:{payload['id']}"
+        if not cache.add(dedup_key, True, WEBHOOK_DEDUPLICATION_TTL):
+            return 200, "Duplicate event"
+
+    for provider, payment in payments:
+        # The payload is not signed, so only use it as a trigger and fetch the
+        # order from Open Collective before touching the payment.
+        try:
+            order_data = provider._refresh_order_by_reference(order_reference(order_id))
+        except PaymentException as exc:
+            logger.warning(
+                "Open Collective webhook for payment %s failed: %s", payment.pk, exc
+            )
+            if dedup_key:
+                cache.delete(dedup_key)
+            return 500, "Could not fetch order"
+        try:
+            provider.apply_order_data(payment, order_data)
+        except PaymentException as exc:
+            logger.info(
+                "Open Collective webhook did not confirm payment %s: %s",
+                payment.pk,
+                exc,
+            )
+    return 200, "OK"
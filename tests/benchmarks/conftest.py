@@ -0,0 +1,145 @@
+import itertools
+import json
+import threading
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from fake_opencollective import FakeOpenCollective
+
+from pretix_opencollective_payment import cache as cache_module
+from pretix_opencollective_payment import client as client_module
+from pretix_opencollective_payment import conf as conf_module
+from pretix_opencollective_payment import config as config_module
+from pretix_opencollective_payment import payment as payment_module
+
+SLUG = "bench-collective"
+RESULTS = pytest.StashKey[list]()
+
+
+class SettingsStub:
+    def __init__(self, *args, **kwargs):
+        self._values = {"collective_slug": SLUG, "token": "bench-token"}
+
+    def get(self, key, as_type=None):
+        return self._values.get(key)
+
+
+class PaymentStub:
+    def __init__(self, manager, pk, event):
+        self.manager = manager
+        self.pk = self.id = pk
+        self.amount = Decimal("10.00")
+        self.state = "created"
+        self.info = None
+        self.confirmations = 0
+        self.order = SimpleNamespace(event=event, code=f"B{pk}", secret="s", status="n")
+
+    def refresh_from_db(self):
+        self.manager.query()
+
+    def save(self, update_fields=None):
+        self.manager.query()
+
+    def confirm(self):
+        self.manager.query()
+        self.confirmations += 1
+        self.state = "confirmed"
+
+
+class PaymentManagerStub:
+    # Stands in for OrderPayment.objects and counts the ORM calls the plugin
+    # makes, since there is no database to count queries on.
+    def __init__(self):
+        self.payments = {}
+        self.queries = 0
+        self.lock = threading.Lock()
+        self.numbers = itertools.count(1)
+
+    def query(self):
+        with self.lock:
+            self.queries += 1
+
+    def create(self, event):
+        payment = PaymentStub(self, next(self.numbers), event)
+        self.payments[payment.pk] = payment
+        return payment
+
+    def select_for_update(self):
+        return self
+
+    def only(self, *fields):
+        return self
+
+    def get(self, pk):
+        self.query()
+        return self.payments[pk]
+
+
+@pytest.fixture
+def payments(monkeypatch):
+    manager = PaymentManagerStub()
+    monkeypatch.setattr(payment_module.OrderPayment, "objects", manager, raising=False)
+    monkeypatch.setattr(
+        payment_module, "index_payment", lambda payment: manager.query()
+    )
+    monkeypatch.setattr(
+        payment_module,
+        "order_claimed_elsewhere",
+        lambda payment, order_data: manager.query() or False,
+    )
+    monkeypatch.setattr(
+        payment_module,
+        "summarize_payment",
+        lambda payment, *args, **kwargs: manager.query(),
+    )
+    return manager
+
+
+@pytest.fixture
+def fake_opencollective(request, monkeypatch, payments):
+    cache_module.cache.clear()
+    cache_module.clear_donation_urls()
+    client_module.close_sessions()
+    monkeypatch.setattr(payment_module, "SettingsSandbox", SettingsStub)
+    for name, value in {"RATE_LIMIT": 0, "RETRY_BACKOFF": 0.01}.items():
+        monkeypatch.setattr(
+            conf_module.settings, f"OPENCOLLECTIVE_{name}", value, raising=False
+        )
+    faults = getattr(request, "param", {})
+    with FakeOpenCollective(
+        slug=SLUG,
+        latency=request.config.getoption("--benchmark-latency"),
+        **faults,
+    ) as fake:
+        monkeypatch.setattr(config_module, "OC_GRAPHQL_BASEURL", fake.graphql_url)
+        monkeypatch.setattr(config_module, "OC_LEGACY_API_BASEURL", fake.legacy_api_url)
+        yield fake
+    client_module.close_sessions()
+
+
+@pytest.fixture
+def benchmark_results(request):
+    return request.config.stash.setdefault(RESULTS, [])
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    results = config.stash.get(RESULTS, [])
+    if not results:
+        return
+    terminalreporter.section("Open Collective benchmarks")
+    for result in results:
+        terminalreporter.write_line(result["scenario"])
+        for key, value in result.items():
+            if key != "scenario":
+                terminalreporter.write_line(f"  {key:<32}{_format(value):>12}")
+    path = config.getoption("--benchmark-json")
+    if path:
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,205 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pretix_opencollective_payment.opencollective import persisted_query
+
+FIELD_PATTERN = re.compile(r"(?:(\w+): )?(order|transaction)\(\w+: \$(\w+)\)")
+LEGACY_PATTERN = re.compile(r"^/v1/collectives/([^/]+)/transactions/([^/?]+)")
+
+# Transactions with this prefix are unknown to GraphQL and only resolve
+# through the legacy REST API, like very old contributions do.
+LEGACY_ONLY_PREFIX = "legacy-"
+TRANSACTION_LEGACY_ID_OFFSET = 1_000_000
+
+
+class FakeOpenCollective:
+    def __init__(
+        self,
+        slug="bench-collective",
+        amount="10.00",
+        currency="USD",
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        slow_rate=0.0,
+        slow_latency=0.0,
+        seed=0,
+    ):
+        self.slug = slug
+        self.amount = amount
+        self.currency = currency
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.queries = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def graphql_url(self):
+        return f"{self.url}/graphql/v2"
+
+    @property
+    def legacy_api_url(self):
+        return f"{self.url}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def order(self, legacy_id):
+        return {
+            "id": f"ord_{legacy_id}",
+            "legacyId": legacy_id,
+            "status": "PAID",
+            "frequency": "ONETIME",
+            "totalAmount": {"value": self.amount, "currency": self.currency},
+            "toAccount": {"slug": self.slug},
+            "fromAccount": {"slug": "backer", "name": "Backer"},
+            "transactions": [
+                {
+                    "id": f"tx_{legacy_id}",
+                    "legacyId": legacy_id + TRANSACTION_LEGACY_ID_OFFSET,
+                    "kind": "CONTRIBUTION",
+                    "type": "CREDIT",
+                }
+            ],
+        }
+
+    def resolve_order(self, reference):
+        if "legacyId" in reference:
+            return self.order(int(reference["legacyId"]))
+        match = re.fullmatch(r"ord_(\d+)", str(reference.get("id")))
+        return self.order(int(match.group(1))) if match else None
+
+    def resolve_transaction(self, reference):
+        if "legacyId" in reference:
+            legacy_id = int(reference["legacyId"]) - TRANSACTION_LEGACY_ID_OFFSET
+            if legacy_id <= 0:
+                return None
+            return {"id": f"tx_{legacy_id}", "order": self.order(legacy_id)}
+        match = re.fullmatch(r"tx_(\d+)", str(reference.get("id")))
+        if not match:
+            return None
+        return {"id": reference["id"], "order": self.order(int(match.group(1)))}
+
+    def graphql(self, body):
+        extensions = body.get("extensions") or {}
+        query_hash = (extensions.get("persistedQuery") or {}).get("sha256Hash")
+        query = body.get("query")
+        with self.lock:
+            if query and query_hash:
+                if persisted_query(query)["persistedQuery"]["sha256Hash"] != query_hash:
+                    return {"errors": [{"message": "provided sha does not match"}]}
+                self.queries[query_hash] = query
+            elif query_hash:
+                query = self.queries.get(query_hash)
+        if not query:
+            return {
+                "errors": [
+                    {
+                        "message": "PersistedQueryNotFound",
+                        "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                    }
+                ]
+            }
+
+        variables = body.get("variables") or {}
+        data = {}
+        errors = []
+        for alias, field, variable in FIELD_PATTERN.findall(query):
+            alias = alias or field
+            resolve = (
+                self.resolve_order if field == "order" else self.resolve_transaction
+            )
+            result = resolve(variables.get(variable) or {})
+            data[alias] = result
+            if result is None:
+                errors.append({"message": f"{field} not found", "path": [alias]})
+        payload = {"data": data}
+        if errors:
+            payload["errors"] = errors
+        return payload
+
+    def legacy_transaction(self, path):
+        match = LEGACY_PATTERN.match(path)
+        if not match or match.group(1) != self.slug:
+            return None
+        transaction_id = match.group(2)
+        if not transaction_id.startswith(LEGACY_ONLY_PREFIX):
+            return None
+        legacy_id = int(transaction_id[len(LEGACY_ONLY_PREFIX) :])
+        return {"result": {"id": transaction_id, "order": {"id": legacy_id}}}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, status, payload, headers=None):
+                content = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _injected_failure(self):
+                with fake.lock:
+                    fake.requests.append((self.command, self.path))
+                    roll = fake.random.random()
+                    slow = fake.random.random() < fake.slow_rate
+                latency = fake.slow_latency if slow else fake.latency
+                if latency:
+                    time.sleep(latency)
+                if roll < fake.throttle_rate:
+                    self._respond(429, {"error": "throttled"}, {"Retry-After": "0"})
+                    return True
+                if roll < fake.throttle_rate + fake.error_rate:
+                    self._respond(503, {"error": "unavailable"})
+                    return True
+                return False
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self._injected_failure():
+                    return
+                self._respond(200, fake.graphql(body))
+
+            def do_GET(self):
+                if self._injected_failure():
+                    return
+                payload = fake.legacy_transaction(self.path)
+                if payload is None:
+                    self._respond(404, {"error": "not found"})
+                else:
+                    self._respond(200, payload)
+
+        return Handler
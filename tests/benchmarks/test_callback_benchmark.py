@@ -0,0 +1,108 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from fake_opencollective import LEGACY_ONLY_PREFIX, TRANSACTION_LEGACY_ID_OFFSET
+
+from pretix_opencollective_payment import metrics
+from pretix_opencollective_payment import views as views_module
+
+pytestmark = pytest.mark.benchmark
+
+# Redirect parameters for every lookup path, and the API calls a callback on
+# that path may cost once connections and persisted queries are warm.
+LOOKUP_PATHS = {
+    "orderId": (lambda n: {"orderId": str(n)}, 1),
+    "orderIdV2": (lambda n: {"orderIdV2": f"ord_{n}"}, 1),
+    "transactionid": (
+        lambda n: {"transactionid": str(n + TRANSACTION_LEGACY_ID_OFFSET)},
+        1,
+    ),
+    "legacy_fallback": (
+        lambda n: {"transactionid": f"{LEGACY_ONLY_PREFIX}{n}"},
+        3,
+    ),
+}
+
+
+def run_callback(payments, event, build_params):
+    payment = payments.create(event)
+    request = SimpleNamespace(
+        event=event,
+        GET=build_params(payment.pk),
+        session={"payment_opencollective_payment": payment.pk},
+        resolver_match=None,
+    )
+    started = time.perf_counter()
+    views_module.return_view(request)
+    return time.perf_counter() - started, payment.state == "confirmed"
+
+
+def run_scenario(config, payments, scenario, build_params):
+    event = SimpleNamespace(
+        pk=1, slug="bench", organizer=SimpleNamespace(slug="bench"), currency="USD"
+    )
+    # One callback per path warms up connections and persisted queries.
+    run_callback(payments, event, build_params)
+    count = config.getoption("--benchmark-callbacks")
+    metrics.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(config.getoption("--benchmark-concurrency")) as pool:
+        outcomes = list(
+            pool.map(
+                lambda _: run_callback(payments, event, build_params), range(count)
+            )
+        )
+    elapsed = time.perf_counter() - started
+    counters = metrics.counters()
+
+    latencies = sorted(duration * 1000 for duration, _ in outcomes)
+    percentiles = statistics.quantiles(latencies, n=100)
+    succeeded = sum(1 for _, confirmed in outcomes if confirmed)
+    return {
+        "scenario": scenario,
+        "callbacks": count,
+        "succeeded": succeeded,
+        "errors": count - succeeded,
+        "p50_ms": percentiles[49],
+        "p95_ms": percentiles[94],
+        "p99_ms": percentiles[98],
+        "throughput": count / elapsed,
+        "api_calls_per_callback": counters.get("api_requests", 0) / count,
+        "retries": counters.get("api_retries", 0),
+        "throttled": counters.get("api_throttled", 0),
+    }
+
+
+@pytest.mark.parametrize("path", list(LOOKUP_PATHS))
+def test_callback_lookup_path(
+    request, fake_opencollective, payments, benchmark_results, path
+):
+    build_params, call_budget = LOOKUP_PATHS[path]
+
+    result = run_scenario(request.config, payments, path, build_params)
+    benchmark_results.append(result)
+
+    assert result["errors"] == 0
+    assert result["api_calls_per_callback"] == call_budget
+
+
+@pytest.mark.parametrize(
+    "fake_opencollective",
+    [{"error_rate": 0.05, "throttle_rate": 0.05}],
+    indirect=True,
+)
+def test_callback_with_upstream_errors(
+    request, fake_opencollective, payments, benchmark_results
+):
+    build_params, _ = LOOKUP_PATHS["orderId"]
+
+    result = run_scenario(
+        request.config, payments, "orderId (5% 503, 5% 429)", build_params
+    )
+    benchmark_results.append(result)
+
+    assert result["succeeded"] >= result["callbacks"] * 0.95
+    assert result["retries"] > 0
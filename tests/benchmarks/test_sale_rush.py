@@ -0,0 +1,140 @@
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from pretix_opencollective_payment import metrics
+from pretix_opencollective_payment import payment as payment_module
+from pretix_opencollective_payment import views as views_module
+
+pytestmark = pytest.mark.benchmark
+
+
+class WorkerPool:
+    # Models the web workers of a deployment: every request occupies one of
+    # them until it returns, and customers queue while all are busy.
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.peak = 0
+        self.busy_time = 0.0
+        self.requests = 0
+
+    def submit(self, func, *args):
+        def run():
+            with self.lock:
+                self.busy += 1
+                self.requests += 1
+                self.peak = max(self.peak, self.busy)
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                    self.busy_time += time.perf_counter() - started
+
+        return self.executor.submit(run)
+
+    def run(self, func, *args):
+        return self.submit(func, *args).result()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def customer(pool, payments, event, duplicate):
+    started = time.perf_counter()
+    session = {}
+    request = SimpleNamespace(event=event, session=session, resolver_match=None)
+    provider = payment_module.OpenCollectivePaymentProvider(event)
+    pool.run(provider.checkout_prepare, request, {"total": Decimal("10.00")})
+
+    # The customer pays on Open Collective and is redirected back, sometimes
+    # twice. The order is only created on the confirm step afterwards.
+    payment = payments.create(event)
+    callback = SimpleNamespace(
+        event=event,
+        session=session,
+        resolver_match=None,
+        GET={"orderId": str(payment.pk), "status": "PAID"},
+    )
+    copies = 2 if duplicate else 1
+    wait([pool.submit(views_module.return_view, callback) for _ in range(copies)])
+
+    session["payment_opencollective_payment"] = payment.pk
+    confirm = payment_module.OpenCollectivePaymentProvider(event)
+    wait(
+        [pool.submit(confirm.execute_payment, request, payment) for _ in range(copies)]
+    )
+    return time.perf_counter() - started, payment, copies
+
+
+@pytest.mark.parametrize(
+    "fake_opencollective",
+    [pytest.param({}, id="rush")],
+    indirect=True,
+)
+def test_sale_rush(request, fake_opencollective, payments, benchmark_results):
+    config = request.config
+    checkouts = config.getoption("--load-checkouts")
+    fake_opencollective.slow_rate = config.getoption("--load-slow-rate")
+    fake_opencollective.slow_latency = config.getoption("--load-slow-latency")
+    duplicates = random.Random(0)
+    plan = [
+        duplicates.random() < config.getoption("--load-duplicate-rate")
+        for _ in range(checkouts)
+    ]
+    event = SimpleNamespace(
+        pk=1, slug="bench", organizer=SimpleNamespace(slug="bench"), currency="USD"
+    )
+    pool = WorkerPool(config.getoption("--load-workers"))
+    metrics.reset()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(config.getoption("--load-clients")) as clients:
+        outcomes = list(
+            clients.map(
+                lambda duplicate: customer(pool, payments, event, duplicate), plan
+            )
+        )
+    elapsed = time.perf_counter() - started
+    pool.shutdown()
+
+    counters = metrics.counters()
+    latencies = sorted(duration * 1000 for duration, _, _ in outcomes)
+    percentiles = statistics.quantiles(latencies, n=100)
+    confirmed = [payment for _, payment, _ in outcomes if payment.state == "confirmed"]
+    callbacks = sum(copies * 2 for _, _, copies in outcomes)
+    result = {
+        "scenario": f"sale rush ({checkouts} checkouts)",
+        "confirmed": len(confirmed),
+        "duplicate_checkouts": sum(plan),
+        "double_confirmations": sum(
+            1 for payment in confirmed if payment.confirmations > 1
+        ),
+        "confirmations_per_second": len(confirmed) / elapsed,
+        "confirmation_p50_ms": percentiles[49],
+        "confirmation_p95_ms": percentiles[94],
+        "confirmation_p99_ms": percentiles[98],
+        "worker_occupancy": pool.busy_time / (pool.workers * elapsed),
+        "peak_busy_workers": pool.peak,
+        "requests": pool.requests,
+        "db_queries_per_callback": payments.queries / callbacks,
+        "upstream_calls_per_confirmed": counters.get("api_requests", 0)
+        / max(len(confirmed), 1),
+        "upstream_retries": counters.get("api_retries", 0),
+        "order_cache_hits": counters.get("order_cache_hit", 0),
+        "single_flight_shared": counters.get("single_flight_shared", 0),
+    }
+    benchmark_results.append(result)
+
+    assert result["confirmed"] == checkouts
+    assert result["double_confirmations"] == 0
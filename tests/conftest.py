@@ -1,16 +1,27 @@
+import contextlib
+from contextlib import ContextDecorator
+from datetime import datetime, timezone
 from decimal import Decimal
 import sys
 import types
 
+import pytest
+
 
 def _install_pretix_stubs():
     pretix_module = types.ModuleType("pretix")
     base_module = types.ModuleType("pretix.base")
     decimal_module = types.ModuleType("pretix.base.decimal")
+    exporter_module = types.ModuleType("pretix.base.exporter")
     forms_module = types.ModuleType("pretix.base.forms")
     models_module = types.ModuleType("pretix.base.models")
     payment_module = types.ModuleType("pretix.base.payment")
+    services_module = types.ModuleType("pretix.base.services")
+    tasks_module = types.ModuleType("pretix.base.services.tasks")
     settings_module = types.ModuleType("pretix.base.settings")
+    celery_app_module = types.ModuleType("pretix.celery_app")
+    control_module = types.ModuleType("pretix.control")
+    permissions_module = types.ModuleType("pretix.control.permissions")
     helpers_module = types.ModuleType("pretix.helpers")
     http_module = types.ModuleType("pretix.helpers.http")
     multidomain_module = types.ModuleType("pretix.multidomain")
@@ -25,6 +36,19 @@ def _install_pretix_stubs():
         def __init__(self, event=None):
             self.event = event
 
+        def settings_form_clean(self, cleaned_data):
+            return cleaned_data
+
+    class BaseExporter:
+        def __init__(self, event, organizer=None):
+            self.event = event
+            self.organizer = organizer
+            self.is_multievent = not hasattr(event, "slug")
+            self.events = event if self.is_multievent else [event]
+
+    class ListExporter(BaseExporter):
+        pass
+
     class PaymentException(Exception):
         pass
 
@@ -32,12 +56,24 @@ def _install_pretix_stubs():
         def __init__(self, *args, **kwargs):
             pass
 
+    class Event:
+        pass
+
     class Order:
         STATUS_PAID = "paid"
 
     class OrderPayment:
         PAYMENT_STATE_CONFIRMED = "confirmed"
         PAYMENT_STATE_PENDING = "pending"
+        PAYMENT_STATE_FAILED = "failed"
+        PAYMENT_STATE_REFUNDED = "refunded"
+
+        class DoesNotExist(Exception):
+            pass
+
+    class OrderRefund:
+        REFUND_STATE_CANCELED = "canceled"
+        REFUND_STATE_FAILED = "failed"
 
     class Quota:
         class QuotaExceededException(Exception):
@@ -53,19 +89,43 @@ def _install_pretix_stubs():
     def redirect_to_url(url):
         return url
 
+    class EventTask:
+        pass
+
+    class CeleryApp:
+        def task(self, *args, **kwargs):
+            def decorator(func):
+                def apply_async(args=(), kwargs=None, **options):
+                    return func(*args, **(kwargs or {}))
+
+                func.apply_async = apply_async
+                return func
+
+            return decorator
+
     def eventreverse(*args, **kwargs):
         return ""
 
     decimal_module.round_decimal = round_decimal
+    exporter_module.BaseExporter = BaseExporter
+    exporter_module.ListExporter = ListExporter
     forms_module.SecretKeySettingsField = DummyField
+    models_module.Event = Event
     models_module.Order = Order
     models_module.OrderPayment = OrderPayment
+    models_module.OrderRefund = OrderRefund
     models_module.Quota = Quota
     payment_module.BasePaymentProvider = BasePaymentProvider
     payment_module.PaymentException = PaymentException
     settings_module.SettingsSandbox = SettingsSandbox
+    tasks_module.EventTask = EventTask
+    celery_app_module.app = CeleryApp()
     http_module.redirect_to_url = redirect_to_url
+    permissions_module.organizer_permission_required = (
+        lambda permission: lambda view: view
+    )
     urlreverse_module.build_absolute_uri = lambda *args, **kwargs: ""
+    urlreverse_module.get_event_domain = lambda event, fallback=False: None
     urlreverse_module.eventreverse = eventreverse
 
     sys.modules.update(
@@ -73,10 +133,16 @@ def _install_pretix_stubs():
             "pretix": pretix_module,
             "pretix.base": base_module,
             "pretix.base.decimal": decimal_module,
+            "pretix.base.exporter": exporter_module,
             "pretix.base.forms": forms_module,
             "pretix.base.models": models_module,
             "pretix.base.payment": payment_module,
+            "pretix.base.services": services_module,
+            "pretix.base.services.tasks": tasks_module,
             "pretix.base.settings": settings_module,
+            "pretix.celery_app": celery_app_module,
+            "pretix.control": control_module,
+            "pretix.control.permissions": permissions_module,
             "pretix.helpers": helpers_module,
             "pretix.helpers.http": http_module,
             "pretix.multidomain": multidomain_module,
@@ -87,26 +153,110 @@ def _install_pretix_stubs():
 
 def _install_django_stubs():
     django_module = types.ModuleType("django")
+    conf_module = types.ModuleType("django.conf")
+    core_module = types.ModuleType("django.core")
+    db_module = types.ModuleType("django.db")
+    transaction_module = types.ModuleType("django.db.transaction")
+    db_models_module = types.ModuleType("django.db.models")
+    cache_module = types.ModuleType("django.core.cache")
     contrib_module = types.ModuleType("django.contrib")
     messages_module = types.ModuleType("django.contrib.messages")
     forms_module = types.ModuleType("django.forms")
+    http_module = types.ModuleType("django.http")
+    shortcuts_module = types.ModuleType("django.shortcuts")
     template_module = types.ModuleType("django.template")
     loader_module = types.ModuleType("django.template.loader")
     utils_module = types.ModuleType("django.utils")
+    dateparse_module = types.ModuleType("django.utils.dateparse")
+    timezone_module = types.ModuleType("django.utils.timezone")
     translation_module = types.ModuleType("django.utils.translation")
+    views_module = types.ModuleType("django.views")
+    decorators_module = types.ModuleType("django.views.decorators")
+    csrf_module = types.ModuleType("django.views.decorators.csrf")
+    views_http_module = types.ModuleType("django.views.decorators.http")
+    scopes_module = types.ModuleType("django_scopes")
 
     messages_module._calls = []
 
     def error(request, message):
         messages_module._calls.append((request, message))
 
+    def warning(request, message):
+        messages_module._calls.append((request, message))
+
     def gettext(value):
         return value
 
+    def render(request, template_name, context=None):
+        return (template_name, context)
+
     class DummyField:
         def __init__(self, *args, **kwargs):
             pass
 
+    class DummyCache:
+        def __init__(self):
+            self._data = {}
+
+        def get(self, key, default=None):
+            return self._data.get(key, default)
+
+        def get_many(self, keys):
+            return {key: self._data[key] for key in keys if key in self._data}
+
+        def set(self, key, value, timeout=None):
+            self._data[key] = value
+
+        def set_many(self, data, timeout=None):
+            self._data.update(data)
+
+        def add(self, key, value, timeout=None):
+            if key in self._data:
+                return False
+            self._data[key] = value
+            return True
+
+        def incr(self, key, delta=1):
+            if key not in self._data:
+                raise ValueError(key)
+            self._data[key] += delta
+            return self._data[key]
+
+        def delete(self, key):
+            self._data.pop(key, None)
+
+        def clear(self):
+            self._data.clear()
+
+    class ValidationError(Exception):
+        pass
+
+    class HttpResponse:
+        def __init__(self, content=b"", status=200, content_type=None):
+            self.content = content
+            self.status_code = status
+            self.headers = {"Content-Type": content_type}
+
+        def __getitem__(self, header):
+            return self.headers[header]
+
+        def __setitem__(self, header, value):
+            self.headers[header] = value
+
+    class Http404(Exception):
+        pass
+
+    class HttpResponseBadRequest(HttpResponse):
+        def __init__(self, content=b""):
+            super().__init__(content, status=400)
+
+    class scopes_disabled(ContextDecorator):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
     class DummyTemplate:
         def render(self, *args, **kwargs):
             return ""
@@ -114,28 +264,105 @@ def _install_django_stubs():
     def get_template(*args, **kwargs):
         return DummyTemplate()
 
+    conf_module.settings = types.SimpleNamespace()
+    cache_module.cache = DummyCache()
+    transaction_module.atomic = contextlib.nullcontext
+    db_module.transaction = transaction_module
+    db_models_module.Model = type("Model", (), {})
+    db_models_module.BooleanField = DummyField
+    db_models_module.CharField = DummyField
+    db_models_module.Count = DummyField
+    db_models_module.DecimalField = DummyField
+    db_models_module.DateTimeField = DummyField
+    db_models_module.ForeignKey = DummyField
+    db_models_module.OneToOneField = DummyField
+    db_models_module.Sum = DummyField
+    db_models_module.TextField = DummyField
+    db_models_module.CASCADE = "CASCADE"
+    db_module.models = db_models_module
     messages_module.error = error
+    messages_module.warning = warning
+    shortcuts_module.render = render
+    http_module.Http404 = Http404
+    http_module.HttpResponse = HttpResponse
+    http_module.HttpResponseBadRequest = HttpResponseBadRequest
+    csrf_module.csrf_exempt = lambda view: view
+    views_http_module.require_POST = lambda view: view
+    scopes_module.scopes_disabled = scopes_disabled
+    dateparse_module.parse_datetime = datetime.fromisoformat
+    timezone_module.now = lambda: datetime.now(timezone.utc)
     translation_module.gettext = gettext
     translation_module.gettext_lazy = gettext
     forms_module.CharField = DummyField
     forms_module.BooleanField = DummyField
     forms_module.EmailField = DummyField
+    forms_module.Textarea = DummyField
+    forms_module.ValidationError = ValidationError
     loader_module.get_template = get_template
     django_module.forms = forms_module
 
     sys.modules.update(
         {
             "django": django_module,
+            "django.conf": conf_module,
+            "django.core": core_module,
+            "django.core.cache": cache_module,
+            "django.db": db_module,
+            "django.db.models": db_models_module,
+            "django.db.transaction": transaction_module,
             "django.contrib": contrib_module,
             "django.contrib.messages": messages_module,
             "django.forms": forms_module,
+            "django.http": http_module,
+            "django.shortcuts": shortcuts_module,
             "django.template": template_module,
             "django.template.loader": loader_module,
             "django.utils": utils_module,
+            "django.utils.dateparse": dateparse_module,
+            "django.utils.timezone": timezone_module,
             "django.utils.translation": translation_module,
+            "django.views": views_module,
+            "django.views.decorators": decorators_module,
+            "django.views.decorators.csrf": csrf_module,
+            "django.views.decorators.http": views_http_module,
+            "django_scopes": scopes_module,
         }
     )
 
 
 _install_pretix_stubs()
 _install_django_stubs()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="Run the callback benchmarks against a local Open Collective stand-in.",
+    )
+    group.addoption("--benchmark-callbacks", type=int, default=200)
+    group.addoption("--benchmark-concurrency", type=int, default=4)
+    group.addoption("--benchmark-latency", type=float, default=0.005)
+    group.addoption(
+        "--benchmark-json", help="Write the benchmark results to this file."
+    )
+    group.addoption("--load-checkouts", type=int, default=2000)
+    group.addoption("--load-clients", type=int, default=128)
+    group.addoption("--load-workers", type=int, default=32)
+    group.addoption("--load-duplicate-rate", type=float, default=0.1)
+    group.addoption("--load-slow-rate", type=float, default=0.05)
+    group.addoption("--load-slow-latency", type=float, default=0.5)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: callback hot path benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,95 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from pretix_opencollective_payment import cache as cache_module
+
+
+def test_order_cache_is_namespaced_per_event_and_environment():
+    order_data = {"id": "ord_1", "status": "PAID"}
+    live = cache_module.OrderCache(SimpleNamespace(pk=1), False)
+    live.set("order", {"id": "ord_1"}, order_data)
+
+    assert live.get("order", {"id": "ord_1"}) == order_data
+    assert (
+        cache_module.OrderCache(SimpleNamespace(pk=1), True).get(
+            "order", {"id": "ord_1"}
+        )
+        is None
+    )
+    assert (
+        cache_module.OrderCache(SimpleNamespace(pk=2), False).get(
+            "order", {"id": "ord_1"}
+        )
+        is None
+    )
+
+
+def test_order_cache_timeout_depends_on_status():
+    assert cache_module.order_cache_timeout("PAID") == 600
+    assert cache_module.order_cache_timeout("PENDING") == 10
+
+
+def test_single_flight_shares_one_call_between_threads():
+    cache_module.cache.clear()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def lookup():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return {"id": "ord_1"}
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(cache_module.single_flight("ord_1", lookup))
+    )
+    leader.start()
+    started.wait(1)
+    follower = threading.Thread(
+        target=lambda: results.append(cache_module.single_flight("ord_1", lookup))
+    )
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert calls == [1]
+    assert results == [{"id": "ord_1"}, {"id": "ord_1"}]
+
+
+def test_single_flight_reuses_result_of_other_worker():
+    cache_module.cache.clear()
+    cache_module.cache.add("pretix_opencollective_flight:ord_2:lock", "other", 20)
+    cache_module.cache.set(
+        "pretix_opencollective_flight:ord_2:result:other", {"result": {"id": "ord_2"}}
+    )
+
+    result = cache_module.single_flight(
+        "ord_2", lambda: pytest.fail("lookup must not run twice")
+    )
+
+    assert result == {"id": "ord_2"}
+
+
+def test_single_flight_ignores_results_of_earlier_leaders(monkeypatch):
+    cache_module.cache.clear()
+    monkeypatch.setattr(cache_module, "SINGLE_FLIGHT_POLL_INTERVAL", 0.01)
+    cache_module.cache.set(
+        "pretix_opencollective_flight:ord_4:result:before", {"result": "stale"}
+    )
+    cache_module.cache.add("pretix_opencollective_flight:ord_4:lock", "current", 20)
+
+    assert cache_module.single_flight("ord_4", lambda: "fresh", timeout=0.1) == "fresh"
+
+
+def test_single_flight_releases_lock_after_call():
+    cache_module.cache.clear()
+
+    result = cache_module.single_flight("ord_3", lambda: {"id": "ord_3"})
+
+    assert result == {"id": "ord_3"}
+    assert cache_module.cache.get("pretix_opencollective_flight:ord_3:lock") is None
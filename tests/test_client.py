@@ -0,0 +1,224 @@
+import threading
+
+import pytest
+
+from pretix_opencollective_payment import client as client_module
+from pretix_opencollective_payment import conf as conf_module
+from pretix_opencollective_payment import metrics
+
+
+def test_get_session_is_shared_per_endpoint():
+    client_module.close_sessions()
+
+    graphql = client_module.get_session("https://api.opencollective.com/graphql/v2")
+    legacy = client_module.get_session(
+        "https://api.opencollective.com/v1/collectives/a/transactions/1"
+    )
+    staging = client_module.get_session("https://staging.opencollective.com/graphql/v2")
+
+    assert graphql is legacy
+    assert graphql is not staging
+
+
+def test_get_session_uses_configured_pool_size(monkeypatch):
+    client_module.close_sessions()
+    monkeypatch.setattr(
+        conf_module.settings,
+        "OPENCOLLECTIVE_HTTP_POOL_SIZE",
+        3,
+        raising=False,
+    )
+
+    client_module.get_session("https://api.opencollective.com/graphql/v2")
+
+    stats = client_module.pool_stats()
+    assert stats["https://api.opencollective.com"] == {
+        "maxsize": 3,
+        "in_use": 0,
+        "connections_opened": 0,
+    }
+    client_module.close_sessions()
+
+
+def test_pool_usage_is_exported_as_gauges(monkeypatch):
+    client_module.close_sessions()
+    monkeypatch.setattr(
+        conf_module.settings,
+        "OPENCOLLECTIVE_HTTP_POOL_SIZE",
+        4,
+        raising=False,
+    )
+    client_module.get_session("https://api.opencollective.com/graphql/v2")
+
+    text = metrics.render_prometheus()
+
+    assert "# TYPE pretix_opencollective_http_pool_size gauge" in text
+    assert (
+        'pretix_opencollective_http_pool_size{endpoint="https://api.opencollective.com"} 4'
+        in text
+    )
+    assert (
+        'pretix_opencollective_http_pool_in_use{endpoint="https://api.opencollective.com"} 0'
+        in text
+    )
+    client_module.close_sessions()
+
+
+def test_session_leaves_retries_to_send_request():
+    client_module.close_sessions()
+
+    session = client_module.get_session("https://api.opencollective.com/graphql/v2")
+
+    retries = session.get_adapter("https://api.opencollective.com").max_retries
+    assert retries.total == 0
+    client_module.close_sessions()
+
+
+def test_circuit_breaker_opens_after_consecutive_failures(monkeypatch):
+    client_module.cache.clear()
+    clock = [1000.0]
+    monkeypatch.setattr(client_module.time, "time", lambda: clock[0])
+    breaker = client_module.CircuitBreaker("https://api.opencollective.com/graphql/v2")
+
+    for _ in range(client_module.DEFAULT_CIRCUIT_FAILURE_THRESHOLD):
+        assert breaker.allow_request()
+        breaker.record_failure()
+
+    assert not breaker.allow_request()
+    assert client_module.circuit_states()["https://api.opencollective.com"] == {
+        "graphql": {"state": "open", "failures": 5, "opened_at": 1000.0},
+        "legacy": {"state": "closed", "failures": 0, "opened_at": None},
+    }
+
+
+def test_legacy_api_failures_leave_the_graphql_circuit_closed():
+    client_module.cache.clear()
+    legacy = client_module.CircuitBreaker(
+        "https://api.opencollective.com/v1/collectives/a/transactions/1"
+    )
+    for _ in range(client_module.DEFAULT_CIRCUIT_FAILURE_THRESHOLD):
+        legacy.record_failure()
+
+    graphql = client_module.CircuitBreaker("https://api.opencollective.com/graphql/v2")
+    assert not legacy.allow_request()
+    assert graphql.allow_request()
+
+    text = metrics.render_prometheus()
+    assert (
+        'pretix_opencollective_circuit_state{api="legacy",'
+        'endpoint="https://api.opencollective.com",state="open"} 1' in text
+    )
+    assert (
+        'pretix_opencollective_circuit_state{api="graphql",'
+        'endpoint="https://api.opencollective.com",state="closed"} 1' in text
+    )
+
+
+def test_circuit_breaker_half_opens_for_a_single_probe(monkeypatch):
+    client_module.cache.clear()
+    clock = [1000.0]
+    monkeypatch.setattr(client_module.time, "time", lambda: clock[0])
+    breaker = client_module.CircuitBreaker("https://api.opencollective.com/graphql/v2")
+    for _ in range(client_module.DEFAULT_CIRCUIT_FAILURE_THRESHOLD):
+        breaker.record_failure()
+
+    clock[0] += client_module.DEFAULT_CIRCUIT_RESET_TIMEOUT
+    assert breaker.state()["state"] == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state() == {"state": "closed", "failures": 0, "opened_at": None}
+    assert breaker.allow_request()
+
+
+class ResponseStub:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise client_module.HTTPError(response=self)
+
+
+def test_send_request_retries_rate_limited_requests(monkeypatch):
+    client_module.cache.clear()
+    client_module.metrics.reset()
+    responses = [ResponseStub(429, {"Retry-After": "1"}), ResponseStub(200)]
+    sleeps = []
+
+    class SessionStub:
+        def request(self, method, url, **kwargs):
+            return responses.pop(0)
+
+    monkeypatch.setattr(client_module, "get_session", lambda url: SessionStub())
+    monkeypatch.setattr(client_module.time, "sleep", sleeps.append)
+
+    response = client_module.send_request(
+        "POST", "https://api.opencollective.com/graphql/v2"
+    )
+
+    assert response.status_code == 200
+    assert sleeps == [1.0]
+    assert client_module.metrics.counters() == {
+        "api_requests": 2,
+        "api_throttled": 1,
+        "api_retries": 1,
+    }
+
+
+def test_count_requests_only_counts_calls_of_the_current_thread(monkeypatch):
+    client_module.cache.clear()
+
+    class SessionStub:
+        def request(self, method, url, **kwargs):
+            return ResponseStub(200)
+
+    monkeypatch.setattr(client_module, "get_session", lambda url: SessionStub())
+    url = "https://api.opencollective.com/graphql/v2"
+
+    with client_module.count_requests() as outer:
+        client_module.send_request("POST", url)
+        with client_module.count_requests() as inner:
+            client_module.send_request("POST", url)
+        other = threading.Thread(target=client_module.send_request, args=("GET", url))
+        other.start()
+        other.join()
+
+    assert (outer.count, inner.count) == (2, 1)
+
+
+def test_send_request_does_not_retry_client_errors(monkeypatch):
+    client_module.cache.clear()
+    calls = []
+
+    class SessionStub:
+        def request(self, method, url, **kwargs):
+            calls.append(method)
+            return ResponseStub(401)
+
+    monkeypatch.setattr(client_module, "get_session", lambda url: SessionStub())
+
+    with pytest.raises(client_module.HTTPError):
+        client_module.send_request("POST", "https://api.opencollective.com/graphql/v2")
+
+    assert calls == ["POST"]
+
+
+def test_retry_delay_uses_jittered_exponential_backoff(monkeypatch):
+    monkeypatch.setattr(client_module.random, "uniform", lambda low, high: high)
+
+    assert client_module.retry_delay(0) == 0.5
+    assert client_module.retry_delay(2) == 2.0
+    assert client_module.retry_delay(0, ResponseStub(429, {"Retry-After": "3"})) == 3
+
+
+def test_rate_limiter_refuses_when_window_is_exhausted(monkeypatch):
+    client_module.cache.clear()
+    monkeypatch.setattr(client_module.time, "time", lambda: 1005.0)
+    limiter = client_module.RateLimiter("https://api.opencollective.com/graphql/v2")
+
+    allowed = [limiter.acquire(max_wait=0) for _ in range(16)]
+
+    assert allowed == [True] * 15 + [False]
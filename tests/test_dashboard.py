@@ -0,0 +1,95 @@
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import cache as cache_module
+from pretix_opencollective_payment import dashboard as dashboard_module
+
+
+def build_payment(amount="10.00", info=None):
+    return SimpleNamespace(
+        amount=Decimal(amount),
+        info=json.dumps(info) if info else None,
+        info_data=info or {},
+        order=SimpleNamespace(event=SimpleNamespace(pk=3, currency="USD")),
+    )
+
+
+def test_summary_fields_flag_amount_mismatches():
+    payment = build_payment(
+        info={
+            "order_id": 919699,
+            "transaction_id": 11503420,
+            "status": "PAID",
+            "amount": {"value": "10.00", "currency": "USD"},
+            "collective_slug": "my-collective",
+        }
+    )
+
+    fields = dashboard_module.summary_fields(payment)
+    rejected = dashboard_module.summary_fields(
+        payment,
+        {
+            "legacyId": 5,
+            "status": "PAID",
+            "totalAmount": {"value": 12, "currency": "USD"},
+        },
+        rejection="amount",
+    )
+
+    assert fields["order_id"] == "919699"
+    assert fields["amount_mismatch"] is False
+    assert fields["collective_slug"] == "my-collective"
+    assert rejected["order_id"] == "5"
+    assert rejected["amount"] == Decimal("12")
+    assert rejected["amount_mismatch"] is True
+    assert rejected["rejection"] == "amount"
+
+
+def test_event_aggregates_are_cached_per_event(monkeypatch):
+    cache_module.cache.clear()
+    computed = []
+
+    def compute(event_ids):
+        computed.append(list(event_ids))
+        return {
+            event_id: {
+                "payments": 2,
+                "mismatches": 1,
+                "statuses": {"PAID": 1, "PENDING": 1},
+                "received": {"USD": "10.00"},
+            }
+            for event_id in event_ids
+        }
+
+    monkeypatch.setattr(dashboard_module, "_compute_aggregates", compute)
+
+    dashboard_module.event_aggregates([1])
+    merged = dashboard_module.merge_aggregates(
+        dashboard_module.event_aggregates([1, 2]).values()
+    )
+
+    assert computed == [[1], [2]]
+    assert merged["payments"] == 4
+    assert merged["statuses"] == {"PAID": 2, "PENDING": 2}
+    assert merged["received"] == {"USD": Decimal("20.00")}
+
+
+def test_keyset_page_continues_below_cursor():
+    class QuerySetStub(list):
+        def filter(self, pk__lt):
+            return QuerySetStub(row for row in self if row.pk < pk__lt)
+
+        def order_by(self, field):
+            return QuerySetStub(sorted(self, key=lambda row: -row.pk))
+
+    rows = QuerySetStub(SimpleNamespace(pk=pk) for pk in range(1, 6))
+
+    first, cursor = dashboard_module.keyset_page(rows, size=2)
+    second, next_cursor = dashboard_module.keyset_page(rows, cursor, size=2)
+    last, end = dashboard_module.keyset_page(rows, next_cursor, size=2)
+
+    assert [row.pk for row in first] == [5, 4]
+    assert [row.pk for row in second] == [3, 2]
+    assert [row.pk for row in last] == [1]
+    assert end is None
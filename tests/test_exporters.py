@@ -0,0 +1,146 @@
+import io
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import exporters as exporters_module
+
+CREATED = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+V2_INFO = {
+    "version": 2,
+    "order_id": 919699,
+    "order_v2_id": "a1b2",
+    "transaction_id": 4242,
+    "status": "PAID",
+    "amount": {"value": "25.00", "currency": "EUR"},
+    "from_account": {"slug": "jane", "name": "Jane"},
+}
+
+LEGACY_INFO = {
+    "order_id": 1000,
+    "transaction_id": 7,
+    "status": "PAID",
+    "order": {
+        "id": "x9",
+        "legacyId": 1000,
+        "totalAmount": {"value": 10, "currency": "EUR"},
+        "fromAccount": {"slug": "joe", "name": "Joe"},
+    },
+}
+
+
+class QuerySetStub:
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+
+    def filter(self, **kwargs):
+        self.calls.append(("filter", kwargs))
+        return self
+
+    def order_by(self, *fields):
+        return self
+
+    def values_list(self, *fields):
+        self.calls.append(("values_list", fields))
+        return self
+
+    def iterator(self, chunk_size=None):
+        self.calls.append(("iterator", chunk_size))
+        return iter(self.rows)
+
+    def __iter__(self):
+        raise AssertionError("exports must stream through iterator()")
+
+
+def install_payments(monkeypatch, rows):
+    calls = []
+    monkeypatch.setattr(
+        exporters_module.OrderPayment,
+        "objects",
+        QuerySetStub(rows, calls),
+        raising=False,
+    )
+    return calls
+
+
+def payment_row(local_id, info):
+    return (
+        "conf",
+        "EUR",
+        "ABC12",
+        local_id,
+        CREATED,
+        "confirmed",
+        Decimal("25.00"),
+        json.dumps(info) if info is not None else None,
+    )
+
+
+def test_payment_export_rows_stream_v2_and_legacy_info(monkeypatch):
+    calls = install_payments(
+        monkeypatch,
+        [payment_row(1, V2_INFO), payment_row(2, LEGACY_INFO), payment_row(3, None)],
+    )
+
+    rows = list(exporters_module.payment_export_rows(["event"], chunk_size=50))
+
+    assert ("iterator", 50) in calls
+    assert calls[0] == (
+        "filter",
+        {"order__event__in": ["event"], "provider": "opencollective"},
+    )
+    assert rows[0]["payment"] == "ABC12-P-1"
+    assert rows[0]["oc_order_id"] == 919699
+    assert rows[0]["oc_transaction_id"] == 4242
+    assert rows[0]["oc_amount"] == "25.00"
+    assert rows[0]["from_account_name"] == "Jane"
+    assert rows[1]["oc_order_v2_id"] == "x9"
+    assert rows[1]["oc_amount"] == "10"
+    assert rows[1]["from_account_slug"] == "joe"
+    assert rows[2]["oc_order_id"] is None
+    assert rows[2]["amount"] == "25.00"
+
+
+def test_list_exporter_yields_header_and_blank_cells(monkeypatch):
+    install_payments(monkeypatch, [payment_row(3, None)])
+    exporter = exporters_module.OpenCollectivePaymentExporter(
+        SimpleNamespace(slug="conf")
+    )
+
+    header, row = list(exporter.iterate_list({}))
+
+    assert len(header) == len(row) == len(exporters_module.EXPORT_COLUMNS)
+    assert header[7] == "Open Collective order ID"
+    assert row[7] == ""
+    assert exporter.get_filename() == "conf_opencollective_payments"
+
+
+def test_json_exporter_renders_organizer_export(monkeypatch):
+    install_payments(monkeypatch, [payment_row(1, V2_INFO), payment_row(2, V2_INFO)])
+    exporter = exporters_module.OpenCollectivePaymentJSONExporter(
+        ["event"], SimpleNamespace(slug="org")
+    )
+
+    filename, content_type, data = exporter.render({})
+
+    assert filename == "org_opencollective_payments.json"
+    assert content_type == "application/json"
+    assert [row["payment"] for row in json.loads(data)] == ["ABC12-P-1", "ABC12-P-2"]
+
+
+def test_json_exporter_streams_into_output_file(monkeypatch):
+    install_payments(monkeypatch, [payment_row(1, V2_INFO), payment_row(2, V2_INFO)])
+    exporter = exporters_module.OpenCollectivePaymentJSONExporter(
+        ["event"], SimpleNamespace(slug="org")
+    )
+    output = io.BytesIO()
+
+    filename, content_type, data = exporter.render({}, output_file=output)
+
+    assert filename == "org_opencollective_payments.json"
+    assert data is None
+    rows = json.loads(output.getvalue())
+    assert [row["payment"] for row in rows] == ["ABC12-P-1", "ABC12-P-2"]
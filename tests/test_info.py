@@ -0,0 +1,55 @@
+from pretix_opencollective_payment import info as info_module
+
+ORDER_DATA = {
+    "id": "8a4y9dmk",
+    "legacyId": 919699,
+    "status": "PAID",
+    "frequency": "ONETIME",
+    "totalAmount": {"value": 10, "currency": "USD"},
+    "amount": {"value": 10, "currency": "USD"},
+    "toAccount": {"slug": "ubucon-asia"},
+    "fromAccount": {"slug": "jane", "name": "Jane"},
+    "transactions": [
+        {"id": "tx_1", "legacyId": 1, "kind": "CONTRIBUTION", "type": "CREDIT"},
+        {"id": "tx_2", "legacyId": 2, "kind": "PLATFORM_TIP", "type": "CREDIT"},
+        {"id": "tx_3", "legacyId": 3, "kind": "CONTRIBUTION", "type": "DEBIT"},
+    ],
+}
+
+
+def test_compact_order_keeps_fields_needed_for_validation():
+    compact = info_module.compact_order(ORDER_DATA)
+
+    assert compact["totalAmount"] == {"value": 10, "currency": "USD"}
+    assert compact["toAccount"] == {"slug": "ubucon-asia"}
+    assert compact["transactions"] == [
+        {"id": "tx_1", "legacyId": 1, "kind": "CONTRIBUTION", "type": "CREDIT"}
+    ]
+    assert "amount" not in compact
+
+
+def test_compact_info_converts_legacy_payloads():
+    legacy_info = {
+        "order_id": 919699,
+        "transaction_id": 1,
+        "status": "PAID",
+        "order": ORDER_DATA,
+        "redirect": {"orderId": "919699"},
+        "collective_slug": "ubucon-asia",
+        "use_staging": False,
+    }
+
+    assert info_module.compact_info(legacy_info) == {
+        "version": 2,
+        "order_id": 919699,
+        "order_v2_id": "8a4y9dmk",
+        "amount": {"value": "10", "currency": "USD"},
+        "from_account": {"slug": "jane", "name": "Jane"},
+        "transaction_id": 1,
+        "status": "PAID",
+        "collective_slug": "ubucon-asia",
+        "use_staging": False,
+        "idempotency_key": None,
+    }
+    compact = info_module.compact_info(legacy_info)
+    assert info_module.compact_info(compact) is compact
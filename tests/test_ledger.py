@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import ledger as ledger_module
+
+
+def build_payment(order_id, amount="10.00", currency="USD"):
+    return SimpleNamespace(
+        info="payload",
+        info_data={"order_id": order_id},
+        amount=Decimal(amount),
+        order=SimpleNamespace(event=SimpleNamespace(currency=currency)),
+    )
+
+
+def build_transaction(legacy_id, value=10, currency="USD"):
+    return {
+        "legacyId": legacy_id * 10,
+        "amount": {"value": value, "currency": currency},
+        "order": {"id": f"ord_{legacy_id}", "legacyId": legacy_id},
+    }
+
+
+def test_iter_ledger_pages_follows_offset_cursor():
+    requests = []
+    pages = {
+        0: [build_transaction(1), build_transaction(2)],
+        2: [build_transaction(3)],
+    }
+
+    class ProviderStub:
+        def _graphql_request(self, query, variables):
+            requests.append(variables["offset"])
+            return {
+                "transactions": {
+                    "totalCount": 3,
+                    "nodes": pages[variables["offset"]],
+                }
+            }
+
+    result = list(ledger_module.iter_ledger_pages(ProviderStub(), "slug", page_size=2))
+
+    assert requests == [0, 2]
+    assert [(len(page.transactions), page.cursor) for page in result] == [
+        (2, 2),
+        (1, 3),
+    ]
+
+
+def test_match_transactions_requires_reference_amount_and_currency():
+    matching = build_payment(1)
+    wrong_amount = build_payment(2, amount="20.00")
+    wrong_currency = build_payment(3, currency="EUR")
+    transactions = [build_transaction(1), build_transaction(2), build_transaction(3)]
+
+    matches = ledger_module.match_transactions(
+        transactions, [matching, wrong_amount, wrong_currency]
+    )
+
+    assert matches == [(matching, transactions[0])]
+
+
+class SyncSettingsStub:
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key, as_type=None):
+        return self._values.get(key)
+
+    def set(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        self._values.pop(key, None)
+
+
+class SyncProviderStub:
+    def __init__(self, ledger):
+        self.settings = SyncSettingsStub()
+        self.ledger = ledger
+        self.date_froms = []
+        self.config = SimpleNamespace(slugs=frozenset({"my-collective"}))
+
+    def _graphql_request(self, query, variables):
+        date_from = variables["dateFrom"]
+        self.date_froms.append(date_from)
+        nodes = [
+            tx
+            for tx in self.ledger
+            if date_from is None or tx["createdAt"] >= date_from
+        ]
+        return {"transactions": {"totalCount": len(nodes), "nodes": nodes}}
+
+
+def build_synced_transaction(legacy_id, created_at):
+    transaction = build_transaction(legacy_id)
+    transaction.update({"id": f"tx_{legacy_id}", "createdAt": created_at})
+    return transaction
+
+
+def test_sync_ledger_only_fetches_newer_transactions():
+    ledger = [
+        build_synced_transaction(1, "2026-01-01T10:00:00+00:00"),
+        build_synced_transaction(2, "2026-01-01T11:00:00+00:00"),
+    ]
+    provider = SyncProviderStub(ledger)
+    payment = build_payment(3)
+
+    assert ledger_module.sync_ledger(provider, [payment], None) == []
+    ledger.append(build_synced_transaction(3, "2026-01-01T11:00:00+00:00"))
+    matches = ledger_module.sync_ledger(provider, [payment], None)
+
+    assert provider.date_froms == [None, "2026-01-01T11:00:00+00:00"]
+    assert matches == [(payment, ledger[2])]
+    assert ledger_module.get_sync_state(provider) == {
+        "my-collective": {
+            "created_at": "2026-01-01T11:00:00+00:00",
+            "ids": ["tx_2", "tx_3"],
+        }
+    }
+
+    ledger_module.reset_sync_state(provider, "my-collective")
+    assert ledger_module.get_sync_state(provider) == {}
+
+
+def test_sync_ledger_does_not_reach_back_past_the_window():
+    ledger = [build_synced_transaction(1, "2026-01-01T10:00:00+00:00")]
+    provider = SyncProviderStub(ledger)
+    ledger_module.sync_ledger(provider, [], None)
+    window = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+    ledger_module.sync_ledger(provider, [], window)
+
+    assert provider.date_froms == [None, window.isoformat()]
@@ -0,0 +1,197 @@
+import fnmatch
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import conf as conf_module
+from pretix_opencollective_payment import metrics
+
+
+class SinkStub:
+    events = []
+
+    def incr(self, name, value, labels):
+        self.events.append(("incr", name, value, labels))
+
+    def observe(self, name, value, labels):
+        self.events.append(("observe", name, value, labels))
+
+
+def test_render_prometheus_includes_counters_and_histograms():
+    metrics.reset()
+    metrics.incr("api_requests", 2)
+    metrics.incr("upstream_responses", api="graphql", status=200)
+    metrics.observe("lookup_seconds", 0.03, strategy="order_id")
+    metrics.observe("lookup_seconds", 20, strategy="order_id")
+
+    text = metrics.render_prometheus()
+
+    assert metrics.counters() == {"api_requests": 2}
+    assert "# TYPE pretix_opencollective_api_requests_total counter" in text
+    assert "pretix_opencollective_api_requests_total 2" in text
+    assert (
+        'pretix_opencollective_upstream_responses_total{api="graphql",status="200"} 1'
+        in text
+    )
+    assert (
+        'pretix_opencollective_lookup_seconds_bucket{strategy="order_id",le="0.05"} 1'
+        in text
+    )
+    assert (
+        'pretix_opencollective_lookup_seconds_bucket{strategy="order_id",le="+Inf"} 2'
+        in text
+    )
+    assert 'pretix_opencollective_lookup_seconds_count{strategy="order_id"} 2' in text
+
+
+def test_disabled_metrics_only_keep_plain_counters(monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(
+        conf_module.settings, "OPENCOLLECTIVE_METRICS", False, raising=False
+    )
+
+    with metrics.timer("confirm_seconds") as timer:
+        timer.labels["outcome"] = "paid"
+    metrics.incr("payment_outcomes", outcome="confirmed", reason="paid")
+    metrics.incr("api_requests")
+
+    assert metrics.histograms() == {}
+    assert metrics.counters() == {"api_requests": 1}
+    assert "payment_outcomes" not in metrics.render_prometheus()
+
+
+def test_events_are_forwarded_to_configured_sink(monkeypatch):
+    metrics.reset()
+    SinkStub.events = []
+    monkeypatch.setattr(
+        conf_module.settings,
+        "OPENCOLLECTIVE_METRICS_SINK",
+        f"{__name__}.SinkStub",
+        raising=False,
+    )
+
+    metrics.incr("payment_outcomes", outcome="pending", reason="processing")
+    with metrics.timer("callback_seconds", view="return") as timer:
+        timer.labels["outcome"] = "handled"
+
+    assert SinkStub.events[0] == (
+        "incr",
+        "payment_outcomes",
+        1,
+        {"outcome": "pending", "reason": "processing"},
+    )
+    assert SinkStub.events[1][:2] == ("observe", "callback_seconds")
+    assert SinkStub.events[1][3] == {"view": "return", "outcome": "handled"}
+
+
+class RedisStub:
+    def __init__(self):
+        self.hash = {}
+
+    def hincrbyfloat(self, key, field, value):
+        fields = self.hash.setdefault(key, {})
+        fields[field.encode()] = float(fields.get(field.encode(), 0)) + value
+
+    def hgetall(self, key):
+        return {
+            field: str(value).encode()
+            for field, value in self.hash.get(key, {}).items()
+        }
+
+    def hset(self, key, mapping):
+        fields = self.hash.setdefault(key, {})
+        fields.update((field.encode(), value) for field, value in mapping.items())
+
+    def expire(self, key, seconds):
+        pass
+
+    def scan_iter(self, match):
+        return [key.encode() for key in self.hash if fnmatch.fnmatch(key, match)]
+
+    def delete(self, key):
+        self.hash.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+
+def test_render_prometheus_aggregates_workers_through_redis(monkeypatch):
+    redis = RedisStub()
+    monkeypatch.setattr(conf_module.settings, "HAS_REDIS", True, raising=False)
+    monkeypatch.setitem(
+        sys.modules,
+        "django_redis",
+        SimpleNamespace(get_redis_connection=lambda alias: redis),
+    )
+    metrics.reset()
+    metrics.incr("api_requests")
+    metrics.observe("lookup_seconds", 0.03, strategy="order_id")
+    # Measurements are batched and only written when the scrape flushes them.
+    assert redis.hash == {}
+    # Measurements of another worker only reach this one through redis.
+    redis.hincrbyfloat(
+        metrics.REDIS_KEY, metrics._field("counter", ("api_requests", ())), 2
+    )
+
+    text = metrics.render_prometheus()
+
+    assert "pretix_opencollective_api_requests_total 3" in text
+    assert (
+        'pretix_opencollective_lookup_seconds_bucket{strategy="order_id",le="0.05"} 1'
+        in text
+    )
+    assert 'pretix_opencollective_lookup_seconds_count{strategy="order_id"} 1' in text
+
+
+def test_measurements_are_flushed_to_redis_after_the_interval(monkeypatch):
+    redis = RedisStub()
+    monkeypatch.setattr(conf_module.settings, "HAS_REDIS", True, raising=False)
+    monkeypatch.setitem(
+        sys.modules,
+        "django_redis",
+        SimpleNamespace(get_redis_connection=lambda alias: redis),
+    )
+    metrics.reset()
+    metrics.incr("api_requests")
+    metrics.incr("api_requests")
+    assert redis.hash == {}
+
+    monkeypatch.setattr(metrics, "_last_flush", time.monotonic() - 60)
+    metrics.incr("api_requests")
+
+    field = metrics._field("counter", ("api_requests", ())).encode()
+    assert redis.hash[metrics.REDIS_KEY] == {field: 3.0}
+
+
+def test_worker_gauges_are_reported_per_worker_through_redis(monkeypatch):
+    redis = RedisStub()
+    monkeypatch.setattr(conf_module.settings, "HAS_REDIS", True, raising=False)
+    monkeypatch.setitem(
+        sys.modules,
+        "django_redis",
+        SimpleNamespace(get_redis_connection=lambda alias: redis),
+    )
+    metrics.reset()
+
+    def collect():
+        return [("queue_depth", {"queue": "default"}, 2)]
+
+    monkeypatch.setattr(metrics, "_gauges", [(collect, True)])
+    # Another worker flushed its gauges before.
+    redis.hset(
+        metrics._worker_key(1),
+        mapping={metrics._field("gauge", ("queue_depth", (("queue", "default"),))): 5},
+    )
+
+    text = metrics.render_prometheus()
+
+    assert "# TYPE pretix_opencollective_queue_depth gauge" in text
+    assert 'pretix_opencollective_queue_depth{queue="default",worker="1"} 5' in text
+    assert (
+        f'pretix_opencollective_queue_depth{{queue="default",worker="{os.getpid()}"}} 2'
+        in text
+    )
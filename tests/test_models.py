@@ -0,0 +1,29 @@
+from pretix_opencollective_payment import models as models_module
+
+
+def test_payment_references_collects_order_and_transaction_ids():
+    info_data = {
+        "order_id": 919699,
+        "transaction_id": 11503420,
+        "order": {
+            "id": "8a4y9dmk-0vjrqwe3-dexzxl5g-7pnbeg3o",
+            "legacyId": 919699,
+            "transactions": [
+                {"id": "tx_credit", "legacyId": 11503420},
+                {"id": "tx_debit", "legacyId": 11503421},
+            ],
+        },
+    }
+
+    assert models_module.payment_references(info_data) == {
+        ("order", "919699"),
+        ("order", "8a4y9dmk-0vjrqwe3-dexzxl5g-7pnbeg3o"),
+        ("transaction", "11503420"),
+        ("transaction", "tx_credit"),
+        ("transaction", "tx_debit"),
+        ("transaction", "11503421"),
+    }
+
+
+def test_payment_references_ignores_empty_info():
+    assert models_module.payment_references({}) == set()
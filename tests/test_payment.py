@@ -1,8 +1,14 @@
+import json
 from decimal import Decimal
 from decimal import Decimal
 from types import SimpleNamespace
 import urllib.parse
 
+import pytest
+
+from pretix_opencollective_payment import cache as cache_module
+from pretix_opencollective_payment import client as client_module
+from pretix_opencollective_payment import metrics
 from pretix_opencollective_payment import payment as payment_module
 
 
@@ -21,7 +27,12 @@ def build_provider(settings_values, currency="USD"):
     provider = payment_module.OpenCollectivePaymentProvider.__new__(
         payment_module.OpenCollectivePaymentProvider
     )
-    provider.event = SimpleNamespace(currency=currency)
+    provider.event = SimpleNamespace(
+        pk=1,
+        slug="conference",
+        organizer=SimpleNamespace(slug="organizer"),
+        currency=currency,
+    )
     provider.settings = SettingsStub(settings_values)
     return provider
 
@@ -30,7 +41,32 @@ def build_request(event):
     return SimpleNamespace(event=event, resolver_match=None)
 
 
+def test_config_is_resolved_once_until_settings_are_saved():
+    values = {"collective_slug": "/collective/", "event_slug": "event", "token": "a"}
+    lookups = []
+
+    class CountingSettings(SettingsStub):
+        def get(self, key, as_type=None):
+            lookups.append(key)
+            return super().get(key, as_type)
+
+    provider = build_provider({})
+    provider.settings = CountingSettings(values)
+
+    assert provider.config.slugs == {"collective", "event"}
+    assert provider.config.graphql_url == "https://api.opencollective.com/graphql/v2"
+    resolved = len(lookups)
+    provider._order_cache()
+    provider._build_donation_url(build_request(provider.event), Decimal("5"), None)
+    assert len(lookups) == resolved
+
+    values["token"] = "b"
+    provider.settings_form_clean({})
+    assert provider.config.token == "b"
+
+
 def test_build_donation_url_uses_production_and_no_memo(monkeypatch):
+    cache_module.clear_donation_urls()
     provider = build_provider(
         {"collective_slug": "my-collective", "use_staging": False}
     )
@@ -54,6 +90,7 @@ def test_build_donation_url_uses_production_and_no_memo(monkeypatch):
 
 
 def test_build_donation_url_uses_staging_when_enabled(monkeypatch):
+    cache_module.clear_donation_urls()
     provider = build_provider({"collective_slug": "my-collective", "use_staging": True})
     redirect_url = "https://pretix.example.com/return/"
     monkeypatch.setattr(
@@ -73,6 +110,141 @@ def test_build_donation_url_uses_staging_when_enabled(monkeypatch):
     assert url == expected
 
 
+def test_build_donation_url_reuses_template_per_event_and_namespace(monkeypatch):
+    cache_module.clear_donation_urls()
+    reversed_kwargs = []
+
+    def build_absolute_uri(event, url, kwargs=None):
+        reversed_kwargs.append(kwargs)
+        return "https://pretix.example.com/" + kwargs.get("cart_namespace", "")
+
+    monkeypatch.setattr(payment_module, "build_absolute_uri", build_absolute_uri)
+    provider = build_provider({"collective_slug": "my-collective"})
+    request = build_request(provider.event)
+    cart_request = SimpleNamespace(
+        event=provider.event,
+        resolver_match=SimpleNamespace(kwargs={"cart_namespace": "widget"}),
+    )
+
+    first = provider._build_donation_url(request, Decimal("10.00"), None)
+    second = provider._build_donation_url(request, Decimal("25.00"), None)
+    in_widget = provider._build_donation_url(cart_request, Decimal("10.00"), None)
+    renamed = build_provider({"collective_slug": "renamed"})
+    moved = renamed._build_donation_url(request, Decimal("10.00"), None)
+    monkeypatch.setattr(
+        cache_module, "get_event_domain", lambda event, fallback=False: "tickets.test"
+    )
+    on_domain = provider._build_donation_url(request, Decimal("10.00"), None)
+
+    assert first.startswith("https://opencollective.com/my-collective/donate/10?")
+    assert second.startswith("https://opencollective.com/my-collective/donate/25?")
+    assert in_widget.endswith(
+        urllib.parse.quote("https://pretix.example.com/widget", safe="")
+    )
+    assert moved.startswith("https://opencollective.com/renamed/donate/10?")
+    assert on_domain.startswith("https://opencollective.com/my-collective/donate/10?")
+    assert reversed_kwargs == [{}, {"cart_namespace": "widget"}, {}, {}]
+
+
+ROUTING_RULES = """
+# Workshops are run by a partner collective
+product:12 = /partner-collective/
+subevent:3 = day-two
+channel:box_office = box-office
+"""
+
+
+def test_routing_rules_resolve_through_slug_index():
+    provider = build_provider(
+        {"collective_slug": "my-collective", "routing_rules": ROUTING_RULES}
+    )
+    config = provider.config
+
+    assert config.routes[("product", "12")] == (0, "partner-collective")
+    assert config.slugs == {
+        "my-collective",
+        "partner-collective",
+        "day-two",
+        "box-office",
+    }
+    assert config.route([(12, 3)], "web") == {"partner-collective"}
+    assert config.route([(5, 3)], "box_office") == {"day-two"}
+    assert config.route([(5, None)], "box_office") == {"box-office"}
+    assert config.route([(5, None)], "web") == {"my-collective"}
+    assert config.route([(12, None), (5, None)]) == {
+        "partner-collective",
+        "my-collective",
+    }
+    assert config.account_slug("day-two") == "day-two"
+    assert config.account_slug("other") == "my-collective"
+
+
+def test_checkout_prepare_donates_to_routed_collective(monkeypatch):
+    cache_module.cache.clear()
+    monkeypatch.setattr(
+        payment_module, "build_absolute_uri", lambda event, url, kwargs=None: "/r/"
+    )
+    provider = build_provider(
+        {"collective_slug": "my-collective", "routing_rules": ROUTING_RULES}
+    )
+    request = SimpleNamespace(
+        event=provider.event,
+        resolver_match=None,
+        session={},
+        sales_channel=SimpleNamespace(identifier="web"),
+    )
+    workshop = SimpleNamespace(item_id=12, subevent_id=None)
+    ticket = SimpleNamespace(item_id=5, subevent_id=None)
+
+    routed = provider.checkout_prepare(
+        request, {"total": Decimal("10.00"), "positions": [workshop, workshop]}
+    )
+    default = provider.checkout_prepare(
+        request, {"total": Decimal("10.00"), "positions": [ticket]}
+    )
+    with pytest.raises(payment_module.PaymentException):
+        provider.checkout_prepare(
+            request, {"total": Decimal("10.00"), "positions": [workshop, ticket]}
+        )
+
+    assert routed.startswith("https://opencollective.com/partner-collective/donate/")
+    assert default.startswith("https://opencollective.com/my-collective/donate/")
+    assert request.session["payment_opencollective_expected"]["slug"] == (
+        "my-collective"
+    )
+    ticket_payment = SimpleNamespace(
+        amount=Decimal("10"),
+        order=SimpleNamespace(
+            event=provider.event,
+            positions=SimpleNamespace(values_list=lambda *fields: [(5, None)]),
+            sales_channel=SimpleNamespace(identifier="web"),
+        ),
+    )
+    order_data = {
+        "status": "PAID",
+        "totalAmount": {"value": 10, "currency": "USD"},
+        "toAccount": {"slug": "partner-collective"},
+    }
+    status = provider._validate_order(
+        ticket_payment, order_data, expected_slug="partner-collective"
+    )
+    assert status == "PAID"
+    # Another routed account is not accepted for a payment routed elsewhere.
+    with pytest.raises(payment_module.PaymentException):
+        provider._validate_order(ticket_payment, order_data)
+    with pytest.raises(payment_module.PaymentException):
+        provider._validate_order(
+            ticket_payment, order_data, expected_slug="my-collective"
+        )
+
+
+def test_settings_form_clean_rejects_invalid_routing_rules():
+    provider = build_provider({"collective_slug": "my-collective"})
+
+    with pytest.raises(payment_module.forms.ValidationError):
+        provider.settings_form_clean({"routing_rules": "product:12 = a\nitem:3 = b"})
+
+
 def test_format_amount_returns_major_units():
     provider = build_provider({"collective_slug": "my-collective"})
     assert provider._format_amount(Decimal("5.00"), "USD") == "5"
@@ -131,3 +303,448 @@ def test_payment_control_render_without_transaction_id():
     result = provider.payment_control_render(None, payment)
 
     assert "openTransactionId=" not in result
+
+
+def test_graphql_request_uses_pooled_session(monkeypatch):
+    cache_module.cache.clear()
+    provider = build_provider({"token": "secret", "use_staging": True})
+    calls = []
+
+    class ResponseStub:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"data": {"order": {"id": "ord_1"}}}
+
+    class SessionStub:
+        def request(self, method, url, **kwargs):
+            calls.append((method, url, kwargs["headers"]["Authorization"]))
+            return ResponseStub()
+
+    monkeypatch.setattr(client_module, "get_session", lambda url: SessionStub())
+
+    data = provider._graphql_request("query", {})
+
+    assert data == {"order": {"id": "ord_1"}}
+    assert calls == [
+        ("POST", "https://staging.opencollective.com/graphql/v2", "Bearer secret")
+    ]
+
+
+def test_graphql_post_sends_query_text_only_for_unknown_hashes(monkeypatch):
+    cache_module.cache.clear()
+    metrics.reset()
+    provider = build_provider({"token": "secret"})
+    bodies = []
+    known = set()
+
+    def send_graphql(endpoint, headers, body, log_errors=True):
+        bodies.append(sorted(body))
+        query_hash = body["extensions"]["persistedQuery"]["sha256Hash"]
+        if "query" in body:
+            known.add(query_hash)
+        elif query_hash not in known:
+            return {"errors": [{"message": "PersistedQueryNotFound"}]}
+        return {"data": {"order": {"id": "ord_1"}}}
+
+    monkeypatch.setattr(provider, "_send_graphql", send_graphql)
+
+    provider._graphql_post(payment_module.ORDER_QUERY, {})
+    provider._graphql_post(payment_module.ORDER_QUERY, {})
+
+    assert bodies == [
+        ["extensions", "variables"],
+        ["extensions", "query", "variables"],
+        ["extensions", "variables"],
+    ]
+    assert metrics.counters() == {"persisted_query_miss": 1, "persisted_query_hit": 1}
+
+
+def test_graphql_post_stops_persisting_when_unsupported(monkeypatch):
+    cache_module.cache.clear()
+    provider = build_provider({"token": "secret"})
+    bodies = []
+
+    def send_graphql(endpoint, headers, body, log_errors=True):
+        bodies.append(sorted(body))
+        if "query" not in body:
+            error = {"extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}
+            return {"errors": [error]}
+        return {"data": {}}
+
+    monkeypatch.setattr(provider, "_send_graphql", send_graphql)
+
+    provider._graphql_post("query", {})
+    provider._graphql_post("query", {})
+
+    assert bodies == [
+        ["extensions", "variables"],
+        ["extensions", "query", "variables"],
+        ["query", "variables"],
+    ]
+
+
+def test_graphql_post_stops_persisting_after_unknown_rejections(monkeypatch):
+    provider = build_provider({"token": "secret"})
+    rejections = [
+        {"errors": [{"message": "Must provide query string."}]},
+        payment_module.PaymentException("failed"),
+    ]
+    for rejection in rejections:
+        cache_module.cache.clear()
+        bodies = []
+
+        def send_graphql(endpoint, headers, body, log_errors=True):
+            bodies.append(sorted(body))
+            if "query" in body:
+                return {"data": {}}
+            if isinstance(rejection, Exception):
+                cause = RuntimeError()
+                cause.response = SimpleNamespace(status_code=400, json=lambda: {})
+                raise rejection from cause
+            return rejection
+
+        monkeypatch.setattr(provider, "_send_graphql", send_graphql)
+
+        provider._graphql_post("query", {})
+        provider._graphql_post("query", {})
+
+        assert bodies == [
+            ["extensions", "variables"],
+            ["extensions", "query", "variables"],
+            ["query", "variables"],
+        ]
+
+
+def test_graphql_post_keeps_persisting_for_execution_errors(monkeypatch):
+    cache_module.cache.clear()
+    metrics.reset()
+    provider = build_provider({"token": "secret"})
+    bodies = []
+
+    def send_graphql(endpoint, headers, body, log_errors=True):
+        bodies.append(sorted(body))
+        return {"data": {"order": None}, "errors": [{"message": "Not found"}]}
+
+    monkeypatch.setattr(provider, "_send_graphql", send_graphql)
+
+    provider._graphql_post("query", {})
+
+    assert bodies == [["extensions", "variables"]]
+    assert metrics.counters() == {"persisted_query_hit": 1}
+
+
+def test_fetch_order_by_reference_uses_cache(monkeypatch):
+    cache_module.cache.clear()
+    metrics.reset()
+    provider = build_provider({"token": "secret"})
+    calls = []
+
+    def graphql_request(query, variables):
+        calls.append(variables)
+        return {"order": {"id": "ord_1", "legacyId": 42, "status": "PAID"}}
+
+    monkeypatch.setattr(provider, "_graphql_request", graphql_request)
+
+    first = provider._fetch_order_by_reference({"id": "ord_1"})
+    second = provider._fetch_order_by_reference({"id": "ord_1"})
+    by_legacy_id = provider._fetch_order_by_reference({"legacyId": 42})
+
+    assert first == second == by_legacy_id
+    assert len(calls) == 1
+    assert metrics.counters() == {"order_cache_miss": 1, "order_cache_hit": 2}
+
+
+def test_refresh_order_by_reference_bypasses_cached_order(monkeypatch):
+    cache_module.cache.clear()
+    provider = build_provider({"token": "secret"})
+    statuses = ["PENDING", "PAID"]
+
+    def graphql_request(query, variables):
+        return {"order": {"id": "ord_1", "status": statuses.pop(0)}}
+
+    monkeypatch.setattr(provider, "_graphql_request", graphql_request)
+
+    provider._fetch_order_by_reference({"id": "ord_1"})
+    refreshed = provider._refresh_order_by_reference({"id": "ord_1"})
+
+    assert refreshed["status"] == "PAID"
+    assert provider._fetch_order_by_reference({"id": "ord_1"})["status"] == "PAID"
+
+
+def test_fetch_orders_batches_and_maps_partial_errors(monkeypatch):
+    cache_module.cache.clear()
+    provider = build_provider({"token": "secret"})
+    documents = []
+
+    def graphql_post(query, variables):
+        documents.append(sorted(variables))
+        data = {alias: None for alias in variables}
+        if "o0" in variables and variables["o0"] == {"legacyId": 1}:
+            data["o0"] = {"id": "ord_1", "legacyId": 1, "status": "PAID"}
+        if variables.get("o1") == {"id": "ord_2"}:
+            data["o1"] = {"id": "ord_2", "status": "PENDING"}
+        return {
+            "data": data,
+            "errors": (
+                [{"message": "Not found", "path": ["o0"]}]
+                if variables["o0"] == {"legacyId": 3}
+                else []
+            ),
+        }
+
+    monkeypatch.setattr(provider, "_graphql_post", graphql_post)
+
+    orders = provider.fetch_orders([1, "ord_2", 3], batch_size=2)
+
+    assert documents == [["o0", "o1"], ["o0"]]
+    assert orders == {
+        1: {"id": "ord_1", "legacyId": 1, "status": "PAID"},
+        "ord_2": {"id": "ord_2", "status": "PENDING"},
+    }
+    assert provider.fetch_orders([1]) == {1: orders[1]}
+    assert len(documents) == 2
+
+
+def test_fetch_orders_splits_rejected_batches(monkeypatch):
+    cache_module.cache.clear()
+    provider = build_provider({"token": "secret"})
+    sizes = []
+
+    def graphql_post(query, variables):
+        sizes.append(len(variables))
+        if len(variables) > 1:
+            cause = payment_module.RequestException(
+                response=SimpleNamespace(status_code=413)
+            )
+            raise payment_module.PaymentException("too large") from cause
+        reference = variables["o0"]
+        return {"data": {"o0": {"id": reference["id"], "status": "PAID"}}}
+
+    monkeypatch.setattr(provider, "_graphql_post", graphql_post)
+
+    orders = provider.fetch_orders(["a", "b", "c"])
+
+    assert sorted(orders) == ["a", "b", "c"]
+    assert sizes == [3, 1, 2, 1, 1]
+
+
+def test_fetch_order_by_transaction_resolves_both_ids_in_one_request(monkeypatch):
+    cache_module.cache.clear()
+    metrics.reset()
+    provider = build_provider({"token": "secret"})
+    documents = []
+
+    def graphql_post(query, variables):
+        documents.append(variables)
+        return {
+            "data": {
+                "byId": None,
+                "byLegacyId": {"order": {"legacyId": 7, "status": "PAID"}},
+            },
+            "errors": [{"message": "Transaction not found", "path": ["byId"]}],
+        }
+
+    monkeypatch.setattr(provider, "_graphql_post", graphql_post)
+    monkeypatch.setattr(
+        provider,
+        "_fetch_order_via_legacy",
+        lambda transaction_id: pytest.fail("legacy API must not be called"),
+    )
+
+    order_data = provider._fetch_order_by_transaction("11503420")
+
+    assert order_data == {"legacyId": 7, "status": "PAID"}
+    assert documents == [
+        {"byId": {"id": "11503420"}, "byLegacyId": {"legacyId": 11503420}}
+    ]
+    assert metrics.counters()["transaction_lookup_legacy_id"] == 1
+
+
+def test_fetch_order_by_transaction_falls_back_to_legacy_api(monkeypatch):
+    cache_module.cache.clear()
+    metrics.reset()
+    provider = build_provider({"token": "secret"})
+    monkeypatch.setattr(
+        provider, "_graphql_post", lambda query, variables: {"data": {"byId": None}}
+    )
+    monkeypatch.setattr(
+        provider,
+        "_fetch_order_via_legacy",
+        lambda transaction_id: {"legacyId": None, "status": "PAID"},
+    )
+
+    order_data = provider._fetch_order_by_transaction("tx_abc")
+
+    assert order_data == {"legacyId": None, "status": "PAID"}
+    assert metrics.counters()["transaction_lookup_legacy_api"] == 1
+
+
+def test_legacy_lookup_reports_an_open_circuit_as_unavailable(monkeypatch):
+    provider = build_provider({"collective_slug": "collective", "token": "secret"})
+
+    def send_request(method, url, **kwargs):
+        raise client_module.CircuitOpenError("open")
+
+    monkeypatch.setattr(payment_module, "send_request", send_request)
+
+    with pytest.raises(payment_module.PaymentException) as excinfo:
+        provider._fetch_order_via_legacy("tx_abc")
+
+    assert "currently unavailable" in str(excinfo.value)
+
+
+class PaymentStub:
+    def __init__(self, amount="10.00", currency="USD"):
+        self.pk = self.id = 1
+        self.amount = Decimal(amount)
+        self.state = "created"
+        self.info = None
+        self.order = SimpleNamespace(event=SimpleNamespace(currency=currency))
+        self.saves = []
+        self.confirmations = 0
+
+    @property
+    def info_data(self):
+        return json.loads(self.info) if self.info else {}
+
+    def refresh_from_db(self):
+        pass
+
+    def save(self, update_fields=None):
+        self.saves.append(update_fields)
+
+    def confirm(self):
+        self.confirmations += 1
+        self.state = "confirmed"
+
+
+def install_locking_manager(monkeypatch, claimed=False):
+    locked = []
+    monkeypatch.setattr(
+        payment_module,
+        "order_claimed_elsewhere",
+        lambda payment, order_data: claimed,
+    )
+
+    class QuerySetStub:
+        def select_for_update(self):
+            return self
+
+        def only(self, *fields):
+            return self
+
+        def get(self, pk):
+            locked.append(pk)
+
+    monkeypatch.setattr(
+        payment_module.OrderPayment, "objects", QuerySetStub(), raising=False
+    )
+    return locked
+
+
+def test_apply_order_data_is_idempotent(monkeypatch):
+    locked = install_locking_manager(monkeypatch)
+    indexed = []
+    monkeypatch.setattr(payment_module, "index_payment", indexed.append)
+    summarized = []
+    monkeypatch.setattr(
+        payment_module,
+        "summarize_payment",
+        lambda payment, order_data=None, rejection=None: summarized.append(payment),
+    )
+    provider = build_provider({"collective_slug": "my-collective"})
+    payment = PaymentStub()
+    order_data = {
+        "legacyId": 919699,
+        "status": "PAID",
+        "frequency": "ONETIME",
+        "totalAmount": {"value": 10, "currency": "USD"},
+        "toAccount": {"slug": "my-collective"},
+    }
+
+    assert provider.apply_order_data(payment, order_data) == "PAID"
+    assert provider.apply_order_data(payment, order_data) == "PAID"
+
+    assert locked == [1, 1]
+    assert payment.confirmations == 1
+    assert payment.saves == [["info"]]
+    assert indexed == [payment]
+    assert summarized == [payment]
+    assert payment.info_data["idempotency_key"] == "919699:PAID"
+
+
+def test_apply_order_data_rejects_orders_of_other_payments(monkeypatch):
+    metrics.reset()
+    install_locking_manager(monkeypatch, claimed=True)
+    monkeypatch.setattr(
+        payment_module,
+        "index_payment",
+        lambda payment: pytest.fail("payment must not be indexed"),
+    )
+    summarized = []
+    monkeypatch.setattr(
+        payment_module,
+        "summarize_payment",
+        lambda payment, order_data=None, rejection=None: summarized.append(rejection),
+    )
+    provider = build_provider({"collective_slug": "my-collective"})
+    payment = PaymentStub()
+    order_data = {
+        "legacyId": 919699,
+        "status": "PAID",
+        "frequency": "ONETIME",
+        "totalAmount": {"value": 10, "currency": "USD"},
+        "toAccount": {"slug": "my-collective"},
+    }
+
+    with pytest.raises(payment_module.PaymentException) as excinfo:
+        provider.apply_order_data(payment, order_data)
+
+    assert excinfo.value.reason == "reused"
+    assert payment.state == "created"
+    assert summarized == ["reused"]
+
+
+def test_apply_order_data_records_outcomes(monkeypatch):
+    install_locking_manager(monkeypatch)
+    monkeypatch.setattr(payment_module, "index_payment", lambda payment: None)
+    monkeypatch.setattr(
+        payment_module, "summarize_payment", lambda payment, *args, **kwargs: None
+    )
+    metrics.reset()
+    provider = build_provider({"collective_slug": "my-collective"})
+    order_data = {
+        "legacyId": 919699,
+        "status": "PAID",
+        "frequency": "ONETIME",
+        "totalAmount": {"value": 12, "currency": "USD"},
+        "toAccount": {"slug": "my-collective"},
+    }
+
+    with pytest.raises(payment_module.PaymentException):
+        provider.apply_order_data(PaymentStub(), order_data)
+    order_data["totalAmount"]["value"] = 10
+    provider.apply_order_data(PaymentStub(), order_data)
+
+    text = metrics.render_prometheus()
+    assert 'payment_outcomes_total{outcome="rejected",reason="amount"} 1' in text
+    assert 'payment_outcomes_total{outcome="confirmed",reason="paid"} 1' in text
+
+
+def test_execute_payment_coalesces_per_order_state(monkeypatch):
+    keys = []
+    monkeypatch.setattr(
+        payment_module, "single_flight", lambda key, func: keys.append(key) or "PAID"
+    )
+    provider = build_provider({"collective_slug": "my-collective"})
+    request = SimpleNamespace(
+        session={"payment_opencollective_order": {"legacyId": 7, "status": "PAID"}}
+    )
+
+    provider.execute_payment(request, PaymentStub())
+    request.session["payment_opencollective_order"] = {"id": "ord_8", "status": "NEW"}
+    provider.execute_payment(request, PaymentStub())
+
+    assert keys == ["payment:1:7:PAID", "payment:1:ord_8:NEW"]
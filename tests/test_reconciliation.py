@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import conf as conf_module
+from pretix_opencollective_payment import reconciliation as reconciliation_module
+
+
+class QuerySetStub(list):
+    def iterator(self):
+        return iter(self)
+
+
+def build_payment(pk, order_id, state="pending", status=None):
+    return SimpleNamespace(
+        pk=pk,
+        state=state,
+        info_data={"order_id": order_id, "status": status},
+        order=SimpleNamespace(event=SimpleNamespace(pk=1)),
+    )
+
+
+def test_order_reference_prefers_legacy_id():
+    assert reconciliation_module.order_reference(919699) == {"legacyId": 919699}
+    assert reconciliation_module.order_reference("ord_1") == {"id": "ord_1"}
+    assert reconciliation_module.order_reference(None) is None
+
+
+def test_reconcile_pending_payments_confirms_and_fails(monkeypatch):
+    payments = QuerySetStub(
+        [build_payment(1, 10), build_payment(2, 20), build_payment(3, None)]
+    )
+    statuses = {10: "PAID", 20: "EXPIRED"}
+    applied = []
+
+    def fetch_orders(self, order_ids, status_only=False):
+        return {order_id: {"status": statuses[order_id]} for order_id in order_ids}
+
+    def apply_order_data(self, payment, order_data, redirect_data=None):
+        applied.append((payment.pk, redirect_data))
+        if order_data["status"] == "EXPIRED":
+            payment.state = "failed"
+            raise reconciliation_module.PaymentException("failed")
+        return order_data["status"]
+
+    provider_cls = reconciliation_module.OpenCollectivePaymentProvider
+    monkeypatch.setattr(provider_cls, "fetch_orders", fetch_orders)
+    monkeypatch.setattr(provider_cls, "apply_order_data", apply_order_data)
+    monkeypatch.setattr(
+        reconciliation_module, "pending_payments", lambda cutoff: payments
+    )
+    monkeypatch.setattr(
+        conf_module.settings,
+        "OPENCOLLECTIVE_RECONCILE_CALL_INTERVAL",
+        0,
+        raising=False,
+    )
+
+    result = reconciliation_module.reconcile_pending_payments()
+
+    assert applied == [(1, None), (2, None)]
+    assert result["scanned"] == 2
+    assert result["confirmed"] == 1
+    assert result["failed"] == 1
+    assert result["errors"] == 0
+
+
+def test_reconcile_only_loads_orders_whose_status_changed(monkeypatch):
+    payments = QuerySetStub(
+        [build_payment(1, 10, status="PENDING"), build_payment(2, 20, status="PENDING")]
+    )
+    statuses = {10: "PENDING", 20: "PAID"}
+    requests = []
+
+    def fetch_orders(self, order_ids, status_only=False):
+        requests.append((list(order_ids), status_only))
+        return {order_id: {"status": statuses[order_id]} for order_id in order_ids}
+
+    def apply_order_data(self, payment, order_data, redirect_data=None):
+        return order_data["status"]
+
+    provider_cls = reconciliation_module.OpenCollectivePaymentProvider
+    monkeypatch.setattr(provider_cls, "fetch_orders", fetch_orders)
+    monkeypatch.setattr(provider_cls, "apply_order_data", apply_order_data)
+    monkeypatch.setattr(
+        reconciliation_module, "pending_payments", lambda cutoff: payments
+    )
+    monkeypatch.setattr(
+        conf_module.settings,
+        "OPENCOLLECTIVE_RECONCILE_CALL_INTERVAL",
+        0,
+        raising=False,
+    )
+
+    result = reconciliation_module.reconcile_pending_payments()
+
+    assert requests == [([10, 20], True), ([20], False)]
+    assert result["pending"] == 1
+    assert result["confirmed"] == 1
@@ -0,0 +1,159 @@
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import refunds as refunds_module
+
+EVENT = SimpleNamespace(pk=1, currency="USD")
+
+
+class QuerySetStub:
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+
+    def filter(self, **kwargs):
+        self.calls.append(kwargs)
+        return self
+
+    def exclude(self, **kwargs):
+        return self
+
+    def select_related(self, *fields):
+        return self
+
+    def values_list(self, *fields):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class PaymentStub:
+    def __init__(self, pk, amount="10.00"):
+        self.pk = pk
+        self.amount = Decimal(amount)
+        self.refunds = []
+
+    def create_external_refund(self, amount=None, execution_date=None, info="{}"):
+        self.refunds.append((amount, execution_date, json.loads(info)))
+
+
+def build_refund(refund_id, original_legacy_id, value=-10, currency="USD"):
+    return {
+        "id": refund_id,
+        "legacyId": 900,
+        "createdAt": "2026-02-01T10:00:00+00:00",
+        "amount": {"value": value, "currency": currency},
+        "refundTransaction": {"id": f"tx_{original_legacy_id}", "legacyId": None},
+    }
+
+
+def test_match_refunds_resolves_payments_in_one_query(monkeypatch):
+    calls = []
+    payment = PaymentStub(1)
+    monkeypatch.setattr(
+        refunds_module.ReferencedOpenCollectiveObject,
+        "objects",
+        QuerySetStub(
+            [
+                SimpleNamespace(reference="tx_1", payment=payment),
+                SimpleNamespace(reference="tx_1", payment=payment),
+            ],
+            calls,
+        ),
+        raising=False,
+    )
+    refunds = [build_refund("r1", 1), build_refund("r2", 2)]
+
+    matches = refunds_module.match_refunds(EVENT, refunds)
+
+    assert matches == [(payment, refunds[0])]
+    assert len(calls) == 1
+    assert sorted(calls[0]["reference__in"]) == ["tx_1", "tx_2"]
+    assert calls[0]["payment__order__event"] is EVENT
+    assert refunds_module.match_refunds(EVENT, [{"id": "r3"}]) == []
+
+
+def test_apply_refunds_creates_each_external_refund_once(monkeypatch):
+    synced = SimpleNamespace(pk=2, amount=Decimal("10.00"))
+    existing = [
+        (
+            2,
+            "opencollective",
+            Decimal("10.00"),
+            json.dumps({"refund_transaction_id": "r2"}),
+        ),
+        (3, "manual", Decimal("10.00"), "{}"),
+    ]
+    monkeypatch.setattr(
+        refunds_module.OrderRefund,
+        "objects",
+        QuerySetStub(existing, []),
+        raising=False,
+    )
+    fresh, by_hand, foreign = PaymentStub(1), PaymentStub(3), PaymentStub(4)
+    result = {"refunds": 0, "skipped": 0, "errors": 0}
+
+    refunds_module.apply_refunds(
+        EVENT,
+        [
+            (fresh, build_refund("r1", 1, value=-4)),
+            (fresh, build_refund("r1", 1, value=-4)),
+            (synced, build_refund("r2", 2)),
+            (by_hand, build_refund("r3", 3)),
+            (foreign, build_refund("r4", 4, currency="EUR")),
+        ],
+        result,
+    )
+
+    assert result == {"refunds": 1, "skipped": 3, "errors": 1}
+    assert [refund[0] for refund in fresh.refunds] == [Decimal("4")]
+    assert fresh.refunds[0][2]["refund_transaction_id"] == "r1"
+    assert by_hand.refunds == foreign.refunds == []
+
+
+def test_sync_event_refunds_pages_refunds_and_keeps_own_high_water_mark(
+    monkeypatch,
+):
+    class SettingsStub(dict):
+        def get(self, key, as_type=None):
+            return super().get(key)
+
+        def set(self, key, value):
+            self[key] = value
+
+    queries = []
+
+    class ProviderStub:
+        event = EVENT
+        settings = SettingsStub()
+        config = SimpleNamespace(slugs=frozenset({"my-collective"}))
+
+        def _graphql_request(self, query, variables):
+            queries.append((query, variables["offset"]))
+            nodes = [build_refund("r1", 1), build_refund("r2", 2)]
+            nodes = nodes[variables["offset"] : variables["offset"] + 1]
+            return {"transactions": {"totalCount": 2, "nodes": nodes}}
+
+    batches = []
+    monkeypatch.setattr(refunds_module, "match_refunds", lambda event, refunds: refunds)
+    monkeypatch.setattr(
+        refunds_module,
+        "apply_refunds",
+        lambda event, matches, result: batches.append([m["id"] for m in matches]),
+    )
+    provider = ProviderStub()
+
+    refunds_module.sync_event_refunds(provider, None, {}, page_size=1)
+
+    assert batches == [["r1"], ["r2"]]
+    assert {query for query, _ in queries} == {refunds_module.REFUND_QUERY}
+    assert provider.settings == {
+        "refund_sync": {
+            "my-collective": {
+                "created_at": "2026-02-01T10:00:00+00:00",
+                "ids": ["r1", "r2"],
+            }
+        }
+    }
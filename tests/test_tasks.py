@@ -0,0 +1,38 @@
+from pretix_opencollective_payment import cache as cache_module
+from pretix_opencollective_payment import tasks as tasks_module
+
+
+def test_verify_callback_stores_order_data(monkeypatch):
+    monkeypatch.setattr(
+        tasks_module.OpenCollectivePaymentProvider,
+        "fetch_order_data",
+        lambda self, redirect_data: {"id": redirect_data["orderIdV2"]},
+    )
+
+    tasks_module.verify_callback.apply_async(
+        kwargs={"event": 1, "token": "tok", "redirect_data": {"orderIdV2": "ord_1"}}
+    )
+
+    state = cache_module.get_verification_state("tok")
+    assert state["state"] == "done"
+    assert state["status"] is None
+    assert state["order"]["id"] == "ord_1"
+    assert state["order"]["transactions"] == []
+
+
+def test_verify_callback_stores_payment_errors(monkeypatch):
+    def fetch_order_data(self, redirect_data):
+        raise tasks_module.PaymentException("Open Collective order could not be found.")
+
+    monkeypatch.setattr(
+        tasks_module.OpenCollectivePaymentProvider, "fetch_order_data", fetch_order_data
+    )
+
+    tasks_module.verify_callback.apply_async(
+        kwargs={"event": 1, "token": "tok", "redirect_data": {"orderIdV2": "ord_1"}}
+    )
+
+    assert cache_module.get_verification_state("tok") == {
+        "state": "error",
+        "message": "Open Collective order could not be found.",
+    }
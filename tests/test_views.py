@@ -1,6 +1,16 @@
+import base64
 from types import SimpleNamespace
 
 from pretix_opencollective_payment import views as views_module
+from pretix_opencollective_payment.config import ProviderConfig
+
+
+class SettingsStub:
+    def __init__(self, values):
+        self._values = values
+
+    def get(self, key, as_type=None):
+        return self._values.get(key)
 
 
 def test_return_view_requires_order_reference(monkeypatch):
@@ -31,6 +41,7 @@ def test_return_view_passes_redirect_data(monkeypatch):
     class ProviderStub:
         def __init__(self, event):
             self.event = event
+            self.config = ProviderConfig.from_settings(SettingsStub({}))
 
         def handle_callback(self, request, redirect_data):
             captured["request"] = request
@@ -49,3 +60,112 @@ def test_return_view_passes_redirect_data(monkeypatch):
         "status": "PAID",
         "transactionid": None,
     }
+
+
+class AsyncProviderStub:
+    def __init__(self, event):
+        self.event = event
+        self.config = ProviderConfig.from_settings(
+            SettingsStub({"async_verification": True})
+        )
+
+    def finish_verification(self, request, state):
+        return ("finished", state)
+
+
+def test_return_view_enqueues_verification_in_async_mode(monkeypatch):
+    request = SimpleNamespace(
+        event=SimpleNamespace(pk=7),
+        GET={"orderIdV2": "ord_123", "status": "PAID"},
+        session={"payment_opencollective_payment": 5},
+    )
+    queued = []
+    monkeypatch.setattr(
+        views_module, "OpenCollectivePaymentProvider", AsyncProviderStub
+    )
+    monkeypatch.setattr(
+        views_module.verify_callback,
+        "apply_async",
+        lambda kwargs: queued.append(kwargs),
+    )
+    monkeypatch.setattr(
+        views_module, "eventreverse", lambda *args, **kwargs: "/status/"
+    )
+
+    result = views_module.return_view(request)
+
+    token = request.session["payment_opencollective_verification"]
+    assert result == (
+        "pretixplugins/opencollective/verifying.html",
+        {"event": request.event, "status_url": "/status/"},
+    )
+    assert views_module.get_verification_state(token) == {"state": "queued"}
+    assert queued == [
+        {
+            "event": 7,
+            "token": token,
+            "redirect_data": {
+                "orderId": None,
+                "orderIdV2": "ord_123",
+                "status": "PAID",
+                "transactionid": None,
+            },
+            "payment_id": 5,
+        }
+    ]
+
+
+def test_status_view_keeps_polling_until_verification_finished(monkeypatch):
+    request = SimpleNamespace(
+        event=SimpleNamespace(pk=7),
+        session={"payment_opencollective_verification": "tok"},
+    )
+    monkeypatch.setattr(
+        views_module, "OpenCollectivePaymentProvider", AsyncProviderStub
+    )
+    monkeypatch.setattr(
+        views_module, "eventreverse", lambda *args, **kwargs: "/status/"
+    )
+
+    views_module.set_verification_state("tok", {"state": "queued"})
+    waiting = views_module.status_view(request)
+    views_module.set_verification_state("tok", {"state": "done", "order": {}})
+    finished = views_module.status_view(request)
+
+    assert waiting[0] == "pretixplugins/opencollective/verifying.html"
+    assert finished == ("finished", {"state": "done", "order": {}})
+    assert "payment_opencollective_verification" not in request.session
+
+
+def test_metrics_view_requires_staff_session_or_metrics_credentials(monkeypatch):
+    monkeypatch.setattr(views_module.settings, "METRICS_USER", "prom", raising=False)
+    monkeypatch.setattr(
+        views_module.settings, "METRICS_PASSPHRASE", "s3cret", raising=False
+    )
+    anonymous = SimpleNamespace(
+        user=SimpleNamespace(is_authenticated=False),
+        session=SimpleNamespace(session_key="k"),
+        META={"HTTP_AUTHORIZATION": "Basic " + base64.b64encode(b"prom:x").decode()},
+    )
+    scraper = SimpleNamespace(
+        META={
+            "HTTP_AUTHORIZATION": "Basic " + base64.b64encode(b"prom:s3cret").decode()
+        },
+    )
+    staff = SimpleNamespace(
+        user=SimpleNamespace(
+            is_authenticated=True,
+            has_active_staff_session=lambda session_key: session_key == "k",
+        ),
+        session=SimpleNamespace(session_key="k"),
+        META={},
+    )
+
+    denied = views_module.metrics_view(anonymous)
+
+    assert denied.status_code == 401
+    assert denied["WWW-Authenticate"].startswith("Basic")
+    assert views_module.metrics_view(scraper).status_code == 200
+    response = views_module.metrics_view(staff)
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
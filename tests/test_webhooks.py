@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+from pretix_opencollective_payment import cache as cache_module
+from pretix_opencollective_payment import webhooks as webhooks_module
+
+
+class SettingsStub:
+    def __init__(self, values):
+        self._values = values
+
+    def get(self, key, as_type=None):
+        return self._values.get(key)
+
+
+def build_payment(pk=1, order_id=919699):
+    return SimpleNamespace(
+        pk=pk,
+        info_data={"order_id": order_id},
+        order=SimpleNamespace(event_id=1, event=SimpleNamespace(pk=1)),
+    )
+
+
+def install_provider(monkeypatch, applied):
+    provider_cls = webhooks_module.OpenCollectivePaymentProvider
+
+    def init(self, event):
+        self.event = event
+        self.settings = SettingsStub({"webhook_secret": "s3cret"})
+
+    monkeypatch.setattr(provider_cls, "__init__", init)
+    monkeypatch.setattr(
+        provider_cls,
+        "_refresh_order_by_reference",
+        lambda self, reference: {"legacyId": reference["legacyId"], "status": "PAID"},
+    )
+    monkeypatch.setattr(
+        provider_cls,
+        "apply_order_data",
+        lambda self, payment, order_data, redirect_data=None: applied.append(
+            (payment.pk, order_data["status"], redirect_data)
+        ),
+    )
+
+
+def test_webhook_order_id_reads_order_and_transaction_payloads():
+    assert webhooks_module.webhook_order_id({"data": {"order": {"id": 5}}}) == 5
+    assert (
+        webhooks_module.webhook_order_id({"data": {"transaction": {"OrderId": 6}}}) == 6
+    )
+    assert webhooks_module.webhook_order_id({"type": "member.created"}) is None
+
+
+def test_process_webhook_refetches_order_and_deduplicates(monkeypatch):
+    cache_module.cache.clear()
+    applied = []
+    install_provider(monkeypatch, applied)
+    monkeypatch.setattr(
+        webhooks_module,
+        "webhook_payments",
+        lambda order_id, organizer, event=None: [build_payment(order_id=order_id)],
+    )
+    payload = {"id": 77, "type": "order.processed", "data": {"order": {"id": 919699}}}
+    organizer = SimpleNamespace(pk=1)
+
+    first = webhooks_module.process_webhook(payload, "s3cret", organizer)
+    second = webhooks_module.process_webhook(payload, "s3cret", organizer)
+
+    assert first == (200, "OK")
+    assert second == (200, "Duplicate event")
+    assert applied == [(1, "PAID", None)]
+
+
+def test_process_webhook_ignores_wrong_secret(monkeypatch):
+    cache_module.cache.clear()
+    applied = []
+    install_provider(monkeypatch, applied)
+    monkeypatch.setattr(
+        webhooks_module,
+        "webhook_payments",
+        lambda order_id, organizer, event=None: [build_payment(order_id=order_id)],
+    )
+    payload = {"id": 78, "data": {"order": {"id": 919699}}}
+
+    result = webhooks_module.process_webhook(payload, "wrong", SimpleNamespace(pk=1))
+
+    assert result == (200, "No matching payment")
+    assert applied == []